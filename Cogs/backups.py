@@ -0,0 +1,129 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+import datetime
+import os
+import re
+import tempfile
+from utils import snapshots, config, bulk
+from utils.checks import is_owner
+
+class BackupsCog(commands.Cog, name="Backups"):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    def target_guild(self, interaction: discord.Interaction, guild_id: str):
+        """The given guild, else the current one; None if neither, or if guild_id isn't an ID (it ends up in paths)"""
+        if not guild_id:
+            return interaction.guild_id
+        return guild_id if re.fullmatch(r"[0-9]{1,20}", guild_id) else None
+
+    @app_commands.command(name="snapshot", description="List or take database snapshots (owner only)")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="List", value="list"),
+        app_commands.Choice(name="Take Now", value="take")
+    ])
+    @is_owner()
+    async def snapshot_slash(self, interaction: discord.Interaction, action: app_commands.Choice[str], guild_id: str = None):
+        guild_id = self.target_guild(interaction, guild_id)
+        if guild_id is None:
+            await interaction.response.send_message("Give a server's numeric ID as guild_id, or use this in the server.", ephemeral=True)
+            return
+
+        if action.value == "take":
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            path = await snapshots.snapshot(guild_id, config.get().section("snapshots").get("compression", "gzip"))
+            await interaction.followup.send(
+                "Snapshot taken." if path else "Nothing changed since the last snapshot.",
+                ephemeral=True
+            )
+            return
+
+        taken = [taken for taken, _ in snapshots.manifests(guild_id)]
+        if not taken:
+            await interaction.response.send_message("No snapshots yet.", ephemeral=True)
+            return
+        lines = [moment.strftime("%Y-%m-%d %H:%M:%S") for moment in reversed(taken[-20:])]
+        await interaction.response.send_message(
+            f"{len(taken)} snapshots, newest first:\n" + "\n".join(lines),
+            ephemeral=True
+        )
+
+    @app_commands.command(name="restore", description="Restore the database to a point in time (owner only)")
+    @app_commands.describe(timestamp="Local time, e.g. 2024-05-01 18:30; the newest snapshot at or before it is used")
+    @is_owner()
+    async def restore_slash(self, interaction: discord.Interaction, timestamp: str, guild_id: str = None):
+        guild_id = self.target_guild(interaction, guild_id)
+        if guild_id is None:
+            await interaction.response.send_message("Give a server's numeric ID as guild_id, or use this in the server.", ephemeral=True)
+            return
+        try:
+            at = datetime.datetime.fromisoformat(timestamp)
+        except ValueError:
+            await interaction.response.send_message("Invalid timestamp! Use e.g. 2024-05-01 18:30", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        taken = await snapshots.restore(guild_id, at, config.get().section("snapshots").get("compression", "gzip"))
+        if taken is None:
+            await interaction.followup.send("No snapshot exists at or before that time.", ephemeral=True)
+            return
+        await interaction.followup.send(
+            f"Restored the snapshot taken {taken.strftime('%Y-%m-%d %H:%M:%S')}. "
+            f"The state before the restore was snapshotted, so it can be restored again.",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="export", description="Export users, missions, duty sessions or roles as a file (owner only)")
+    @app_commands.choices(
+        kind=[app_commands.Choice(name=kind.title(), value=kind) for kind in bulk.KINDS],
+        format=[app_commands.Choice(name=fmt.upper(), value=fmt) for fmt in bulk.FORMATS]
+    )
+    @is_owner()
+    async def export_slash(self, interaction: discord.Interaction, kind: app_commands.Choice[str], format: app_commands.Choice[str], guild_id: str = None):
+        guild_id = self.target_guild(interaction, guild_id)
+        if guild_id is None:
+            await interaction.response.send_message("Give a server's numeric ID as guild_id, or use this in the server.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        limit = interaction.guild.filesize_limit if interaction.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+        path = await bulk.export_file(guild_id, kind.value, format.value)
+        try:
+            if os.path.getsize(path) > limit:
+                # Exports are repetitive text and usually shrink a lot
+                os.remove(path)
+                path = await bulk.export_file(guild_id, kind.value, format.value, compress=True)
+            if os.path.getsize(path) > limit:
+                await interaction.followup.send(
+                    "The export is too large to upload even compressed. Use `python -m utils.bulk export` on the host.",
+                    ephemeral=True
+                )
+                return
+            filename = f"{kind.value}-{guild_id}.{format.value}" + (".gz" if path.endswith(".gz") else "")
+            await interaction.followup.send(file=discord.File(path, filename=filename), ephemeral=True)
+        finally:
+            os.remove(path)
+
+    @app_commands.command(name="import", description="Import users, missions, duty sessions or roles from a file (owner only)")
+    @app_commands.choices(kind=[app_commands.Choice(name=kind.title(), value=kind) for kind in bulk.KINDS])
+    @app_commands.describe(file="NDJSON or CSV as produced by /export, optionally .gz")
+    @is_owner()
+    async def import_slash(self, interaction: discord.Interaction, kind: app_commands.Choice[str], file: discord.Attachment, guild_id: str = None):
+        guild_id = self.target_guild(interaction, guild_id)
+        if guild_id is None:
+            await interaction.response.send_message("Give a server's numeric ID as guild_id, or use this in the server.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        handle, path = tempfile.mkstemp(suffix=".gz" if file.filename.endswith(".gz") else "")
+        os.close(handle)
+        try:
+            await file.save(path)
+            report = await bulk.import_file(guild_id, kind.value, path, bulk.detect_format(file.filename))
+        finally:
+            os.remove(path)
+        await interaction.followup.send(report.summary()[:2000], ephemeral=True)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(BackupsCog(bot))
@@ -1,111 +1,275 @@
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
-import json
+from utils import store, config, schema, metrics
+from utils.profiling import profiler
+from utils.gateway import owns_guild
+from utils.outbox import outbox, resolve_channel, LOG
+from utils.dm import dms
 import datetime
 import random
 import asyncio
+import logging
+
+log = logging.getLogger("bot.duty")
+
+# How long a user has to answer a check-in
+CHECK_IN_WINDOW = datetime.timedelta(minutes=5)
+# What starting, checking in and ending a session writes; saves name them so other sections aren't re-encoded
+SESSION_SECTIONS = ("duty_status", "users")
 
 class DutyCog(commands.Cog, name="Duty System"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.load_data()
-        self.check_duty_status.start()
+        self.check_duty_status.change_interval(minutes=config.get().duty_rewards.interval_minutes)
+        # (guild id, user id) -> code; an index of the check-ins stored in duty_status, rebuilt by recover()
         self.confirmation_codes = {}
+        self.expiry_task = None
+        config.config.subscribe(self.on_config_reload)
+
+    async def cog_load(self):
+        # Before the first sweep, so it sees which users are still waiting on a check-in
+        await self.recover()
+        self.check_duty_status.start()
+
+    async def cog_unload(self):
+        config.config.unsubscribe(self.on_config_reload)
+        self.check_duty_status.cancel()
+        if self.expiry_task:
+            self.expiry_task.cancel()
+
+    def on_config_reload(self, settings: config.Config):
+        minutes = settings.duty_rewards.interval_minutes
+        if self.check_duty_status.minutes != minutes:
+            self.check_duty_status.change_interval(minutes=minutes)
 
-    def load_data(self):
-        with open("data/database.json", "r") as f:
-            self.data = json.load(f)
-        if "duty_status" not in self.data:
-            self.data["duty_status"] = {}
-
-    def save_data(self):
-        with open("data/database.json", "w") as f:
-            json.dump(self.data, f, indent=4)
-
-    def calculate_duty_reward(self, user_id: str, duration_minutes: float) -> tuple[int, int]:
-        user_data = self.data["users"].get(str(user_id), {"level": 0})
-        base_reward = 10  # Base SC per 30 minutes
-        
-        # Level multipliers
-        level_multipliers = {
-            0: 1.0,  # Normal income
-            1: 1.5,  # 15 SC per 30 minutes
-            # Add more levels as needed
-        }
-        
-        multiplier = level_multipliers.get(user_data.get("level", 0), 1.0)
-        bonus_percent = self.data.get("bonus_income", {}).get(str(user_id), 0)
-        
-        base_amount = (base_reward * multiplier * duration_minutes) / 30
+    def load_data(self, guild_id) -> dict:
+        return store.load(guild_id)
+
+    def save_data(self, guild_id, *sections):
+        store.save(guild_id, *(sections or SESSION_SECTIONS))
+
+    def calculate_duty_reward(self, guild_id: str, user_id: str, duration_minutes: float) -> tuple[int, int]:
+        data = self.load_data(guild_id)
+        user_data = data["users"].get(str(user_id))
+        settings = config.get()
+        rewards = settings.duty_rewards  # Base SC and EXP per interval
+
+        multiplier = settings.reward_for_level(user_data["level"] if user_data else 0).duty_multiplier
+        bonus_percent = data.get("bonus_income", {}).get(str(user_id), 0)
+
+        intervals = duration_minutes / rewards.interval_minutes
+        base_amount = rewards.base_sc * multiplier * intervals
         bonus_amount = base_amount * (bonus_percent / 100)
-        
-        return int(base_amount + bonus_amount), int(base_amount * 0.5)  # SC and EXP
+
+        return int(base_amount + bonus_amount), int(rewards.base_exp * multiplier * intervals)  # SC and EXP
+
+    async def recover(self):
+        """Rebuild pending check-ins from duty_status in one scan, ending the sessions that missed a check-in while the bot was down"""
+        now = datetime.datetime.now()
+        interval = datetime.timedelta(minutes=config.get().duty_rewards.interval_minutes)
+        pending = expired = 0
+        latest = None
+        with metrics.timer("duty_recovery_seconds"):
+            for guild_id in store.guild_ids():
+                if not owns_guild(self.bot, guild_id):
+                    continue
+                data = self.load_data(guild_id)
+                changed = False
+                for user_id, status in list(data["duty_status"].items()):
+                    if not status["active"]:
+                        continue
+                    if status["check_code"] is None:
+                        # A check-in came due during the downtime and nobody was asked: paid up to when it was due
+                        due = self.last_check_in(status) + interval
+                        if due + CHECK_IN_WINDOW <= now:
+                            self.end_session(guild_id, user_id, due)
+                            changed = True
+                            expired += 1
+                        continue
+                    deadline = datetime.datetime.fromisoformat(status["check_deadline"])
+                    if deadline <= now:
+                        self.end_session(guild_id, user_id, self.last_check_in(status))
+                        changed = True
+                        expired += 1
+                    else:
+                        self.confirmation_codes[(guild_id, user_id)] = status["check_code"]
+                        latest = max(latest or deadline, deadline)
+                        pending += 1
+                if changed:
+                    self.save_data(guild_id)
+        if latest:
+            self.expiry_task = asyncio.get_running_loop().create_task(self.expire_after((latest - now).total_seconds()))
+        if pending or expired:
+            log.info("Recovered %d pending duty check-ins, ended %d that missed a check-in during downtime", pending, expired)
+
+    async def expire_after(self, seconds: float):
+        await asyncio.sleep(seconds)
+        await self.expire_overdue()
 
     @tasks.loop(minutes=30)
     async def check_duty_status(self):
-        for user_id, status in self.data["duty_status"].items():
-            if status["active"]:
-                code = ''.join(random.choices('0123456789', k=4))
-                self.confirmation_codes[user_id] = code
-                
-                try:
-                    user = await self.bot.fetch_user(int(user_id))
-                    await user.send(f"Still on duty? Enter `/confirm {code}` within 5 minutes to stay on duty.")
-                    
-                    await asyncio.sleep(300)  # Wait 5 minutes
-                    
-                    if user_id in self.confirmation_codes:  # If code wasn't confirmed
-                        await self.set_off_duty(user_id)
-                        await user.send("You have been automatically set to off duty.")
-                except:
-                    continue
+        # Only the sweep is profiled, not the 5 minute wait for answers
+        async with profiler.sample("task:check_duty_status"):
+            asked = await self.ask_for_check_ins()
+        if asked:
+            await asyncio.sleep(CHECK_IN_WINDOW.total_seconds())
+            await self.expire_overdue()
+
+    async def ask_for_check_ins(self) -> bool:
+        """Ask everyone on duty for a check-in code; whether anyone was asked"""
+        await self.expire_overdue()
+        now = datetime.datetime.now()
+        deadline = (now + CHECK_IN_WINDOW).isoformat()
+        prompts = []
+        for guild_id in store.guild_ids():
+            # Another shard's process handles the guilds it owns
+            if not owns_guild(self.bot, guild_id):
+                continue
+            asking = len(prompts)
+            for user_id, status in list(self.load_data(guild_id)["duty_status"].items()):
+                # Users still answering a check-in from before a restart aren't asked twice
+                if status["active"] and status["check_code"] is None:
+                    code = ''.join(random.choices('0123456789', k=4))
+                    # Stored before asking, so a restart during the window still expires it
+                    status.update(check_code=code, check_deadline=deadline)
+                    self.confirmation_codes[(guild_id, user_id)] = code
+                    prompts.append((guild_id, user_id, code))
+            if len(prompts) > asking:
+                self.save_data(guild_id)
+        if not prompts:
+            return False
+
+        # Everyone is asked at once and shares one 5 minute window
+        delivered = await dms.send_many(self.bot, [
+            (user_id, f"Still on duty? Enter `/confirm {code}` within 5 minutes to stay on duty.")
+            for _, user_id, code in prompts
+        ])
+        for (guild_id, user_id, code), reached in zip(prompts, delivered):
+            if not reached and not await self.prompt_unreachable(guild_id, user_id, code):
+                # Not asked, so counted as checked in; a restart shouldn't cut the shift short on their account
+                self.clear_check_in(guild_id, user_id, confirmed=now)
+                self.save_data(guild_id)
+        return True
+
+    async def expire_overdue(self):
+        """End the sessions whose check-in deadline has passed and tell their users"""
+        now = datetime.datetime.now()
+        expired = []
+        for key in list(self.confirmation_codes):
+            guild_id, user_id = key
+            status = self.load_data(guild_id)["duty_status"].get(user_id)
+            if status is None or not status["active"] or status["check_code"] is None:
+                # Answered or ended some other way
+                del self.confirmation_codes[key]
+            elif datetime.datetime.fromisoformat(status["check_deadline"]) <= now:
+                self.end_session(guild_id, user_id, self.last_check_in(status))
+                expired.append(key)
+        for guild_id in {guild_id for guild_id, _ in expired}:
+            self.save_data(guild_id)
+        await dms.send_many(self.bot, [(user_id, "You have been automatically set to off duty.") for _, user_id in expired])
+
+    @staticmethod
+    def last_check_in(status: dict) -> datetime.datetime:
+        """Where an unanswered check-in caps the payout: the last confirmed check-in, or the start of the shift"""
+        return datetime.datetime.fromisoformat(status["last_check_in"] or status["start_time"])
+
+    def clear_check_in(self, guild_id: str, user_id: str, confirmed: datetime.datetime = None):
+        """Drop a pending check-in without saving; confirmed is when it was answered, if it was"""
+        self.confirmation_codes.pop((guild_id, user_id), None)
+        status = self.load_data(guild_id)["duty_status"].get(user_id)
+        if status is None:
+            return
+        status.update(check_code=None, check_deadline=None)
+        if confirmed:
+            status["last_check_in"] = confirmed.isoformat()
+
+    async def prompt_unreachable(self, guild_id: str, user_id: str, code: str) -> bool:
+        """Handle a user who can't be DMed by the configured policy; whether they were asked some other way"""
+        if dms.fallback == "off_duty":
+            await self.set_off_duty(guild_id, user_id)
+            return False
+        if dms.fallback != "ping":
+            return False
+        channels = self.load_data(guild_id)["channels"]
+        channel_id = channels.get("duty_checks") or channels.get("announcements")
+        if not channel_id:
+            return False
+        try:
+            channel = await resolve_channel(self.bot, channel_id)
+        except (discord.NotFound, discord.Forbidden, ValueError):
+            return False
+        # Queued as a log line, so a sweep's pings to one channel go out as a single message
+        outbox.send(channel, f"<@{user_id}> still on duty? Your DMs are closed, so enter `/confirm {code}` within 5 minutes.", priority=LOG)
+        return True
 
     @app_commands.command(name="onduty", description="Set yourself as on duty")
+    @app_commands.guild_only()
     async def on_duty(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)
-        self.data["duty_status"][user_id] = {
-            "active": True,
-            "start_time": datetime.datetime.now().isoformat()
-        }
-        self.save_data()
+        self.confirmation_codes.pop((str(interaction.guild_id), user_id), None)
+        start_time = datetime.datetime.now().isoformat()
+
+        def start_session(data):
+            data["duty_status"][user_id] = {
+                "active": True,
+                "start_time": start_time,
+                "last_check_in": None,
+                "check_code": None,
+                "check_deadline": None
+            }
+
+        store.update(interaction.guild_id, start_session, "duty_status")
         await interaction.response.send_message("You are now on duty!", ephemeral=True)
 
     @app_commands.command(name="offduty", description="Set yourself as off duty")
+    @app_commands.guild_only()
     async def off_duty(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)
-        await self.set_off_duty(user_id)
+        await self.set_off_duty(str(interaction.guild_id), user_id)
         await interaction.response.send_message("You are now off duty!", ephemeral=True)
 
     @app_commands.command(name="confirm", description="Confirm you're still on duty")
     async def confirm_duty(self, interaction: discord.Interaction, code: str):
         user_id = str(interaction.user.id)
-        if user_id in self.confirmation_codes:
-            if code == self.confirmation_codes[user_id]:
-                del self.confirmation_codes[user_id]
+        # Usually sent from DMs, so match on the code rather than the server
+        pending = [key for key in self.confirmation_codes if key[1] == user_id]
+        if pending:
+            confirmed = [key for key in pending if self.confirmation_codes[key] == code]
+            if confirmed:
+                now = datetime.datetime.now()
+                for key in confirmed:
+                    self.clear_check_in(*key, confirmed=now)
+                for guild_id in {guild_id for guild_id, _ in confirmed}:
+                    self.save_data(guild_id)
                 await interaction.response.send_message("Duty status confirmed!", ephemeral=True)
             else:
                 await interaction.response.send_message("Invalid code!", ephemeral=True)
         else:
             await interaction.response.send_message("No confirmation needed at this time.", ephemeral=True)
 
-    async def set_off_duty(self, user_id: str):
-        if user_id in self.data["duty_status"]:
-            status = self.data["duty_status"][user_id]
-            if status["active"]:
-                end_time = datetime.datetime.now()
-                start_time = datetime.datetime.fromisoformat(status["start_time"])
-                duration = (end_time - start_time).total_seconds() / 60  # Duration in minutes
-                
-                sc_reward, exp_reward = self.calculate_duty_reward(user_id, duration)
-                
-                if user_id not in self.data["users"]:
-                    self.data["users"][user_id] = {"sc": 0, "exp": 0}
-                
-                self.data["users"][user_id]["sc"] += sc_reward
-                self.data["users"][user_id]["exp"] += exp_reward
-                status["active"] = False
-                self.save_data()
+    async def set_off_duty(self, guild_id: str, user_id: str):
+        end_time = datetime.datetime.now()
+        # Rerun on the latest data if another process changed the session or balance at the same time
+        store.update(guild_id, lambda data: self.end_session(guild_id, user_id, end_time), *SESSION_SECTIONS)
+
+    def end_session(self, guild_id: str, user_id: str, end_time: datetime.datetime) -> bool:
+        """Pay out an active session up to end_time and end it, without saving; whether there was one"""
+        data = self.load_data(guild_id)
+        status = data["duty_status"].get(user_id)
+        if status is None or not status["active"]:
+            return False
+        start_time = datetime.datetime.fromisoformat(status["start_time"])
+        duration = max(0.0, (end_time - start_time).total_seconds() / 60)  # Duration in minutes
+
+        sc_reward, exp_reward = self.calculate_duty_reward(guild_id, user_id, duration)
+
+        user_data = schema.ensure_user(data["users"], user_id)
+        user_data["sc"] += sc_reward
+        user_data["exp"] += exp_reward
+        status.update(active=False, check_code=None, check_deadline=None)
+        self.confirmation_codes.pop((guild_id, user_id), None)
+        return True
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(DutyCog(bot))
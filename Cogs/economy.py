@@ -1,57 +1,54 @@
 import discord
 from discord.ext import commands
-import json
+import logging
 from discord import app_commands
+from utils import store, schema
+
+log = logging.getLogger("bot.economy")
 
 class EconomyCog(commands.Cog, name="Economy"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.load_data()
 
-    def load_data(self):
-        with open("data/database.json", "r") as f:
-            self.data = json.load(f)
-            print(f"Loaded data: {self.data}")  # Debugging line
+    def load_data(self, guild_id) -> dict:
+        return store.load(guild_id)
 
-    def save_data(self):
-        with open("data/database.json", "w") as f:
-            json.dump(self.data, f, indent=4)
+    def save_data(self, guild_id, *sections):
+        store.save(guild_id, *sections)
 
     @app_commands.command(name="balance", description="Check your SC balance")
+    @app_commands.guild_only()
     async def balance_slash(self, interaction: discord.Interaction):
-        user_id = str(interaction.user.id)
-        if user_id not in self.data["users"]:
-            self.data["users"][user_id] = {"sc": 0, "exp": 0}
-            self.save_data()
-        
-        balance = self.data["users"][user_id]["sc"]
-        print(f"User ID: {user_id}, Balance: {balance}")  # Debugging line
+        data = self.load_data(interaction.guild_id)
+        user = data["users"].get(str(interaction.user.id))
+        balance = user["sc"] if user else 0
+        log.debug("Balance checked: %s SC", balance)
         await interaction.response.send_message(f"Your balance: {balance} SC")
 
     @app_commands.command(name="transfer", description="Transfer SC to another user")
+    @app_commands.guild_only()
     async def transfer_slash(self, interaction: discord.Interaction, recipient: discord.Member, amount: int):
         if amount <= 0:
             await interaction.response.send_message("Amount must be positive!", ephemeral=True)
             return
 
-        sender_id = str(interaction.user.id)
-        recipient_id = str(recipient.id)
+        def transfer(data) -> bool:
+            sender = data["users"].get(str(interaction.user.id))
 
-        # Initialize user data if not exists
-        for user_id in [sender_id, recipient_id]:
-            if user_id not in self.data["users"]:
-                self.data["users"][user_id] = {"sc": 0, "exp": 0}
+            # Check if sender has enough SC
+            if sender is None or sender["sc"] < amount:
+                return False
 
-        # Check if sender has enough SC
-        if self.data["users"][sender_id]["sc"] < amount:
+            # Perform transfer
+            sender["sc"] -= amount
+            schema.ensure_user(data["users"], str(recipient.id))["sc"] += amount
+            return True
+
+        # Rerun on the latest balances if another process changed them at the same time
+        if not store.update(interaction.guild_id, transfer, "users"):
             await interaction.response.send_message("Insufficient balance!", ephemeral=True)
             return
 
-        # Perform transfer
-        self.data["users"][sender_id]["sc"] -= amount
-        self.data["users"][recipient_id]["sc"] += amount
-        self.save_data()
-
         await interaction.response.send_message(
             f"Successfully transferred {amount} SC to {recipient.mention}"
         )
@@ -59,22 +56,18 @@ class EconomyCog(commands.Cog, name="Economy"):
     # New command to modify a user's balance
     @app_commands.command(name="modifybalance", description="Modify a user's SC balance")
     @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.guild_only()
     async def modify_balance_slash(self, interaction: discord.Interaction, user: discord.Member, new_balance: int):
-        user_id = str(user.id)
-        if user_id not in self.data["users"]:
-            self.data["users"][user_id] = {"sc": 0, "exp": 0}
-        
-        self.data["users"][user_id]["sc"] = new_balance
-        self.save_data()
+        def set_balance(data):
+            schema.ensure_user(data["users"], str(user.id))["sc"] = new_balance
+            # An exact balance; a transfer landing at the same moment makes this run again rather than add up
+            data["users"].assign(str(user.id))
+
+        store.update(interaction.guild_id, set_balance, "users")
         
         await interaction.response.send_message(
             f"The balance of {user.mention} has been set to {new_balance} SC."
         )
 
-    @modify_balance_slash.error
-    async def modify_balance_slash_error(self, interaction: discord.Interaction, error):
-        if isinstance(error, app_commands.MissingPermissions):
-            await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
-
 async def setup(bot: commands.Bot):
     await bot.add_cog(EconomyCog(bot))
\ No newline at end of file
@@ -1,7 +1,8 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from discord.ui import Select, View
+from discord.ui import Select
+from utils.views import BotView
 from random import randint
 
 class CategorySelect(Select):
@@ -15,10 +16,13 @@ class CategorySelect(Select):
         super().__init__(placeholder="Select a category...", options=options)
 
     async def callback(self, interaction: discord.Interaction):
-        embed = create_category_embed(self.view.bot, self.values[0])
+        help_cog = self.view.bot.get_cog("Help Command")
+        embed = help_cog.index.category_embeds.get(self.values[0]) if help_cog else None
+        if embed is None:
+            embed = create_category_embed(self.view.bot, self.values[0])
         await interaction.response.edit_message(embed=embed)
 
-class HelpView(View):
+class HelpView(BotView):
     def __init__(self, bot: commands.Bot):
         super().__init__()
         self.bot = bot
@@ -61,9 +65,85 @@ def create_command_embed(command: app_commands.Command) -> discord.Embed:
     
     return embed
 
+class PrefixTrie:
+    """Maps word prefixes to the set of keys that contain a word starting with them"""
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, word: str, key: str):
+        node = self.root
+        for char in word.lower():
+            node = node.setdefault(char, {})
+            node.setdefault(None, set()).add(key)
+
+    def search(self, prefix: str) -> set:
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get(None, set())
+
+class HelpIndex:
+    """Help data built once after the extensions load, so lookups never walk the command tree"""
+    def __init__(self, bot: commands.Bot):
+        self.commands = {}
+        self.command_embeds = {}
+        self.category_embeds = {}
+        self.command_trie = PrefixTrie()
+        self.category_trie = PrefixTrie()
+
+        for command in bot.tree.get_commands():
+            if not isinstance(command, app_commands.Command):
+                continue
+            self.commands[command.name] = command
+            self.command_embeds[command.name] = create_command_embed(command)
+            self.command_trie.insert(command.name, command.name)
+            for word in (command.description or "").split():
+                self.command_trie.insert(word, command.name)
+
+        for cog in bot.cogs.values():
+            category = cog.qualified_name
+            self.category_embeds[category] = create_category_embed(bot, category)
+            for word in category.split():
+                self.category_trie.insert(word, category)
+            self.category_trie.insert(category, category)
+            for command in cog.get_app_commands():
+                self.command_trie.insert(category, command.name)
+
+    def complete(self, trie: PrefixTrie, names, current: str) -> list:
+        words = current.split()
+        if not words:
+            matches = set(names)
+        else:
+            matches = trie.search(words[0])
+            for word in words[1:]:
+                matches = matches & trie.search(word)
+        # Names that start with the typed text come first
+        ranked = sorted(matches, key=lambda name: (not name.lower().startswith(current.lower()), name))
+        return [app_commands.Choice(name=name, value=name) for name in ranked[:25]]
+
+    def complete_command(self, current: str) -> list:
+        return self.complete(self.command_trie, self.commands, current)
+
+    def complete_category(self, current: str) -> list:
+        return self.complete(self.category_trie, self.category_embeds, current)
+
 class HelpCog(commands.Cog, name="Help Command"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.index = None
+
+    async def cog_load(self):
+        # Covers reloading this extension on its own; the full build happens on extensions_ready
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        self.index = HelpIndex(self.bot)
+
+    @commands.Cog.listener()
+    async def on_extensions_ready(self):
+        self.rebuild_index()
 
     @app_commands.command(name="help", description="Display the help message")
     async def help_slash(
@@ -74,9 +154,8 @@ class HelpCog(commands.Cog, name="Help Command"):
     ):
         if command:
             # Find and display specific command
-            cmd = discord.utils.get(self.bot.tree.get_commands(), name=command.lower())
-            if cmd:
-                embed = create_command_embed(cmd)
+            embed = self.index.command_embeds.get(command.lower())
+            if embed:
                 await interaction.response.send_message(embed=embed)
             else:
                 await interaction.response.send_message(
@@ -87,9 +166,8 @@ class HelpCog(commands.Cog, name="Help Command"):
 
         if category:
             # Display specific category
-            cog = self.bot.get_cog(category)
-            if cog:
-                embed = create_category_embed(self.bot, category)
+            embed = self.index.category_embeds.get(category)
+            if embed:
                 await interaction.response.send_message(embed=embed)
             else:
                 await interaction.response.send_message(
@@ -116,5 +194,13 @@ class HelpCog(commands.Cog, name="Help Command"):
         view = HelpView(self.bot)
         await interaction.response.send_message(embed=embed, view=view)
 
+    @help_slash.autocomplete("command")
+    async def command_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self.index.complete_command(current)
+
+    @help_slash.autocomplete("category")
+    async def category_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self.index.complete_category(current)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(HelpCog(bot))
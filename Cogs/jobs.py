@@ -0,0 +1,116 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+import io
+from utils import reports, config
+from utils.jobs import JobManager
+from utils.outbox import outbox, REPLY
+
+REPORTS = {
+    "duty": "Duty rollup",
+    "missions": "Mission statistics",
+    "leaderboard": "SC leaderboard",
+    "levels": "Level reconciliation",
+    "export": "User export (CSV)"
+}
+
+class JobsCog(commands.Cog, name="Reports"):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.manager = JobManager()
+
+    async def cog_unload(self):
+        self.manager.shutdown()
+
+    def render(self, job) -> dict:
+        """Turn a finished job into send_message kwargs"""
+        if job.status == "failed":
+            return {"content": f"Job #{job.id} ({REPORTS[job.name]}) failed: {job.error}"}
+
+        result = job.result
+        embed = discord.Embed(title=f"{REPORTS[job.name]} (job #{job.id})", color=discord.Color.teal())
+        if job.name == "duty":
+            for key, value in result.items():
+                embed.add_field(name=key.replace("_", " ").title(), value=str(value))
+        elif job.name == "missions":
+            for category, stats in sorted(result.items()):
+                embed.add_field(
+                    name=category,
+                    value=(
+                        f"Total: {stats['total']}\n"
+                        f"Completed: {stats['completed']}\n"
+                        f"Aborted: {stats['aborted']}\n"
+                        f"Average: {stats['average_minutes']} min"
+                    )
+                )
+        elif job.name == "leaderboard":
+            embed.description = "\n".join(
+                f"{rank}. <@{user_id}>: {value} SC" for rank, (user_id, value) in enumerate(result, start=1)
+            ) or "No users yet"
+        elif job.name == "levels":
+            embed.description = f"{len(result)} users have a level that doesn't match their EXP."
+            if result:
+                return {"embed": embed, "file": discord.File(
+                    io.BytesIO("\n".join(f"{user_id},{stored},{earned}" for user_id, stored, earned in result).encode()),
+                    filename="level_mismatches.csv"
+                )}
+        elif job.name == "export":
+            embed.description = "Attached."
+            return {"embed": embed, "file": discord.File(io.BytesIO(result.encode()), filename="users.csv")}
+        return {"embed": embed}
+
+    @app_commands.command(name="report", description="Run a report in the background")
+    @app_commands.choices(kind=[app_commands.Choice(name=name, value=value) for value, name in REPORTS.items()])
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    async def report_slash(self, interaction: discord.Interaction, kind: app_commands.Choice[str]):
+        functions = {
+            "duty": (reports.duty_rollup,),
+            "missions": (reports.mission_statistics,),
+            "leaderboard": (reports.leaderboard,),
+            "levels": (reports.level_reconciliation, config.get().level_thresholds),
+            "export": (reports.users_csv,)
+        }
+        func, *args = functions[kind.value]
+
+        async def deliver(job):
+            # Reports can outlast the 15 minutes an interaction token is valid, so post to the channel instead
+            await outbox.send(interaction.channel, priority=REPLY, **self.render(job))
+
+        job = self.manager.submit(kind.value, interaction.guild_id, interaction.user.id, func, *args, on_done=deliver)
+        await interaction.response.send_message(
+            f"Started {kind.name} as job #{job.id}. The result will be posted here.",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="jobs", description="Show or cancel background report jobs")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    async def jobs_slash(self, interaction: discord.Interaction, cancel: int = None):
+        if cancel is not None:
+            job = self.manager.jobs.get(cancel)
+            if job is None or job.guild_id != interaction.guild_id:
+                await interaction.response.send_message(f"No job #{cancel} in this server.", ephemeral=True)
+            elif self.manager.cancel(cancel):
+                await interaction.response.send_message(f"Job #{cancel} cancelled.", ephemeral=True)
+            else:
+                await interaction.response.send_message(f"Job #{cancel} already {job.status}.", ephemeral=True)
+            return
+
+        jobs = [job for job in self.manager.jobs.values() if job.guild_id == interaction.guild_id]
+        if not jobs:
+            await interaction.response.send_message("No jobs have run in this server.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title="Background Jobs", color=discord.Color.teal())
+        for job in jobs[-15:]:
+            took = f" in {(job.finished - job.created).total_seconds():.1f}s" if job.finished else ""
+            embed.add_field(
+                name=f"#{job.id} {REPORTS[job.name]}",
+                value=f"{job.status}{took}\nby <@{job.requested_by}> at {job.created:%H:%M:%S}",
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(JobsCog(bot))
@@ -1,49 +1,26 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import json
+import logging
+from utils import store, config, ranks, idempotency, schema
+from utils.gateway import fetch_members, owns_guild
+from utils.views import BotView
 
-class LevelManageView(discord.ui.View):
+log = logging.getLogger("bot.levels")
+
+class LevelManageView(BotView):
     def __init__(self, cog):
         super().__init__(timeout=None)
         self.cog = cog
 
     @discord.ui.button(label="Add/Edit Level Role", style=discord.ButtonStyle.green)
     async def add_level_role(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = LevelRoleModal()
-        await interaction.response.send_modal(modal)
-        try:
-            modal_inter = await interaction.client.wait_for(
-                "modal_submit",
-                timeout=300.0,
-                check=lambda i: i.user.id == interaction.user.id
-            )
-            
-            level_data = {
-                "role_id": str(modal.role.value),
-                "exp_required": int(modal.exp_required.value),
-                "duty_income": float(modal.duty_income.value),
-                "mission_bonus": float(modal.mission_bonus.value)
-            }
-            
-            self.cog.data["level_roles"][str(modal.level.value)] = level_data
-            self.cog.save_data()
-            # If this is level 0, assign it to members who have a hierarchy role
-            if int(modal.level.value) == 0:
-                for member in interaction.guild.members:
-                    if str(member.id) not in self.cog.data["users"] and any(str(role.id) in self.cog.data.get("roles", {}) for role in member.roles):
-                        await self.cog.assign_default_levels(interaction.guild)
-            
-            await modal_inter.response.send_message(
-                f"Level {modal.level.value} configured successfully!", 
-                ephemeral=True
-            )
-        except Exception as e:
-            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+        await interaction.response.send_modal(LevelRoleModal(self.cog))
 
 class LevelRoleModal(discord.ui.Modal):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, cog):
         super().__init__(title="Configure Level Role")
+        self.cog = cog
         self.level = discord.ui.TextInput(
             label="Level Number",
             placeholder="Enter level number (0 is lowest)",
@@ -72,66 +49,61 @@ class LevelRoleModal(discord.ui.Modal):
         for item in [self.level, self.role, self.exp_required, self.duty_income, self.mission_bonus]:
             self.add_item(item)
 
+    async def on_submit(self, interaction: discord.Interaction):
+        try:
+            level = int(self.level.value)
+            level_data = {
+                "role_id": str(self.role.value),
+                "exp_required": int(self.exp_required.value),
+                "duty_income": float(self.duty_income.value),
+                "mission_bonus": float(self.mission_bonus.value)
+            }
+        except ValueError as e:
+            await interaction.response.send_message(f"Error: {str(e)}", ephemeral=True)
+            return
+
+        async def configure():
+            store.update(interaction.guild_id, lambda data: data["level_roles"].update({str(level): level_data}), "level_roles")
+            # If this is level 0, assign it to members who don't have a level yet
+            if level == 0:
+                await self.cog.assign_default_levels(interaction.guild)
+            return f"Level {level} configured successfully!"
+
+        # Submitting the same level again is a legitimate edit, so this is only collapsed while in flight,
+        # and only with a submission of the same values; a different one runs after it and wins
+        key = (str(interaction.guild_id), f"level:{level}", tuple(sorted(level_data.items())))
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            message = await idempotency.flight.do(key, configure)
+        except Exception as e:
+            message = f"Error: {str(e)}"
+        await interaction.followup.send(message, ephemeral=True)
+
 class LevelsCog(commands.Cog, name="leveling commands"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.load_data()
 
-    def load_data(self):
-        try:
-            with open("data/database.json", "r") as f:
-                self.data = json.load(f)
-                print("Loaded data:", self.data)  # Debug print
-                # Initialize level_roles if not exists
-                if "level_roles" not in self.data:
-                    self.data["level_roles"] = {}
-                if "roles" not in self.data:
-                    self.data["roles"] = {}
-            with open("configuration.json", "r") as f:
-                self.config = json.load(f)
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            self.data = {"roles": {}, "level_roles": {}}
+    def load_data(self, guild_id) -> dict:
+        return store.load(guild_id)
 
-    def save_data(self):
-        with open("data/database.json", "w") as f:
-            json.dump(self.data, f, indent=4)
+    def save_data(self, guild_id, *sections):
+        store.save(guild_id, *sections)
 
     def get_user_priority(self, member: discord.Member) -> int:
-        highest_priority = float('inf')  # Default to lowest priority
-        found_role = False
-        
-        # Reload data to ensure we have the latest
-        self.load_data()
-        
-        print(f"Checking roles for {member.name}...")
-        print(f"Available roles in database: {self.data.get('roles', {}).keys()}")
-        
-        for role in member.roles:
-            role_id = str(role.id)
-            print(f"Checking role {role.name} (ID: {role_id})")
-            if role_id in self.data.get("roles", {}):
-                found_role = True
-                priority = self.data["roles"][role_id]["priority"]
-                print(f"Found role in system with priority {priority}")
-                highest_priority = min(highest_priority, priority)
-        
-        final_priority = 999 if not found_role else highest_priority
-        print(f"Final priority for {member.name}: {final_priority}")
-        return final_priority
+        # Priorities are per server; the compiled rank table is rebuilt when the roles change
+        return ranks.rank_of(member)
 
     def debug_roles(self, member: discord.Member) -> str:
         """Helper method to debug role priorities"""
-        # Force reload data to ensure we have latest
-        self.load_data()
+        data = self.load_data(member.guild.id)
         
         debug_info = []
-        debug_info.append(f"Database roles: {list(self.data.get('roles', {}).keys())}")
+        debug_info.append(f"Database roles: {list(data['roles'].keys())}")
         
         for role in member.roles:
             role_id = str(role.id)
-            if role_id in self.data.get("roles", {}):
-                role_data = self.data["roles"][role_id]
+            if role_id in data["roles"]:
+                role_data = data["roles"][role_id]
                 priority = role_data["priority"]
                 debug_info.append(f"Role {role.name} (ID: {role_id}): Priority {priority}")
             else:
@@ -139,6 +111,7 @@ class LevelsCog(commands.Cog, name="leveling commands"):
         return "\n".join(debug_info)
 
     @app_commands.command(name="checkroles", description="Debug role priorities")
+    @app_commands.guild_only()
     async def check_roles(self, interaction: discord.Interaction):
         """Debug command to check role priorities"""
         debug_info = self.debug_roles(interaction.user)
@@ -152,21 +125,24 @@ class LevelsCog(commands.Cog, name="leveling commands"):
         )
 
     def can_approve(self, approver: discord.Member, target: discord.Member) -> bool:
-        approver_priority = self.get_user_priority(approver)
-        target_priority = self.get_user_priority(target)
-        
-        # Priority 0 can approve anyone including themselves
-        if approver_priority == 0:
-            return True
-            
-        # Priority 1 and 2 can approve lower ranks but not themselves
-        if approver_priority in [1, 2]:
-            return target_priority > approver_priority
-            
-        # Other priorities cannot approve
-        return False
+        # Who may approve whom is set by "approval" in configuration.json
+        return ranks.can_approve(approver, target)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            ranks.forget_member(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        ranks.forget_member(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        ranks.invalidate(role.guild.id)
 
     @app_commands.command(name="approve", description="Approve a mission and award SC/EXP")
+    @app_commands.guild_only()
     async def approve_slash(self, interaction: discord.Interaction, user: discord.Member, mission_id: str, sc: int, exp: int):
         """Approve a mission and award SC/EXP"""
         try:
@@ -179,22 +155,17 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                 )
                 return
 
-            # Initialize user data if not exists
-            user_id = str(user.id)
-            if user_id not in self.data["users"]:
-                self.data["users"][user_id] = {"sc": 0, "exp": 0}
-
             # Award SC and EXP
-            self.data["users"][user_id]["sc"] += sc
-            self.data["users"][user_id]["exp"] += exp
-            self.save_data()
+            def award(data) -> int:
+                user_data = schema.ensure_user(data["users"], str(user.id))
+                user_data["sc"] += sc
+                user_data["exp"] += exp
+                return user_data["exp"]
+
+            total_exp = store.update(interaction.guild_id, award, "users")
 
             # Calculate new level
-            current_exp = self.data["users"][user_id]["exp"]
-            new_level = 0
-            for level, req_exp in sorted(self.config["experience_levels"].items(), key=lambda x: int(x[0])):
-                if current_exp >= req_exp:
-                    new_level = int(level)
+            new_level = config.get().level_for_exp(total_exp)
 
             await interaction.response.send_message(
                 f"Mission {mission_id} approved!\n"
@@ -209,22 +180,15 @@ class LevelsCog(commands.Cog, name="leveling commands"):
             )
 
     @app_commands.command(name="level", description="Check your or another user's level")
+    @app_commands.guild_only()
     async def level_slash(self, interaction: discord.Interaction, user: discord.Member = None):
+        data = self.load_data(interaction.guild_id)
         target = user or interaction.user
-        user_id = str(target.id)
-        
-        if user_id not in self.data["users"]:
-            self.data["users"][user_id] = {"sc": 0, "exp": 0}
-            self.save_data()
-        
-        exp = self.data["users"][user_id]["exp"]
-        level = 1
-        for lvl, req_exp in self.config["experience_levels"].items():
-            if exp >= req_exp:
-                level = int(lvl)
-        
-        next_level = min(level + 1, max(map(int, self.config["experience_levels"].keys())))
-        exp_needed = self.config["experience_levels"][str(next_level)] - exp
+        user_data = data["users"].get(str(target.id))
+        exp = user_data["exp"] if user_data else 0
+        settings = config.get()
+        level = settings.level_for_exp(exp)
+        exp_needed = settings.exp_for_level(settings.next_level(level)) - exp
 
         name_part = "Your" if user is None else f"{target.name}'s"
         await interaction.response.send_message(
@@ -240,6 +204,7 @@ class LevelsCog(commands.Cog, name="leveling commands"):
         app_commands.Choice(name="Add/Edit Level", value="add"),
         app_commands.Choice(name="Remove Level", value="remove")
     ])
+    @app_commands.guild_only()
     async def levels_manage(
         self, 
         interaction: discord.Interaction, 
@@ -252,8 +217,9 @@ class LevelsCog(commands.Cog, name="leveling commands"):
     ):
         """Manage level roles and settings"""
         try:
+            data = self.load_data(interaction.guild_id)
             user_priority = self.get_user_priority(interaction.user)
-            if user_priority > 2:
+            if user_priority > config.get().approval.manage_levels_max_priority:
                 await interaction.response.send_message(
                     "You don't have permission to manage levels!",
                     ephemeral=True
@@ -268,15 +234,15 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                     color=discord.Color.blue()
                 )
                 
-                for level, data in sorted(self.data.get("level_roles", {}).items(), key=lambda x: int(x[0])):
-                    role = interaction.guild.get_role(int(data["role_id"]))
+                for level, level_data in sorted(data["level_roles"].items(), key=lambda x: int(x[0])):
+                    role = interaction.guild.get_role(int(level_data["role_id"]))
                     embed.add_field(
                         name=f"Level {level}",
                         value=(
                             f"Role: {role.mention if role else 'Not found'}\n"
-                            f"Required EXP: {data['exp_required']}\n"
-                            f"Duty Income: {data['duty_income']} SC/30min\n"
-                            f"Mission Bonus: {data['mission_bonus']}%"
+                            f"Required EXP: {level_data['exp_required']}\n"
+                            f"Duty Income: {level_data['duty_income']} SC/30min\n"
+                            f"Mission Bonus: {level_data['mission_bonus']}%"
                         ),
                         inline=False
                     )
@@ -300,8 +266,7 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                     "mission_bonus": mission_bonus
                 }
                 
-                self.data["level_roles"][str(level)] = level_data
-                self.save_data()
+                store.update(interaction.guild_id, lambda data: data["level_roles"].update({str(level): level_data}), "level_roles")
 
                 # If this is level 0, assign it to members who have a hierarchy role
                 if level == 0:
@@ -321,9 +286,7 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                     )
                     return
 
-                if str(level) in self.data["level_roles"]:
-                    del self.data["level_roles"][str(level)]
-                    self.save_data()
+                if store.update(interaction.guild_id, lambda data: data["level_roles"].pop(str(level), None) is not None, "level_roles"):
                     await interaction.response.send_message(
                         f"Level {level} removed from configuration",
                         ephemeral=True
@@ -342,40 +305,42 @@ class LevelsCog(commands.Cog, name="leveling commands"):
 
     async def assign_default_levels(self, guild: discord.Guild):
         """Assign level 0 role to all users who don't have a level role"""
-        if "0" not in self.data["level_roles"]:
+        data = self.load_data(guild.id)
+        if "0" not in data["level_roles"] or not owns_guild(self.bot, guild.id):
             return
             
-        default_role_id = self.data["level_roles"]["0"]["role_id"]
+        default_role_id = data["level_roles"]["0"]["role_id"]
         default_role = guild.get_role(int(default_role_id))
         if not default_role:
             return
 
-        for member in guild.members:
+        for member in await fetch_members(guild):
             user_id = str(member.id)
-            if user_id not in self.data["users"]:
-                self.data["users"][user_id] = {"sc": 0, "exp": 0, "level": 0}
+            if user_id not in data["users"]:
+                schema.ensure_user(data["users"], user_id)
                 await member.add_roles(default_role)
 
     async def check_level_up(self, user_id: str, guild: discord.Guild):
         """Check and process level up for a user"""
-        if user_id not in self.data["users"]:
+        data = self.load_data(guild.id)
+        if user_id not in data["users"]:
             return
 
-        user_data = self.data["users"][user_id]
-        current_exp = user_data.get("exp", 0)
-        current_level = user_data.get("level", 0)
+        user_data = data["users"][user_id]
+        current_exp = user_data["exp"]
+        current_level = user_data["level"]
 
         # Find next level
         next_level = None
-        for level, data in sorted(self.data["level_roles"].items(), key=lambda x: int(x[0])):
-            if int(level) > current_level and current_exp >= data["exp_required"]:
+        for level, level_data in sorted(data["level_roles"].items(), key=lambda x: int(x[0])):
+            if int(level) > current_level and current_exp >= level_data["exp_required"]:
                 next_level = int(level)
                 break
 
         if next_level is not None:
             # Remove old level role
-            if str(current_level) in self.data["level_roles"]:
-                old_role_id = self.data["level_roles"][str(current_level)]["role_id"]
+            if str(current_level) in data["level_roles"]:
+                old_role_id = data["level_roles"][str(current_level)]["role_id"]
                 old_role = guild.get_role(int(old_role_id))
                 if old_role:
                     member = guild.get_member(int(user_id))
@@ -383,7 +348,7 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                         await member.remove_roles(old_role)
 
             # Add new level role
-            new_role_id = self.data["level_roles"][str(next_level)]["role_id"]
+            new_role_id = data["level_roles"][str(next_level)]["role_id"]
             new_role = guild.get_role(int(new_role_id))
             if new_role:
                 member = guild.get_member(int(user_id))
@@ -391,36 +356,34 @@ class LevelsCog(commands.Cog, name="leveling commands"):
                     await member.add_roles(new_role)
                     
             # Update user data
-            self.data["users"][user_id].update({
+            user_data.update({
                 "level": next_level,
                 "exp": 0  # Reset EXP on level up
             })
-            self.save_data()
+            self.save_data(guild.id, "users")
             
             return next_level
         return None
 
     @app_commands.command(name="addexp", description="Add or remove EXP from a user")
+    @app_commands.guild_only()
     async def add_exp(self, interaction: discord.Interaction, user: discord.Member, amount: int):
         """Add or remove EXP from a user (Rank 0 only)"""
-        if self.get_user_priority(interaction.user) != 0:
+        if self.get_user_priority(interaction.user) > config.get().approval.modify_exp_max_priority:
             await interaction.response.send_message(
                 "Only highest rank can modify EXP!",
                 ephemeral=True
             )
             return
 
-        user_id = str(user.id)
-        if user_id not in self.data["users"]:
-            self.data["users"][user_id] = {"sc": 0, "exp": 0}
-
-        self.data["users"][user_id]["exp"] += amount
-        if self.data["users"][user_id]["exp"] < 0:
-            self.data["users"][user_id]["exp"] = 0
+        def add(data) -> int:
+            user_data = schema.ensure_user(data["users"], str(user.id))
+            user_data["exp"] = max(0, user_data["exp"] + amount)
+            return user_data["exp"]
 
-        self.save_data()
+        total = store.update(interaction.guild_id, add, "users")
         await interaction.response.send_message(
-            f"Updated {user.mention}'s EXP by {amount:+}. New total: {self.data['users'][user_id]['exp']}",
+            f"Updated {user.mention}'s EXP by {amount:+}. New total: {total}",
             ephemeral=True
         )
 
@@ -2,10 +2,15 @@ import asyncio
 import discord
 from discord.ext import commands
 from discord import app_commands, ui
-import json
 import datetime
-from discord.ui import Button, View, Modal, TextInput
+from discord.ui import Button, Modal, TextInput
 import random
+import logging
+from utils import store, config, idempotency, analytics
+from utils.outbox import outbox, resolve_channel, REPLY, LOG
+from utils.views import BotView
+
+log = logging.getLogger("bot.missions")
 
 class AbortModal(Modal):
     def __init__(self, verification_code: str):
@@ -25,7 +30,7 @@ class AbortModal(Modal):
         await interaction.response.send_message("Invalid code!", ephemeral=True)
         return False
 
-class PendingMissionView(View):
+class PendingMissionView(BotView):
     def __init__(self, bot: commands.Bot, mission_data: dict):
         super().__init__(timeout=None)
         self.bot = bot
@@ -33,33 +38,43 @@ class PendingMissionView(View):
 
     @discord.ui.button(label="Start Mission", style=discord.ButtonStyle.green)
     async def start_mission(self, interaction: discord.Interaction, button: Button):
+        # Acknowledged first: starting edits messages, which can outlast the 3 second window
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        # Double clicks and two leaders clicking at once start the mission only once
         try:
-            channel = await self.bot.fetch_channel(int(self.mission_data["channels"]["missions"]))
-            
-            # Create active mission embed
-            embed = discord.Embed(
-                title=f"Mission #{self.mission_data['id']} In Progress",
-                description=f"Leader: {interaction.user.mention}\nCategory: {self.mission_data['category']}\nDescription: {self.mission_data['description']}",
-                color=discord.Color.green()
+            message = await idempotency.run_once(
+                interaction.guild_id,
+                f"mission:{self.mission_data['id']}:start",
+                lambda: self.start(interaction)
             )
-            
-            # Create active mission view with end/abort buttons
-            active_view = ActiveMissionView(self.bot, self.mission_data)
-            await channel.send(embed=embed, view=active_view)
-            
-            # Remove buttons from pending mission message
-            await interaction.message.edit(view=None)
-            await interaction.response.send_message("Mission started successfully!", ephemeral=True)
-            
         except Exception as e:
-            await interaction.response.send_message(f"Error starting mission: {str(e)}", ephemeral=True)
+            message = f"Error starting mission: {str(e)}"
+        await interaction.followup.send(message, ephemeral=True)
+
+    async def start(self, interaction: discord.Interaction) -> str:
+        channel = await resolve_channel(self.bot, self.mission_data["channels"]["missions"])
+
+        # Create active mission embed
+        embed = discord.Embed(
+            title=f"Mission #{self.mission_data['id']} In Progress",
+            description=f"Leader: {interaction.user.mention}\nCategory: {self.mission_data['category']}\nDescription: {self.mission_data['description']}",
+            color=discord.Color.green()
+        )
+
+        # Create active mission view with end/abort buttons
+        active_view = ActiveMissionView(self.bot, self.mission_data)
+        # Queued, so a busy missions channel doesn't hold up the reply
+        outbox.send(channel, embed=embed, view=active_view, priority=REPLY)
+
+        # Remove buttons from pending mission message
+        await interaction.message.edit(view=None)
+        return "Mission started successfully!"
 
     @discord.ui.button(label="Request Support", style=discord.ButtonStyle.primary)
     async def request_support(self, interaction: discord.Interaction, button: Button):
-        with open("data/database.json", "r") as f:
-            data = json.load(f)
+        data = store.load(interaction.guild_id)
         
-        on_duty_users = [user_id for user_id, status in data.get("duty_status", {}).items() if status["active"]]
+        on_duty_users = [user_id for user_id, status in data["duty_status"].items() if status["active"]]
         if not on_duty_users:
             await interaction.response.send_message("No users currently on duty!", ephemeral=True)
             return
@@ -71,133 +86,125 @@ class PendingMissionView(View):
             allowed_mentions=discord.AllowedMentions(users=True)
         )
 
-class ActiveMissionView(View):
+class ActiveMissionView(BotView):
     def __init__(self, bot: commands.Bot, mission_data: dict):
         super().__init__(timeout=None)
         self.bot = bot
         self.mission_data = mission_data
 
-    async def get_channel_from_db(self, channel_type: str) -> str:
-        """Get channel ID from database.json"""
+    async def get_channel_from_db(self, guild_id, channel_type: str) -> str:
+        """Get channel ID from the server's data"""
         try:
-            with open("data/database.json", "r") as f:
-                data = json.load(f)
-                return data.get("channels", {}).get(channel_type)
+            return store.load(guild_id)["channels"].get(channel_type)
         except Exception:
             return None
 
-    @discord.ui.button(label="End Mission", style=discord.ButtonStyle.green)
-    async def end_mission(self, interaction: discord.Interaction, button: Button):
+    async def get_screenshots_channel(self, guild_id):
+        screenshots_channel_id = await self.get_channel_from_db(guild_id, "screenshots")
+        if not screenshots_channel_id:
+            raise idempotency.Rejected("Error: Screenshots channel not configured! Please ask an admin to set it up.")
         try:
-            # Get screenshots channel ID from database
-            screenshots_channel_id = await self.get_channel_from_db("screenshots")
-            if not screenshots_channel_id:
-                await interaction.response.send_message(
-                    "Error: Screenshots channel not configured! Please ask an admin to set it up.",
-                    ephemeral=True
-                )
-                return
+            return await resolve_channel(self.bot, screenshots_channel_id)
+        except (discord.NotFound, ValueError):
+            raise idempotency.Rejected("Error: Could not find screenshots channel! Please ask an admin to check the configuration.")
 
-            try:
-                screenshots_channel = await self.bot.fetch_channel(int(screenshots_channel_id))
-            except (discord.NotFound, ValueError):
-                await interaction.response.send_message(
-                    "Error: Could not find screenshots channel! Please ask an admin to check the configuration.",
-                    ephemeral=True
-                )
-                return
+    def update_mission(self, guild_id, **fields):
+        """Apply fields to this view's copy and the stored mission, then save"""
+        self.mission_data.update(fields)
 
-            # Send end confirmation request
-            await screenshots_channel.send(
-                f"Mission #{self.mission_data['id']} ending.\n"
-                f"{interaction.user.mention}, please use `/confend {self.mission_data['id']} <reason>` "
-                f"and optionally upload a screenshot."
-            )
-            
-            # Update mission status
-            self.mission_data["status"] = "ending"
-            self.mission_data["end_initiated_by"] = interaction.user.id
-            self.mission_data["end_time"] = datetime.datetime.now().isoformat()
-            
-            # Disable buttons
-            self.clear_items()
-            await interaction.message.edit(view=self)
-            await interaction.response.send_message(
-                "Mission end initiated. Please confirm in screenshots channel.", 
-                ephemeral=True
+        def apply(data):
+            mission = data["active_missions"].get(self.mission_data["id"])
+            if mission is not None and mission is not self.mission_data:
+                mission.update(fields)
+
+        store.update(guild_id, apply, "active_missions")
+
+    async def run_action(self, interaction: discord.Interaction, action: str, func, error: str):
+        """Run an end/abort action once per mission, however many times or by whomever it is clicked"""
+        # Acknowledged first: the action resolves channels and edits messages, which can outlast the 3 second window
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            message = await idempotency.run_once(
+                interaction.guild_id,
+                f"mission:{self.mission_data['id']}:{action}",
+                lambda: func(interaction)
             )
-            
+        except idempotency.Rejected as e:
+            message = str(e)
         except Exception as e:
-            await interaction.response.send_message(
-                f"Error ending mission: {str(e)}", 
-                ephemeral=True
-            )
+            message = f"{error}: {str(e)}"
+        await interaction.followup.send(message, ephemeral=True)
+
+    @discord.ui.button(label="End Mission", style=discord.ButtonStyle.green)
+    async def end_mission(self, interaction: discord.Interaction, button: Button):
+        await self.run_action(interaction, "end", self.end, "Error ending mission")
+
+    async def end(self, interaction: discord.Interaction) -> str:
+        screenshots_channel = await self.get_screenshots_channel(interaction.guild_id)
+
+        # Send end confirmation request
+        outbox.send(
+            screenshots_channel,
+            f"Mission #{self.mission_data['id']} ending.\n"
+            f"{interaction.user.mention}, please use `/confend {self.mission_data['id']} <reason>` "
+            f"and optionally upload a screenshot."
+        )
+
+        # Update mission status
+        self.update_mission(
+            interaction.guild_id,
+            status="ending",
+            end_initiated_by=interaction.user.id,
+            end_time=datetime.datetime.now().isoformat()
+        )
+
+        # Disable buttons
+        self.clear_items()
+        await interaction.message.edit(view=self)
+        return "Mission end initiated. Please confirm in screenshots channel."
 
     @discord.ui.button(label="Abort Mission", style=discord.ButtonStyle.red)
     async def abort_mission(self, interaction: discord.Interaction, button: Button):
-        try:
-            # Get screenshots channel ID from database
-            screenshots_channel_id = await self.get_channel_from_db("screenshots")
-            if not screenshots_channel_id:
-                await interaction.response.send_message(
-                    "Error: Screenshots channel not configured! Please ask an admin to set it up.",
-                    ephemeral=True
-                )
-                return
+        await self.run_action(interaction, "abort", self.abort, "Error aborting mission")
 
-            try:
-                screenshots_channel = await self.bot.fetch_channel(int(screenshots_channel_id))
-            except (discord.NotFound, ValueError):
-                await interaction.response.send_message(
-                    "Error: Could not find screenshots channel! Please ask an admin to check the configuration.",
-                    ephemeral=True
-                )
-                return
+    async def abort(self, interaction: discord.Interaction) -> str:
+        screenshots_channel = await self.get_screenshots_channel(interaction.guild_id)
+
+        # Send abort confirmation request
+        outbox.send(
+            screenshots_channel,
+            f"Mission #{self.mission_data['id']} aborting.\n"
+            f"{interaction.user.mention}, please use `/confabort {self.mission_data['id']} <reason>` "
+            f"and optionally upload a screenshot."
+        )
+
+        # Update mission status
+        self.update_mission(
+            interaction.guild_id,
+            status="aborting",
+            abort_initiated_by=interaction.user.id,
+            abort_time=datetime.datetime.now().isoformat()
+        )
+
+        # Disable buttons
+        self.clear_items()
+        await interaction.message.edit(view=self)
+        return "Mission abort initiated. Please confirm in screenshots channel."
 
-            # Send abort confirmation request
-            await screenshots_channel.send(
-                f"Mission #{self.mission_data['id']} aborting.\n"
-                f"{interaction.user.mention}, please use `/confabort {self.mission_data['id']} <reason>` "
-                f"and optionally upload a screenshot."
-            )
-            
-            # Update mission status
-            self.mission_data["status"] = "aborting"
-            self.mission_data["abort_initiated_by"] = interaction.user.id
-            self.mission_data["abort_time"] = datetime.datetime.now().isoformat()
-            
-            # Disable buttons
-            self.clear_items()
-            await interaction.message.edit(view=self)
-            await interaction.response.send_message(
-                "Mission abort initiated. Please confirm in screenshots channel.", 
-                ephemeral=True
-            )
-            
-        except Exception as e:
-            await interaction.response.send_message(
-                f"Error aborting mission: {str(e)}", 
-                ephemeral=True
-            )
 class MissionCog(commands.Cog, name="Mission System"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.load_data()
 
-    def load_data(self):
-        with open("data/database.json", "r") as f:
-            self.data = json.load(f)
-        with open("configuration.json", "r") as f:
-            self.config = json.load(f)
+    def load_data(self, guild_id) -> dict:
+        return store.load(guild_id)
 
-    def save_data(self):
-        with open("data/database.json", "w") as f:
-            json.dump(self.data, f, indent=4)
+    def save_data(self, guild_id, *sections):
+        store.save(guild_id, *sections)
 
-    async def post_to_pending_missions(self, mission_data: dict):
+    async def post_to_pending_missions(self, guild_id, mission_data: dict):
         try:
             # Get channel IDs from data and verify they exist
-            channels = self.data.get("channels", {})
+            channels = self.load_data(guild_id)["channels"]
             mission_data["channels"] = {
                 "missions": channels.get("missions"),
                 "mission_logs": channels.get("mission_logs"),
@@ -210,7 +217,7 @@ class MissionCog(commands.Cog, name="Mission System"):
             if not channel_id:
                 return False
 
-            channel = await self.bot.fetch_channel(int(channel_id))
+            channel = await resolve_channel(self.bot, channel_id)
             if not channel:
                 return False
 
@@ -220,26 +227,26 @@ class MissionCog(commands.Cog, name="Mission System"):
                 description=f"Category: {mission_data['category']}\nDescription: {mission_data['description']}",
                 color=discord.Color.blue()
             )
-            await channel.send(embed=embed, view=view)
+            outbox.send(channel, embed=embed, view=view, priority=REPLY)
             return True
         except (discord.NotFound, ValueError, TypeError):
             return False
 
     @app_commands.command(name="startmission", description="Start a new mission")
-    @app_commands.choices(category=[
-        app_commands.Choice(name=cat, value=cat) 
-    for cat in ["Rescue", "Transport", "Delivery", "Training", "Other"]
-])
-    async def start_mission_slash(self, interaction: discord.Interaction, category: app_commands.Choice[str], description: str):
+    @app_commands.guild_only()
+    async def start_mission_slash(self, interaction: discord.Interaction, category: str, description: str):
         try:
-        # Validate category
-            if category.value not in self.config["mission_categories"]:
+            data = self.load_data(interaction.guild_id)
+        # Validate category; autocomplete only suggests, so anything can be typed
+            settings = config.get()
+            if category not in settings.category_set:
                await interaction.response.send_message(
-                "Invalid category. Available categories: " + ", ".join(self.config["mission_categories"]))
+                "Invalid category. Available categories: " + ", ".join(settings.mission_categories),
+                ephemeral=True)
                return
 
         # Check if channels exist
-            channels = self.data.get("channels", {})
+            channels = data["channels"]
             required_channels = {
            "missions": channels.get("missions"),
             "mission_logs": channels.get("mission_logs"),
@@ -253,7 +260,7 @@ class MissionCog(commands.Cog, name="Mission System"):
                     missing_channels.append(name)
                 else:
                     try:
-                        await self.bot.fetch_channel(int(channel_id))
+                        await resolve_channel(self.bot, channel_id)
                     except (discord.NotFound, ValueError):
                         missing_channels.append(name)
 
@@ -264,12 +271,12 @@ class MissionCog(commands.Cog, name="Mission System"):
             )
                 return
 
-            # Create mission
-            mission_id = str(len(self.data.get("active_missions", {})) + 1)
+            # Create mission; after the highest ID rather than the count, which imported missions can skip ahead of
+            mission_id = str(max((int(key) for key in data["active_missions"] if key.isdecimal()), default=0) + 1)
             mission = {
             "id": mission_id,
             "leader": interaction.user.id,
-            "category": category.value,
+            "category": category,
             "description": description,
             "status": "pending",
             "start_time": datetime.datetime.now().isoformat(),
@@ -278,14 +285,11 @@ class MissionCog(commands.Cog, name="Mission System"):
             "channels": required_channels
         }
 
-            if "active_missions" not in self.data:
-                self.data["active_missions"] = {}
-
-            self.data["active_missions"][mission_id] = mission
-            self.save_data()
+            data["active_missions"][mission_id] = mission
+            self.save_data(interaction.guild_id, "active_missions")
 
             # Post to pending_missions
-            success = await self.post_to_pending_missions(mission)
+            success = await self.post_to_pending_missions(interaction.guild_id, mission)
             if success:
                 await interaction.response.send_message(
                 f"Mission {mission_id} created! Check pending missions channel.",
@@ -298,43 +302,54 @@ class MissionCog(commands.Cog, name="Mission System"):
             )
         except Exception as e:
             # Log the error for debugging
-            print(f"Error in start_mission_slash: {str(e)}")
+            log.exception("Error in start_mission_slash")
             await interaction.response.send_message(
             f"Error creating mission: {str(e)}",
             ephemeral=True
         )
 
+    @start_mission_slash.autocomplete("category")
+    async def category_autocomplete(self, interaction: discord.Interaction, current: str):
+        # Read per keystroke, so categories added to configuration.json show up without a resync
+        return [
+            app_commands.Choice(name=category, value=category)
+            for category in config.get().mission_categories if current.lower() in category.lower()
+        ][:25]
 
     @app_commands.command(name="confend", description="Confirm mission end with reason and optional screenshot")
+    @app_commands.guild_only()
     async def confirm_end(self, interaction: discord.Interaction, mission_id: str, reason: str, screenshot_url: str = None):
         """Confirm mission end with reason and optional screenshot"""
         try:
-            if mission_id not in self.data["active_missions"]:
-                await interaction.response.send_message("Mission not found!", ephemeral=True)
-                return
-
-            mission = self.data["active_missions"][mission_id]
-            if mission["status"] != "ending":
-                await interaction.response.send_message("This mission is not in ending state!", ephemeral=True)
+            def complete(data):
+                """The completed mission, or why it can't be completed"""
+                mission = data["active_missions"].get(mission_id)
+                if mission is None:
+                    return "Mission not found!"
+                if mission["status"] != "ending":
+                    return "This mission is not in ending state!"
+                if interaction.user.id != mission["end_initiated_by"]:
+                    return "Only the person who initiated the end can confirm it!"
+
+                # Calculate duration
+                end_time = datetime.datetime.fromisoformat(mission["end_time"])
+                duration = end_time - datetime.datetime.fromisoformat(mission["start_time"])
+
+                # Update mission data
+                mission.update({
+                    "status": "completed",
+                    "end_reason": reason,
+                    "screenshot": screenshot_url,
+                    "duration": duration.total_seconds()
+                })
+                analytics.record(data["mission_stats"], mission, "completed", duration.total_seconds(), end_time)
+                return mission
+
+            mission = store.update(interaction.guild_id, complete, "active_missions", "mission_stats")
+            if isinstance(mission, str):
+                await interaction.response.send_message(mission, ephemeral=True)
                 return
-
-            if interaction.user.id != mission["end_initiated_by"]:
-                await interaction.response.send_message("Only the person who initiated the end can confirm it!", ephemeral=True)
-                return
-
-            # Calculate duration
-            end_time = datetime.datetime.fromisoformat(mission["end_time"])
-            start_time = datetime.datetime.fromisoformat(mission["start_time"])
-            duration = end_time - start_time
-
-            # Update mission data
-            mission.update({
-                "status": "completed",
-                "end_reason": reason,
-                "screenshot": screenshot_url,
-                "duration": str(duration)
-            })
-            self.save_data()
+            duration = datetime.timedelta(seconds=mission["duration"])
 
             # Create completion embed
             embed = discord.Embed(
@@ -350,9 +365,9 @@ class MissionCog(commands.Cog, name="Mission System"):
             if screenshot_url:
                 embed.add_field(name="Screenshot", value=screenshot_url)
 
-            # Post to missions channel
-            channel = await self.bot.fetch_channel(int(mission["channels"]["missions"]))
-            await channel.send(embed=embed)
+            # Post to missions channel; completions arriving together are sent as one message
+            channel = await resolve_channel(self.bot, mission["channels"]["missions"])
+            outbox.send(channel, embed=embed, priority=LOG)
             
             await interaction.response.send_message("Mission end confirmed!", ephemeral=True)
 
@@ -360,28 +375,32 @@ class MissionCog(commands.Cog, name="Mission System"):
             await interaction.response.send_message(f"Error confirming mission end: {str(e)}", ephemeral=True)
 
     @app_commands.command(name="confabort", description="Confirm mission abort with reason and optional screenshot")
+    @app_commands.guild_only()
     async def confirm_abort(self, interaction: discord.Interaction, mission_id: str, reason: str, screenshot_url: str = None):
         """Confirm mission abort with reason and optional screenshot"""
         try:
-            if mission_id not in self.data["active_missions"]:
-                await interaction.response.send_message("Mission not found!", ephemeral=True)
+            def abort(data):
+                """The aborted mission, or why it can't be aborted"""
+                mission = data["active_missions"].get(mission_id)
+                if mission is None:
+                    return "Mission not found!"
+                if mission["status"] != "aborting":
+                    return "This mission is not in aborting state!"
+                if interaction.user.id != mission["abort_initiated_by"]:
+                    return "Only the person who initiated the abort can confirm it!"
+
+                # Update mission data
+                mission["status"] = "aborted"
+                mission["abort_reason"] = reason
+                mission["screenshot"] = screenshot_url
+                analytics.record(data["mission_stats"], mission, "aborted", None, datetime.datetime.now())
+                return mission
+
+            mission = store.update(interaction.guild_id, abort, "active_missions", "mission_stats")
+            if isinstance(mission, str):
+                await interaction.response.send_message(mission, ephemeral=True)
                 return
 
-            mission = self.data["active_missions"][mission_id]
-            if mission["status"] != "aborting":
-                await interaction.response.send_message("This mission is not in aborting state!", ephemeral=True)
-                return
-
-            if interaction.user.id != mission["abort_initiated_by"]:
-                await interaction.response.send_message("Only the person who initiated the abort can confirm it!", ephemeral=True)
-                return
-
-            # Update mission data
-            mission["status"] = "aborted"
-            mission["abort_reason"] = reason
-            mission["screenshot"] = screenshot_url
-            self.save_data()
-
             # Create abort embed
             embed = discord.Embed(
                 title=f"Mission {mission_id} Aborted",
@@ -396,13 +415,55 @@ class MissionCog(commands.Cog, name="Mission System"):
                 embed.add_field(name="Screenshot", value=screenshot_url)
 
             # Post to mission logs
-            log_channel = await self.bot.fetch_channel(int(mission["channels"]["mission_logs"]))
-            await log_channel.send(embed=embed)
+            log_channel = await resolve_channel(self.bot, mission["channels"]["mission_logs"])
+            outbox.send(log_channel, embed=embed, priority=LOG)
             
             await interaction.response.send_message("Mission abort confirmed!", ephemeral=True)
 
         except Exception as e:
             await interaction.response.send_message(f"Error confirming mission abort: {str(e)}", ephemeral=True)
 
+    @app_commands.command(name="missionstats", description="Show mission completion rates, durations and throughput")
+    @app_commands.describe(leader="Show the missions led by this member instead of the whole server")
+    @app_commands.guild_only()
+    async def mission_stats_slash(self, interaction: discord.Interaction, leader: discord.Member = None):
+        # Answered from the aggregates kept as missions close, never from the mission history
+        stats = self.load_data(interaction.guild_id)["mission_stats"]
+        overall = analytics.summary(stats, f"leader:{leader.id}" if leader else "total")
+        if overall is None:
+            await interaction.response.send_message("No missions have been closed yet.", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            title=f"Mission Statistics for {leader.display_name}" if leader else "Mission Statistics",
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="All Missions", value=format_summary(overall), inline=False)
+        if not leader:
+            for category in config.get().mission_categories:
+                summary = analytics.summary(stats, f"category:{category}")
+                if summary:
+                    embed.add_field(name=category, value=format_summary(summary))
+            today = datetime.date.today()
+            lines = []
+            for days in (1, 7, 30):
+                counts = analytics.recent(stats, days, today)
+                lines.append(f"Last {days} day{'s' if days > 1 else ''}: {counts['completed']} completed, {counts['aborted']} aborted")
+            embed.add_field(name="Throughput", value="\n".join(lines), inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def format_minutes(seconds) -> str:
+    return "-" if seconds is None else f"{seconds / 60:.1f} min"
+
+def format_summary(summary: dict) -> str:
+    return (
+        f"Completed: {summary['completed']}\n"
+        f"Aborted: {summary['aborted']}\n"
+        f"Completion rate: {summary['completion_rate']:.0%}\n"
+        f"Average: {format_minutes(summary['mean_seconds'])}\n"
+        f"Median: {format_minutes(summary['p50_seconds'])}\n"
+        f"90th percentile: {format_minutes(summary['p90_seconds'])}"
+    )
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(MissionCog(bot))
@@ -1,27 +1,42 @@
 import discord
 from discord.ext import commands
 from discord.ext.commands import MissingPermissions, CheckFailure, CommandNotFound, NotOwner
+from discord import app_commands
 import time
+import logging
+from utils.ratelimit import cooldown_message, send_error
+from utils import store
+
+log = logging.getLogger("bot.errors")
 
 
 class OnCommandErrorCog(commands.Cog, name="on command error"):
 	def __init__(self, bot:commands.Bot):
 		self.bot = bot
-        
+
+	async def cog_load(self):
+		# App command errors don't reach on_command_error, so take over the tree's handler
+		self.default_tree_error = self.bot.tree.on_error
+		self.bot.tree.on_error = self.on_app_command_error
+
+	async def cog_unload(self):
+		self.bot.tree.on_error = self.default_tree_error
+
+	async def on_app_command_error(self, interaction:discord.Interaction, error:app_commands.AppCommandError):
+		if isinstance(error, app_commands.CommandOnCooldown):
+			await send_error(interaction, cooldown_message(error.retry_after))
+		elif isinstance(error, app_commands.CheckFailure):
+			await send_error(interaction, str(error) or "You can't use this command.")
+		elif isinstance(getattr(error, "original", None), store.ConflictError):
+			await send_error(interaction, "Someone changed the same data at the same moment, so nothing was saved. Please try again.")
+		else:
+			command = interaction.command.qualified_name if interaction.command else "unknown"
+			log.error("Unhandled error in /%s", command, exc_info=error)
+
 	@commands.Cog.listener()
 	async def on_command_error(self, ctx:commands.Context, error:commands.CommandError):
 		if isinstance(error, commands.CommandOnCooldown):
-			day = round(error.retry_after/86400)
-			hour = round(error.retry_after/3600)
-			minute = round(error.retry_after/60)
-			if day > 0:
-				await ctx.send('This command has a cooldown, for '+str(day)+ "day(s)")
-			elif hour > 0:
-				await ctx.send('This command has a cooldown, for '+str(hour)+ " hour(s)")
-			elif minute > 0:
-				await ctx.send('This command has a cooldown, for '+ str(minute)+" minute(s)")
-			else:
-				await ctx.send(f'This command has a cooldown, for {error.retry_after:.2f} second(s)')
+			await ctx.send(cooldown_message(error.retry_after))
 		elif isinstance(error, CommandNotFound):
 			return
 		elif isinstance(error, MissingPermissions):
@@ -31,7 +46,7 @@ class OnCommandErrorCog(commands.Cog, name="on command error"):
 		elif isinstance(error, NotOwner):
 			await ctx.send(error)
 		else:
-			print(error) 
+			log.error("Unhandled command error: %s", error)
 
 async def setup(bot):
     await bot.add_cog(OnCommandErrorCog(bot))
@@ -13,8 +13,14 @@ class PingCog(commands.Cog, name="ping command"):
         start_time = time.perf_counter()
         await interaction.response.send_message("Pinging...")
         end_time = time.perf_counter()
+        latencies = getattr(self.bot, "latencies", None) or [(0, self.bot.latency)]
+        shard_id = interaction.guild.shard_id if interaction.guild else 0
+        gateway = "\n".join(
+            f"Shard {shard}: {latency * 1000:.0f}ms" + (" (this server)" if shard == shard_id and len(latencies) > 1 else "")
+            for shard, latency in latencies
+        )
         await interaction.edit_original_response(
-            content=f"Pong! {(end_time - start_time) * 1000:.0f}ms"
+            content=f"Pong! {(end_time - start_time) * 1000:.0f}ms\n{gateway}"
         )
 
 async def setup(bot:commands.Bot):
@@ -1,8 +1,12 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from discord.ui import Select, View, Button
-import json
+from discord.ui import Select, Button
+import logging
+from utils import store, ranks
+from utils.views import BotView
+
+log = logging.getLogger("bot.setup")
 
 class RoleSelect(Select):
     def __init__(self, roles):
@@ -26,26 +30,17 @@ class ChannelSelect(Select):
         if isinstance(view, ChannelSetupView):
             await view.set_channel(interaction, self.values[0], self.purpose)
 
-class ChannelSetupView(View):
+class ChannelSetupView(BotView):
     def __init__(self, bot: commands.Bot):
         super().__init__()
         self.bot = bot
         
     async def set_channel(self, interaction, channel_id, purpose):
-        with open("data/database.json", "r") as f:
-            data = json.load(f)
-        
-        if "channels" not in data:
-            data["channels"] = {}
-            
-        data["channels"][purpose] = str(channel_id)
-        
-        with open("data/database.json", "w") as f:
-            json.dump(data, f, indent=4)
+        store.update(interaction.guild_id, lambda data: data["channels"].update({purpose: str(channel_id)}), "channels")
         
         await interaction.response.send_message(f"Set <#{channel_id}> as the {purpose} channel", ephemeral=True)
 
-class SetupView(View):
+class SetupView(BotView):
     def __init__(self, bot: commands.Bot):
         super().__init__()
         self.bot = bot
@@ -72,32 +67,20 @@ class SetupView(View):
 class SetupCog(commands.Cog, name="setup commands"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.load_data()
 
-    def load_data(self):
-        with open("data/database.json", "r") as f:
-            self.data = json.load(f)
-            # Initialize required structures if they don't exist
-            if "roles" not in self.data:
-                self.data["roles"] = {}
-            self.save_data()
+    def load_data(self, guild_id) -> dict:
+        return store.load(guild_id)
 
-    def save_data(self):
+    def save_data(self, guild_id, *sections):
         try:
-            with open("data/database.json", "r") as f:
-                current_data = json.load(f)
-            
-            # Update only the roles section
-            current_data["roles"] = self.data["roles"]
-            
-            with open("data/database.json", "w") as f:
-                json.dump(current_data, f, indent=4)
-        except Exception as e:
-            print(f"Error saving data: {str(e)}")
+            store.save(guild_id, *sections)
+        except Exception:
+            log.exception("Error saving data")
 
 
     @app_commands.command(name="setup", description="Set up roles and channels for the bot")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
     async def setup_slash(self, interaction: discord.Interaction):
         """Slash command for setup"""
         view = SetupView(self.bot)
@@ -105,12 +88,10 @@ class SetupCog(commands.Cog, name="setup commands"):
 
     @app_commands.command(name="role", description="Add an existing role to the ranking system")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
     async def role_slash(self, interaction: discord.Interaction, role: discord.Role, priority: int):
         """Add an existing role to the ranking system"""
         try:
-            # Load fresh data
-            self.load_data()
-            
             role_data = {
                 "id": str(role.id),
                 "name": role.name,
@@ -118,18 +99,12 @@ class SetupCog(commands.Cog, name="setup commands"):
                 "bonus_income": 1.0
             }
 
-            if "roles" not in self.data:
-                self.data["roles"] = {}
-            
-            # Update role data
-            self.data["roles"][str(role.id)] = role_data
-            
-            # Save data immediately
-            self.save_data()
+            # Update role data and save it immediately
+            store.update(interaction.guild_id, lambda data: data["roles"].update({str(role.id): role_data}), "roles")
+            ranks.invalidate(interaction.guild_id)
 
             # Verify data was saved
-            self.load_data()
-            if str(role.id) in self.data["roles"]:
+            if str(role.id) in self.load_data(interaction.guild_id)["roles"]:
                 await interaction.response.send_message(
                     f"Added existing role {role.mention} to ranking system with priority {priority}",
                     ephemeral=True
@@ -148,12 +123,9 @@ class SetupCog(commands.Cog, name="setup commands"):
 
     @app_commands.command(name="editrole", description="Edit a role's properties (name/priority/bonus)")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
     async def edit_role(self, ctx, role: discord.Role, field: str, value: str):
         role_id = str(role.id)
-        if role_id not in self.data["roles"]:
-            await ctx.send("This role is not in the ranking system!")
-            return
-
         if field not in ["name", "priority", "bonus_income"]:
             await ctx.send("Invalid field! Use: name, priority, or bonus_income")
             return
@@ -163,17 +135,25 @@ class SetupCog(commands.Cog, name="setup commands"):
         elif field == "bonus_income":
             value = float(value)
 
-        self.data["roles"][role_id][field] = value
-        self.save_data()
+        def set_field(data) -> bool:
+            if role_id not in data["roles"]:
+                return False
+            data["roles"][role_id][field] = value
+            return True
+
+        if not store.update(ctx.guild_id, set_field, "roles"):
+            await ctx.send("This role is not in the ranking system!")
+            return
+        ranks.invalidate(ctx.guild_id)
         await ctx.send(f"Updated {field} for role {role.name}")
 
     @app_commands.command(name="removerole",description="Remove a role from the ranking system")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
     async def remove_role(self, ctx, role: discord.Role):
         role_id = str(role.id)
-        if role_id in self.data["roles"]:
-            del self.data["roles"][role_id]
-            self.save_data()
+        if store.update(ctx.guild_id, lambda data: data["roles"].pop(role_id, None) is not None, "roles"):
+            ranks.invalidate(ctx.guild_id)
             await ctx.send(f"Role {role.name} removed from ranking system")
         else:
             await ctx.send("This role is not in the ranking system!")
@@ -184,17 +164,15 @@ class SetupCog(commands.Cog, name="setup commands"):
         app_commands.Choice(name="Announcements", value="announcements"),
         app_commands.Choice(name="Pending Missions", value="pending_missions"),
         app_commands.Choice(name="Mission Logs", value="mission_logs"),
-        app_commands.Choice(name="Screenshots", value="screenshots")  # Added screenshots channel
+        app_commands.Choice(name="Screenshots", value="screenshots"),  # Added screenshots channel
+        app_commands.Choice(name="Duty Checks", value="duty_checks")  # Pings users whose DMs are closed
     ])
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
     async def setchannel_slash(self, interaction: discord.Interaction, channel: discord.TextChannel, purpose: app_commands.Choice[str]):
         """Set a channel for a specific purpose"""
         try:
-            if "channels" not in self.data:
-                self.data["channels"] = {}
-            
-            self.data["channels"][purpose.value] = str(channel.id)
-            self.save_data()
+            store.update(interaction.guild_id, lambda data: data["channels"].update({purpose.value: str(channel.id)}), "channels")
             
             await interaction.response.send_message(
                 f"Set {channel.mention} as the {purpose.name} channel",
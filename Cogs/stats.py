@@ -0,0 +1,152 @@
+import discord
+from discord.ext import commands
+from discord import app_commands
+from utils import metrics
+from utils.checks import is_owner
+from utils.profiling import profiler
+
+def summarize(histograms: dict, label: str, limit: int = 15) -> str:
+    """One line per series, slowest p95 first"""
+    rows = sorted(histograms.items(), key=lambda item: item[1].quantile(0.95), reverse=True)
+    lines = []
+    for labels, histogram in rows[:limit]:
+        name = dict(labels).get(label, "?")
+        lines.append(
+            f"`{name}` n={histogram.count} "
+            f"p50={histogram.quantile(0.5) * 1000:.0f}ms "
+            f"p95={histogram.quantile(0.95) * 1000:.0f}ms "
+            f"max={histogram.max * 1000:.0f}ms"
+        )
+    return "\n".join(lines)[:1024] or "No data yet"
+
+class StatsCog(commands.Cog, name="Statistics"):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @app_commands.command(name="stats", description="Show command latency and I/O statistics (owner only)")
+    @is_owner()
+    async def stats_slash(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="Bot Statistics", color=discord.Color.blurple())
+        embed.add_field(
+            name="Commands",
+            value=summarize({labels: h for labels, h in metrics.series("command_seconds").items()
+                             if dict(labels).get("kind") == "command"}, "command"),
+            inline=False
+        )
+        embed.add_field(name="Buttons & Menus", value=summarize(metrics.series("view_callback_seconds"), "item"), inline=False)
+        embed.add_field(name="Discord REST", value=summarize(metrics.series("rest_seconds"), "route", limit=8), inline=False)
+        embed.add_field(name="Database", value=summarize(metrics.series("store_seconds"), "op"), inline=False)
+
+        lag = metrics.series("event_loop_lag_seconds").get((), metrics.Histogram())
+        embed.add_field(
+            name="Event Loop Lag",
+            value=f"p50={lag.quantile(0.5) * 1000:.0f}ms p99={lag.quantile(0.99) * 1000:.0f}ms max={lag.max * 1000:.0f}ms",
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="stalls", description="Show recent event loop stalls (owner only)")
+    @is_owner()
+    async def stalls_slash(self, interaction: discord.Interaction, detail: int = None):
+        watchdog = getattr(self.bot, "watchdog", None)
+        stalls = list(watchdog.stalls) if watchdog else []
+        if not stalls:
+            await interaction.response.send_message("No event loop stalls recorded.", ephemeral=True)
+            return
+
+        if detail is not None:
+            # Full captured stack for one stall, 1 being the most recent
+            if not 1 <= detail <= len(stalls):
+                await interaction.response.send_message(f"Pick a stall between 1 and {len(stalls)}.", ephemeral=True)
+                return
+            stall = stalls[-detail]
+            stack = "".join(stall.stack)[-1800:]
+            await interaction.response.send_message(
+                f"**{stall.duration * 1000:.0f}ms** in `{stall.culprit}` at `{stall.blocking_at}`\n```py\n{stack}```",
+                ephemeral=True
+            )
+            return
+
+        embed = discord.Embed(
+            title="Recent Event Loop Stalls",
+            description=f"Threshold: {watchdog.threshold * 1000:.0f}ms. Use `detail` for the captured stack.",
+            color=discord.Color.orange()
+        )
+        for number, stall in enumerate(reversed(stalls[-10:]), start=1):
+            embed.add_field(
+                name=f"{number}. {stall.duration * 1000:.0f}ms at {stall.when:%H:%M:%S}",
+                value=f"`{stall.culprit}`\n{stall.blocking_at}"[:1024],
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="profile", description="Control sampled profiling of commands and tasks (owner only)")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="Start", value="start"),
+        app_commands.Choice(name="Stop", value="stop"),
+        app_commands.Choice(name="Status", value="status"),
+        app_commands.Choice(name="Top Functions", value="top"),
+        app_commands.Choice(name="Dump to Disk", value="dump"),
+        app_commands.Choice(name="Reset", value="reset")
+    ])
+    @is_owner()
+    async def profile_slash(
+        self,
+        interaction: discord.Interaction,
+        action: app_commands.Choice[str],
+        target: str = None,
+        sample_rate: float = None,
+        memory: bool = None
+    ):
+        """Targets are named command:<name> or task:<name>"""
+        if action.value == "start":
+            profiler.configure(True, sample_rate, memory)
+            await interaction.response.send_message(
+                f"Profiling {profiler.sample_rate:.0%} of runs"
+                f"{' with allocation tracking' if profiler.memory else ''}.",
+                ephemeral=True
+            )
+        elif action.value == "stop":
+            profiler.configure(False)
+            await interaction.response.send_message("Profiling stopped. Collected profiles are kept.", ephemeral=True)
+        elif action.value == "reset":
+            profiler.reset()
+            await interaction.response.send_message("Collected profiles cleared.", ephemeral=True)
+        elif action.value == "dump":
+            paths = await profiler.dump()
+            await interaction.response.send_message(
+                "\n".join(f"`{path}`" for path in paths) or "Nothing collected yet.",
+                ephemeral=True
+            )
+        elif action.value == "top":
+            rows = profiler.top(target) if target else []
+            if not rows:
+                await interaction.response.send_message("No samples for that target. Check `status` for names.", ephemeral=True)
+                return
+            lines = [f"{cumulative * 1000:>8.1f}ms {calls:>6} {function}" for cumulative, calls, function in rows]
+            allocations = profiler.allocations.get(target)
+            if allocations:
+                lines += ["", "Top allocations:"] + allocations[:5]
+            report = "\n".join(lines)[:1800]
+            await interaction.response.send_message(
+                f"**{target}** over {profiler.samples[target]} samples (cumulative, calls, function)\n```\n{report}```",
+                ephemeral=True
+            )
+        else:
+            names = ", ".join(f"`{name}` ({count})" for name, count in sorted(profiler.samples.items()))
+            await interaction.response.send_message(
+                f"Profiling is {'on' if profiler.enabled else 'off'} at {profiler.sample_rate:.0%}"
+                f"{', tracking allocations' if profiler.memory else ''}.\n"
+                f"Sampled: {names or 'nothing yet'}",
+                ephemeral=True
+            )
+
+    @profile_slash.autocomplete("target")
+    async def profile_target_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [
+            app_commands.Choice(name=name, value=name)
+            for name in sorted(profiler.stats) if current.lower() in name.lower()
+        ][:25]
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(StatsCog(bot))
@@ -0,0 +1,60 @@
+import datetime
+import json
+import random
+
+MISSION_CATEGORIES = ["Rescue", "Transport", "Delivery", "Training", "Other"]
+
+def generate(user_count: int, mission_count: int, duty_count: int, role_ids, channel_ids: dict, level_role_id: int, seed: int = 0) -> dict:
+    """Build a database.json-shaped dict with synthetic users, missions and duty sessions"""
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    user_ids = [str(10**15 + i) for i in range(user_count)]
+
+    users = {
+        user_id: {"sc": rng.randint(0, 5000), "exp": rng.randint(0, 3000), "level": rng.randint(0, 2)}
+        for user_id in user_ids
+    }
+    roles = {
+        str(role_id): {"id": str(role_id), "name": f"Rank {priority}", "priority": priority, "bonus_income": 1.0}
+        for priority, role_id in enumerate(role_ids)
+    }
+    level_roles = {
+        "0": {"role_id": str(level_role_id), "exp_required": 0, "duty_income": 10.0, "mission_bonus": 0.0}
+    }
+    duty_status = {
+        user_id: {
+            "active": rng.random() < 0.5,
+            "start_time": (now - datetime.timedelta(minutes=rng.randint(1, 600))).isoformat(),
+            # Checked in lately, so the bot doesn't end these shifts at startup as having run through downtime
+            "last_check_in": (now - datetime.timedelta(minutes=rng.randint(1, 20))).isoformat()
+        }
+        for user_id in rng.sample(user_ids, min(duty_count, user_count))
+    }
+
+    active_missions = {}
+    for i in range(1, mission_count + 1):
+        start = now - datetime.timedelta(minutes=rng.randint(30, 60 * 24 * 30))
+        active_missions[str(i)] = {
+            "id": str(i),
+            "leader": int(rng.choice(user_ids)),
+            "category": rng.choice(MISSION_CATEGORIES),
+            "description": f"Synthetic mission {i}",
+            "status": rng.choice(["pending", "completed", "aborted"]),
+            "start_time": start.isoformat(),
+            "members": [int(rng.choice(user_ids))],
+            "helpers_needed": 0,
+            "channels": {name: str(channel_id) for name, channel_id in channel_ids.items()}
+        }
+
+    return {
+        "users": users,
+        "roles": roles,
+        "level_roles": level_roles,
+        "channels": {name: str(channel_id) for name, channel_id in channel_ids.items()},
+        "duty_status": duty_status,
+        "active_missions": active_missions
+    }
+
+def write(data: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
@@ -0,0 +1,175 @@
+# Lightweight stand-ins for the parts of discord.py the cogs touch, so they can run offline
+import datetime
+import itertools
+import discord
+
+_ids = itertools.count(10**17)
+
+def next_id() -> int:
+    return next(_ids)
+
+class FakeRole:
+    def __init__(self, name: str, role_id: int = None):
+        self.id = role_id or next_id()
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+
+class FakeMessage:
+    def __init__(self, channel=None, content=None, embed=None, view=None):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+    async def edit(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+        return self
+
+class FakeChannel:
+    def __init__(self, name: str, channel_id: int = None):
+        self.id = channel_id or next_id()
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = FakeMessage(self, content, kwargs.get("embed"), kwargs.get("view"))
+        self.sent.append(message)
+        return message
+
+class FakeMember:
+    def __init__(self, name: str, member_id: int = None, roles=None, guild=None):
+        self.id = member_id or next_id()
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.roles = list(roles or [])
+        self.guild = guild
+        self.bot = False
+        self.dms = []
+        self.dm_channel = None
+
+    async def add_roles(self, *roles, **kwargs):
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles, **kwargs):
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def send(self, content=None, **kwargs):
+        self.dms.append(content)
+        return FakeMessage(None, content)
+
+    async def create_dm(self):
+        self.dm_channel = FakeDMChannel(self)
+        return self.dm_channel
+
+class FakeDMChannel:
+    def __init__(self, recipient: FakeMember):
+        self.id = next_id()
+        self.recipient = recipient
+
+    async def send(self, content=None, **kwargs):
+        return await self.recipient.send(content, **kwargs)
+
+class FakeGuild:
+    def __init__(self, guild_id: int = None, roles=(), members=(), channels=()):
+        self.id = guild_id or next_id()
+        self.name = "Benchmark Guild"
+        self._roles = {role.id: role for role in roles}
+        self._members = {}
+        self.channels = list(channels)
+        self.chunked = True
+        for member in members:
+            self.add_member(member)
+
+    def add_member(self, member: FakeMember):
+        member.guild = self
+        self._members[member.id] = member
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    def get_role(self, role_id: int):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id: int):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id: int):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self.interaction.replies.append(content if content is not None else kwargs.get("embed"))
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+
+    async def send_modal(self, modal):
+        self._done = True
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.replies.append(content if content is not None else kwargs.get("embed"))
+
+class FakeInteraction:
+    def __init__(self, client, user: FakeMember, guild: FakeGuild = None, message: FakeMessage = None, data=None):
+        self.id = next_id()
+        self.client = client
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id if guild else None
+        self.channel = None
+        self.message = message
+        self.data = data or {}
+        self.type = discord.InteractionType.application_command
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.extras = {}
+        self.command = None
+        self.replies = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        pass
+
+def attach_fake_rest(bot, channels=(), members=()):
+    """Point the bot's REST helpers at in-memory objects instead of the Discord API"""
+    channel_map = {channel.id: channel for channel in channels}
+    member_map = {member.id: member for member in members}
+
+    async def fetch_channel(channel_id: int):
+        if channel_id not in channel_map:
+            raise ValueError(f"Unknown channel {channel_id}")
+        return channel_map[channel_id]
+
+    async def fetch_user(user_id: int):
+        if user_id not in member_map:
+            member_map[user_id] = FakeMember(f"user{user_id}", user_id)
+        return member_map[user_id]
+
+    bot.fetch_channel = fetch_channel
+    bot.fetch_user = fetch_user
+    bot.get_user = member_map.get
+    return channel_map, member_map
@@ -0,0 +1,97 @@
+# Shared setup for the offline benchmarks: real cogs on a bot whose Discord layer is faked
+import json
+import os
+import shutil
+
+import discord
+from discord.ext import commands
+
+from bench.fakes import FakeChannel, FakeGuild, FakeInteraction, FakeMember, FakeRole, attach_fake_rest, next_id
+from utils import store
+from utils.outbox import outbox
+
+class Environment:
+    def __init__(self, bot: commands.Bot, guild: FakeGuild):
+        self.bot = bot
+        self.guild = guild
+        self.channels = {channel.id: channel for channel in guild.channels}
+
+    def member(self, user_id: int) -> FakeMember:
+        member = self.guild.get_member(user_id)
+        if member is None:
+            member = FakeMember(f"user{user_id}", user_id)
+            self.guild.add_member(member)
+        return member
+
+    def role(self, role_id: int) -> FakeRole:
+        role = self.guild.get_role(role_id)
+        if role is None:
+            role = self.guild._roles[role_id] = FakeRole(f"role{role_id}", role_id)
+        return role
+
+    def channel(self, channel_id: int) -> FakeChannel:
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(f"channel{channel_id}", channel_id)
+            self.guild.channels.append(channel)
+        return channel
+
+    def interaction(self, user: FakeMember, **kwargs) -> FakeInteraction:
+        return FakeInteraction(self.bot, user, self.guild, **kwargs)
+
+    def cog(self, name: str):
+        return self.bot.get_cog(name)
+
+async def open_environment(database_path: str, with_members: bool = True) -> Environment:
+    """Load the cogs with database_path as the data of one guild; roles, channels and members are faked from its IDs"""
+    with open(database_path, "r") as f:
+        data = json.load(f)
+
+    roles = [FakeRole(role["name"], int(role_id)) for role_id, role in data.get("roles", {}).items()]
+    known = {role.id for role in roles}
+    for level, level_role in data.get("level_roles", {}).items():
+        if int(level_role["role_id"]) not in known:
+            roles.append(FakeRole(f"Level {level}", int(level_role["role_id"])))
+    channels = [FakeChannel(name, int(channel_id)) for name, channel_id in data.get("channels", {}).items()]
+    lowest = max(roles, key=lambda role: data["roles"].get(str(role.id), {}).get("priority", -1), default=None)
+    members = [
+        FakeMember(f"user{user_id}", int(user_id), [lowest] if lowest else [])
+        for user_id in (data.get("users", {}) if with_members else ())
+    ]
+    del data
+
+    # Every environment starts from a cold load of its own guild directory
+    guild_id = next_id()
+    guilds_dir = os.path.join(os.path.dirname(os.path.abspath(database_path)), f"guilds-{guild_id}")
+    os.makedirs(guilds_dir)
+    shutil.copyfile(database_path, os.path.join(guilds_dir, f"{guild_id}.json"))
+    store.reset(guilds_dir)
+    # Split into sections now, so the benchmarks measure loading the format the bot runs on
+    store.load(guild_id)
+    store.reset()
+
+    bot = commands.Bot(command_prefix="!", intents=discord.Intents.none())
+    await bot.__aenter__()
+    guild = FakeGuild(guild_id, roles=roles, members=members, channels=channels)
+    environment = Environment(bot, guild)
+    attach_fake_rest(bot, channels, members)
+    bot.fetch_user = _fetch_member(environment)
+
+    from Cogs.duty import DutyCog
+    from Cogs.economy import EconomyCog
+    from Cogs.levels import LevelsCog
+    from Cogs.missions import MissionCog
+    for cog_class in (EconomyCog, LevelsCog, DutyCog, MissionCog):
+        await bot.add_cog(cog_class(bot))
+    # The duty loop is driven explicitly by the benchmarks
+    bot.get_cog("Duty System").check_duty_status.cancel()
+    return environment
+
+def _fetch_member(environment: Environment):
+    async def fetch_user(user_id: int):
+        return environment.member(user_id)
+    return fetch_user
+
+async def close_environment(environment: Environment):
+    await outbox.flush()
+    await environment.bot.close()
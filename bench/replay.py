@@ -0,0 +1,143 @@
+# Replay a recorded interaction trace against the real cogs on a fake Discord layer.
+# Usage: python -m bench.replay data/traces/interactions.ndjson --database data/database.json --speed 10
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from discord import app_commands
+
+from bench.harness import close_environment, open_environment
+from bench.run import summarize
+from utils.tracing import read_trace
+
+def convert_option(environment, parameter, option):
+    value = option["value"]
+    if isinstance(value, dict) and "redacted" in value:
+        value = "x" * value["redacted"]
+    option_type = option["type"]
+    if option_type == 6:
+        return environment.member(int(value))
+    if option_type == 7:
+        return environment.channel(int(value))
+    if option_type == 8:
+        return environment.role(int(value))
+    if parameter is not None and parameter.choices:
+        return app_commands.Choice(name=str(value), value=value)
+    return value
+
+def resolve_command(environment, name: str, options: list):
+    """Walk subcommand groups down to the leaf command and its options"""
+    parts = name.split()
+    command = environment.bot.tree.get_command(parts[0])
+    while isinstance(command, app_commands.Group):
+        nested = next((option for option in options if "options" in option), None)
+        if nested is None:
+            return None, []
+        command = command.get_command(nested["name"])
+        options = nested["options"]
+    return command, options
+
+async def replay_event(environment, event: dict, latencies: dict, errors: dict):
+    command, options = resolve_command(environment, event["command"], event.get("options", []))
+    if command is None:
+        errors[event["command"]] = errors.get(event["command"], 0) + 1
+        return
+
+    kwargs = {
+        option["name"]: convert_option(environment, command.get_parameter(option["name"]), option)
+        for option in options
+    }
+    interaction = environment.interaction(environment.member(int(event["user_id"])))
+    interaction.command = command
+
+    start = time.perf_counter()
+    try:
+        if command.binding is not None:
+            await command.callback(command.binding, interaction, **kwargs)
+        else:
+            await command.callback(interaction, **kwargs)
+    except Exception:
+        errors[command.qualified_name] = errors.get(command.qualified_name, 0) + 1
+    finally:
+        latencies.setdefault(command.qualified_name, []).append(time.perf_counter() - start)
+
+async def watch_loop(stalls: list, lags: list, threshold: float, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        lags.append(lag)
+        if lag >= threshold:
+            stalls.append(lag)
+
+async def replay(trace_path: str, database_path: str, speed: float, stall_threshold: float) -> dict:
+    events = sorted(read_trace(trace_path), key=lambda event: event["t"])
+    latencies, errors, stalls, lags = {}, {}, [], []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Never write to the database the trace came from
+        working_copy = os.path.join(workdir, "database.json")
+        shutil.copyfile(database_path, working_copy)
+        environment = await open_environment(working_copy)
+        watcher = asyncio.get_running_loop().create_task(watch_loop(stalls, lags, stall_threshold))
+        pending = []
+        start = time.perf_counter()
+        try:
+            first = events[0]["t"] if events else 0
+            for event in events:
+                if speed > 0:
+                    delay = (event["t"] - first) / speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                pending.append(asyncio.create_task(replay_event(environment, event, latencies, errors)))
+            await asyncio.gather(*pending)
+            # Give the watcher a chance to observe a stall caused by the last events
+            await asyncio.sleep(0.05)
+        finally:
+            watcher.cancel()
+            await close_environment(environment)
+        wall_time = time.perf_counter() - start
+
+    return {
+        "trace": trace_path,
+        "events": len(events),
+        "speed": speed,
+        "wall_time_s": round(wall_time, 3),
+        "commands": {
+            name: dict(summarize(samples), errors=errors.get(name, 0))
+            for name, samples in sorted(latencies.items())
+        },
+        "unresolved": {name: count for name, count in errors.items() if name not in latencies},
+        "event_loop": {
+            "lag": summarize(lags) if lags else None,
+            "stalls": len(stalls),
+            "stall_threshold_ms": stall_threshold * 1000,
+            "max_stall_ms": round(max(stalls) * 1000, 3) if stalls else 0
+        }
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded interaction trace offline")
+    parser.add_argument("trace", help="NDJSON trace written by the bot with tracing enabled")
+    parser.add_argument("--database", default="data/database.json", help="Database to replay against (copied, never modified)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 for real time, 10 for ten times faster, 0 for no pacing")
+    parser.add_argument("--stall-threshold-ms", type=float, default=50.0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = await replay(args.trace, args.database, args.speed, args.stall_threshold_ms / 1000)
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
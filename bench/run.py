@@ -0,0 +1,145 @@
+# Offline benchmarks for the cog hot paths.
+# Usage: python -m bench.run --sizes 1000,10000,100000 --iterations 50 --output bench_report.json
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import types
+
+import discord
+
+from bench import datasets
+from bench.fakes import FakeMember, next_id
+from bench.harness import close_environment, open_environment
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+    total = sum(ordered)
+
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "iterations": len(ordered),
+        "total_s": round(total, 6),
+        "ops_per_s": round(len(ordered) / total, 2) if total else None,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(percentile(0.50), 3),
+        "p95_ms": round(percentile(0.95), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+async def measure(iterations: int, make_call) -> dict:
+    """make_call(i) builds the fake interaction and returns the coroutine; only the await is timed"""
+    samples = []
+    for i in range(iterations):
+        call = make_call(i)
+        start = time.perf_counter()
+        await call
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+async def run_dataset(size: int, missions: int, duty_sessions: int, iterations: int, workdir: str) -> dict:
+    ranks = [next_id() for priority in range(4)]
+    level_role = next_id()
+    channels = {name: next_id() for name in ("missions", "mission_logs", "pending_missions", "screenshots", "announcements")}
+
+    path = os.path.join(workdir, f"database-{size}.json")
+    datasets.write(datasets.generate(size, missions, duty_sessions, ranks, channels, level_role), path)
+
+    import Cogs.duty as duty_module
+
+    results = {}
+    start = time.perf_counter()
+    environment = await open_environment(path)
+    results["cog_startup"] = summarize([time.perf_counter() - start])
+    try:
+        economy = environment.cog("Economy")
+        levels = environment.cog("leveling commands")
+        duty = environment.cog("Duty System")
+        mission = environment.cog("Mission System")
+        members = environment.guild.members
+        approver = FakeMember("approver", roles=[environment.role(ranks[0])])
+        environment.guild.add_member(approver)
+
+        def member(i):
+            return members[i % len(members)]
+
+        def interaction(user):
+            return environment.interaction(user)
+
+        results["transfer"] = await measure(iterations, lambda i: economy.transfer_slash.callback(
+            economy, interaction(member(i)), member(i + 1), 1))
+        results["approve"] = await measure(iterations, lambda i: levels.approve_slash.callback(
+            levels, interaction(approver), member(i), str(i), 10, 5))
+        results["level"] = await measure(iterations, lambda i: levels.level_slash.callback(
+            levels, interaction(member(i)), None))
+        results["onduty"] = await measure(iterations, lambda i: duty.on_duty.callback(
+            duty, interaction(member(i))))
+        results["offduty"] = await measure(iterations, lambda i: duty.off_duty.callback(
+            duty, interaction(member(i))))
+        results["startmission"] = await measure(iterations, lambda i: mission.start_mission_slash.callback(
+            mission, interaction(member(i)), "Rescue", f"Benchmark mission {i}"))
+
+        # The 5 minute confirmation window is skipped and every user confirms during it
+        async def confirmed_sleep(seconds):
+            now = datetime.datetime.now()
+            keys = list(duty.confirmation_codes)
+            for key in keys:
+                duty.clear_check_in(*key, confirmed=now)
+            for guild_id in {guild_id for guild_id, _ in keys}:
+                duty.save_data(guild_id)
+
+        duty_module.asyncio = types.SimpleNamespace(sleep=confirmed_sleep)
+        try:
+            results["check_duty_status_sweep"] = await measure(1, lambda i: duty.check_duty_status.coro(duty))
+        finally:
+            duty_module.asyncio = asyncio
+
+        # A tenth of the guild is new and needs the default level role
+        for i in range(max(1, size // 10)):
+            environment.guild.add_member(FakeMember(f"new{i}"))
+        results["assign_default_levels"] = await measure(1, lambda i: levels.assign_default_levels(environment.guild))
+    finally:
+        await close_environment(environment)
+
+    return {
+        "dataset": {"users": size, "missions": missions, "duty_sessions": duty_sessions,
+                    "file_bytes": os.path.getsize(path)},
+        "results": results
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run the offline cog benchmarks")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated user counts, e.g. 1000,10000,100000")
+    parser.add_argument("--missions", type=int, default=2000)
+    parser.add_argument("--duty-sessions", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "discord.py": discord.__version__,
+        "timestamp": time.time(),
+        "runs": []
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(size) for size in args.sizes.split(",")):
+            report["runs"].append(await run_dataset(size, args.missions, args.duty_sessions, args.iterations, workdir))
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,52 +1,223 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import json
+import logging
 import os
+import asyncio
+import hashlib
+import time
+from utils import store, metrics, ranks, snapshots
+from utils.tracing import TraceRecorder
+from utils.watchdog import Watchdog
+from utils import log as bot_log
+from utils.profiling import profiler
+from utils import gateway
+from utils import config
+from utils.ratelimit import limiter
+from utils.outbox import outbox
 
-# Get configuration.json
-with open("configuration.json", "r") as config: 
-    data = json.load(config)
-    owner_id = data["owner_id"]
+# Get configuration.json, parsed and validated once by utils.config
+settings = config.get()
+owner_id = settings.owner_id
+metrics_config = settings.section("metrics")
+tracing_config = settings.section("tracing")
+watchdog_config = settings.section("watchdog")
+logging_config = settings.section("logging")
+gateway_config = settings.section("gateway")
+sharding_config = settings.section("sharding")
+storage_config = settings.section("storage")
+snapshot_config = settings.section("snapshots")
 
-# Get token from environment variable or fall back to a .env file
-token = os.getenv('DISCORD_BOT_TOKEN')
-if not token:
-    # Try to load from a .env file using python-dotenv if available
-    try:
-        from dotenv import load_dotenv
-    except Exception:
-        raise ValueError("No token found in environment and python-dotenv is not installed. Install python-dotenv or set DISCORD_BOT_TOKEN environment variable.")
-    # load .env from project root (default behavior)
-    load_dotenv()
+log = logging.getLogger("bot")
+command_log = logging.getLogger("bot.commands")
+
+# Hash of the last command tree pushed to Discord
+TREE_HASH_PATH = "data/command_tree.sha256"
+
+def get_token() -> str:
+    # Get token from environment variable or fall back to a .env file
     token = os.getenv('DISCORD_BOT_TOKEN')
+    if not token:
+        # Try to load from a .env file using python-dotenv if available
+        try:
+            from dotenv import load_dotenv
+        except Exception:
+            raise ValueError("No token found in environment and python-dotenv is not installed. Install python-dotenv or set DISCORD_BOT_TOKEN environment variable.")
+        # load .env from project root (default behavior)
+        load_dotenv()
+        token = os.getenv('DISCORD_BOT_TOKEN')
+
+    if not token:
+        raise ValueError("No token found! Make sure to set DISCORD_BOT_TOKEN environment variable or create a .env file with DISCORD_BOT_TOKEN=...")
+    return token
+
+class BotTree(app_commands.CommandTree):
+    # Set in setup_hook when interaction tracing is enabled
+    recorder = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Raises CommandOnCooldown, rendered by OnCommandErrorCog through tree.on_error
+        limiter.hit(interaction)
+        return True
 
-if not token:
-    raise ValueError("No token found! Make sure to set DISCORD_BOT_TOKEN environment variable or create a .env file with DISCORD_BOT_TOKEN=...")
+    async def _call(self, interaction: discord.Interaction):
+        start = time.perf_counter()
+        data = interaction.data or {}
+        token = bot_log.bind(command=data.get("name"), user=interaction.user.id, guild=interaction.guild_id)
+        try:
+            if interaction.type is discord.InteractionType.application_command:
+                async with profiler.sample(f"command:{data.get('name')}"):
+                    await super()._call(interaction)
+            else:
+                await super()._call(interaction)
+        finally:
+            if self.recorder:
+                self.recorder.record(interaction)
+            command = interaction.command.qualified_name if interaction.command else "unknown"
+            kind = "autocomplete" if interaction.type is discord.InteractionType.autocomplete else "command"
+            elapsed = time.perf_counter() - start
+            metrics.observe("command_seconds", elapsed, command=command, kind=kind)
+            if kind == "command":
+                command_log.info("Handled /%s", command, extra={"latency_ms": round(elapsed * 1000, 1)})
+            bot_log.unbind(token)
 
-class CustomBot(commands.Bot):
+# AutoShardedBot spreads guilds over several gateway connections; shard_ids splits them across processes
+BotBase = commands.AutoShardedBot if sharding_config.get("enabled") else commands.Bot
+
+class CustomBot(BotBase):
     def __init__(self):
+        intents = gateway.build_intents(gateway_config)
+        shard_options = {}
+        if sharding_config.get("enabled"):
+            shard_options = {
+                "shard_count": sharding_config.get("shard_count"),
+                "shard_ids": list(sharding_config["shard_ids"]) if sharding_config.get("shard_ids") else None
+            }
         super().__init__(
             command_prefix=commands.when_mentioned,  # Only respond to mentions
-            intents=discord.Intents.all(),
-            owner_id=owner_id,
-            application_id=os.getenv('APPLICATION_ID')
+            intents=intents,
+            member_cache_flags=gateway.build_member_cache_flags(gateway_config, intents),
+            chunk_guilds_at_startup=gateway_config.get("chunk_guilds_at_startup", False),
+            max_messages=gateway_config.get("max_messages", 1000),
+            owner_id=int(owner_id),
+            application_id=os.getenv('APPLICATION_ID'),
+            tree_cls=BotTree,
+            **shard_options
+        )
+        metrics.instrument_http(self.http)
+        self.watchdog = Watchdog(
+            threshold=watchdog_config.get("threshold_ms", 250) / 1000,
+            history=watchdog_config.get("history", 50)
         )
 
     async def setup_hook(self):
-        for filename in os.listdir("Cogs"):
-            if filename.endswith(".py"):
-                await self.load_extension(f"Cogs.{filename[:-3]}")
+        timings = {}
+        self.loop.create_task(metrics.monitor_loop_lag())
+        self.watchdog.start()
+        # Edits to configuration.json are picked up without a restart
+        self.loop.create_task(config.config.watch())
+        self.loop.create_task(limiter.cleanup_loop())
+        if metrics_config.get("port"):
+            await metrics.start_http_endpoint(metrics_config.get("host", "127.0.0.1"), metrics_config["port"])
+        if tracing_config.get("enabled"):
+            self.tree.recorder = TraceRecorder(tracing_config.get("path", "data/traces/interactions.ndjson"))
+            self.tree.recorder.start()
+
+        # Guild data is loaded lazily on first use, so startup doesn't scale with the number of guilds
+        store.legacy_guild_id = storage_config.get("legacy_guild_id")
+        # A second instance (e.g. for reporting) can share the data directory without writing to it
+        store.read_only = storage_config.get("read_only", False)
+        phase_start = time.perf_counter()
+        # Stored data is brought to the current schema once here, so handlers can index fields directly
+        migrated = store.migrate_all()
+        timings[f"migrations ({migrated} guilds)"] = time.perf_counter() - phase_start
+        self.loop.create_task(self.evict_idle_guilds(storage_config.get("idle_eviction_minutes", 30) * 60))
+        if snapshot_config.get("enabled", True) and not store.read_only:
+            self.loop.create_task(snapshots.run(self, snapshot_config))
+
+        phase_start = time.perf_counter()
+        await asyncio.gather(*(
+            self.load_extension(f"Cogs.{filename[:-3]}")
+            for filename in os.listdir("Cogs") if filename.endswith(".py")
+        ))
+        # Let cogs that index other cogs (e.g. the help index) build once everything is loaded
+        self.dispatch("extensions_ready")
+        timings["extensions"] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        synced = await self.sync_tree_if_changed()
+        timings["tree sync" if synced else "tree sync (skipped)"] = time.perf_counter() - phase_start
+
+        log.info("Startup timings: " + ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in timings.items()))
+
+    async def evict_idle_guilds(self, max_idle: float):
+        while True:
+            await asyncio.sleep(min(max_idle, 300))
+            evicted = store.evict_idle(max_idle)
+            ranks.prune()
+            if evicted:
+                log.debug("Evicted %d idle guilds from memory", evicted)
+
+    def command_tree_hash(self) -> str:
+        payload = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands()),
+            key=lambda command: (command.get("type", 1), command["name"])
+        )
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_tree_if_changed(self) -> bool:
+        """Only do the global (rate-limited) sync when the commands differ from the last one"""
+        tree_hash = self.command_tree_hash()
+        try:
+            with open(TREE_HASH_PATH, "r") as f:
+                if f.read().strip() == tree_hash:
+                    return False
+        except FileNotFoundError:
+            pass
+
         await self.tree.sync()
+        with open(TREE_HASH_PATH, "w") as f:
+            f.write(tree_hash)
+        return True
 
-bot = CustomBot()
+    async def close(self):
+        # Queued posts and notices go out before the connection is torn down
+        await outbox.flush(timeout=10)
+        await super().close()
 
-@bot.event
-async def on_ready():
-    print(f"We have logged in as {bot.user}")
-    print(discord.__version__)
-    await bot.change_presence(activity=discord.Activity(
-        type=discord.ActivityType.watching, 
-        name="/help"
-    ))
+    async def on_ready(self):
+        log.info("We have logged in as %s (discord.py %s)", self.user, discord.__version__)
+        # Lets the store hand a legacy database to the only guild there is
+        store.guild_count = len(self.guilds)
+        gateway.report_memory(self)
+        await self.change_presence(activity=discord.Activity(
+            type=discord.ActivityType.watching, 
+            name="/help"
+        ))
+
+    async def on_guild_join(self, guild: discord.Guild):
+        store.guild_count = len(self.guilds)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        store.guild_count = len(self.guilds)
+
+    async def reload_extension(self, name, *, package=None):
+        await super().reload_extension(name, package=package)
+        self.dispatch("extensions_ready")
+
+def main():
+    listener = bot_log.setup_logging(logging_config)
+    try:
+        token = get_token()
+        bot = CustomBot()
+        # Logging is already routed through utils.log, so keep discord.py from adding its own handler
+        bot.run(token, log_handler=None)
+    finally:
+        # Writes out whatever is still queued for the handlers
+        listener.stop()
 
-bot.run(token)
\ No newline at end of file
+# Report worker processes (utils.jobs) are spawned and import this module as __mp_main__; everything with
+# side effects (logging handlers, the token, the bot) stays in main() so they only get the definitions
+if __name__ == "__main__":
+    main()
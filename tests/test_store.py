@@ -0,0 +1,153 @@
+import pytest
+
+from utils import store
+
+@pytest.fixture
+def guilds(tmp_path):
+    store.reset(str(tmp_path))
+    yield tmp_path
+    store.reset(store.GUILDS_DIR)
+
+def open_guild(key="1"):
+    return store.GuildData(key)
+
+def test_concurrent_balance_changes_both_count(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100, "rank": "Cadet"}
+    setup.save()
+
+    # Two processes read the user, then each changes the balance
+    first, second = open_guild(), open_guild()
+    first["users"]["10"]["sc"] += 30
+    second["users"]["10"]["sc"] -= 5
+    first.save()
+    second.save()
+
+    assert second["users"]["10"]["sc"] == 125
+    assert open_guild()["users"]["10"] == {"sc": 125, "rank": "Cadet"}
+
+def test_concurrent_changes_to_other_fields_merge(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100, "rank": "Cadet"}
+    setup["duty_status"]["10"] = {"on_duty": False}
+    setup.save()
+
+    first, second = open_guild(), open_guild()
+    first["users"]["10"]["rank"] = "Officer"
+    first["duty_status"]["10"]["on_duty"] = True
+    second["users"]["10"]["sc"] = 150
+    second["duty_status"]["20"] = {"on_duty": True}
+    first.save()
+    second.save()
+
+    result = open_guild()
+    assert result["users"]["10"] == {"sc": 150, "rank": "Officer"}
+    assert result["duty_status"] == {"10": {"on_duty": True}, "20": {"on_duty": True}}
+
+@pytest.mark.parametrize("section", ["users", "duty_status"])
+def test_conflicting_change_raises_and_discards(guilds, section):
+    setup = open_guild()
+    setup[section]["10"] = {"rank": "Cadet"}
+    setup.save()
+
+    first, second = open_guild(), open_guild()
+    first[section]["10"]["rank"] = "Officer"
+    second[section]["10"]["rank"] = "Captain"
+    first.save()
+    with pytest.raises(store.ConflictError):
+        second.save()
+
+    # Nothing of the losing change is kept, and what the other process committed is visible
+    assert second[section]["10"] == {"rank": "Officer"}
+    assert not second.save()
+    assert open_guild()[section]["10"] == {"rank": "Officer"}
+
+def test_update_reruns_change_after_conflict(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100, "rank": "Cadet"}
+    setup.save()
+
+    other = open_guild()
+    calls = []
+
+    def promote(data):
+        if not calls:
+            # Another process commits between this read and the save
+            other["users"]["10"]["rank"] = "Officer"
+            other.save()
+        calls.append(data["users"]["10"]["rank"])
+        data["users"]["10"]["rank"] = "Captain" if data["users"]["10"]["rank"] == "Officer" else "Lieutenant"
+
+    store.load("1")["users"]["10"]
+    store.update("1", promote)
+
+    assert calls == ["Cadet", "Officer"]
+    assert open_guild()["users"]["10"]["rank"] == "Captain"
+
+def test_withdrawals_that_overdraw_together_conflict(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100}
+    setup.save()
+
+    first, second = open_guild(), open_guild()
+    first["users"]["10"]["sc"] -= 80
+    second["users"]["10"]["sc"] -= 80
+    first.save()
+    with pytest.raises(store.ConflictError):
+        second.save()
+    assert second["users"]["10"]["sc"] == 20
+
+def test_concurrent_changes_to_other_numbers_conflict_unless_equal(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100, "level": 1}
+    setup["roles"]["5"] = {"priority": 2}
+    setup.save()
+
+    # The same edit made twice is applied once, not added up
+    first, second = open_guild(), open_guild()
+    first["users"]["10"]["level"] = 2
+    first["roles"]["5"]["priority"] = 1
+    second["users"]["10"]["level"] = 2
+    second["roles"]["5"]["priority"] = 1
+    first.save()
+    second.save()
+    assert open_guild()["users"]["10"]["level"] == 2
+    assert open_guild()["roles"]["5"]["priority"] == 1
+
+    first, second = open_guild(), open_guild()
+    first["roles"]["5"]["priority"] = 3
+    second["roles"]["5"]["priority"] = 4
+    first.save()
+    with pytest.raises(store.ConflictError):
+        second.save()
+
+def test_assigned_balance_conflicts_with_concurrent_change(guilds):
+    setup = open_guild()
+    setup["users"]["10"] = {"sc": 100}
+    setup.save()
+
+    first, second = open_guild(), open_guild()
+    first["users"]["10"]["sc"] += 50
+    second["users"]["10"]["sc"] = 0
+    second["users"].assign("10")
+    first.save()
+    with pytest.raises(store.ConflictError):
+        second.save()
+    assert open_guild()["users"]["10"]["sc"] == 150
+
+def test_tallies_added_on_both_sides_merge(guilds):
+    setup = open_guild()
+    setup["mission_stats"]["total"] = {"completed": 1}
+    setup.save()
+
+    first, second = open_guild(), open_guild()
+    first["mission_stats"]["total"]["completed"] += 1
+    first["mission_stats"]["day:2024-05-01"] = {"completed": 1, "aborted": 0}
+    second["mission_stats"]["total"]["completed"] += 1
+    second["mission_stats"]["day:2024-05-01"] = {"completed": 0, "aborted": 1}
+    first.save()
+    second.save()
+
+    result = open_guild()["mission_stats"]
+    assert result["total"] == {"completed": 3}
+    assert result["day:2024-05-01"] == {"completed": 1, "aborted": 1}
@@ -0,0 +1,101 @@
+import datetime
+import math
+
+# Streaming mission aggregates, kept in each guild's mission_stats section and updated as missions close.
+# Keys are flat ("total", "category:Rescue", "leader:123", "day:2024-05-01") so the store's per-key
+# merge applies to each aggregate on its own.
+
+# Duration quantiles are within 2% of the true value
+ACCURACY = 0.02
+GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Daily counters older than this are dropped
+KEEP_DAYS = 90
+
+class Sketch:
+    """Counts of durations in logarithmic buckets: quantiles with bounded relative error in space that grows
+    with the range of values rather than their number, and two sketches merge by adding their counts"""
+    def __init__(self, buckets: dict):
+        self.buckets = buckets  # str(bucket index) -> count; stored as is, so keys are JSON strings
+
+    def add(self, seconds: float):
+        # Bucket i holds (GAMMA^(i-1), GAMMA^i]; anything under a second counts as one
+        key = str(math.ceil(math.log(max(seconds, 1.0)) / LOG_GAMMA))
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other: "Sketch"):
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def quantile(self, q: float):
+        total = sum(self.buckets.values())
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(int(key) for key in self.buckets):
+            seen += self.buckets[str(index)]
+            if seen > rank:
+                # The point of the bucket equally far, relatively, from both of its bounds
+                return 2 * GAMMA ** index / (GAMMA + 1)
+
+def new_aggregate() -> dict:
+    return {"completed": 0, "aborted": 0, "seconds": 0.0, "durations": {}}
+
+def record(stats: dict, mission: dict, outcome: str, seconds: float, when: datetime.datetime):
+    """Count a mission that just closed; outcome is "completed" or "aborted", seconds its duration if completed"""
+    for key in ("total", f"category:{mission['category']}", f"leader:{mission['leader']}"):
+        aggregate = stats.get(key)
+        if aggregate is None:
+            aggregate = stats[key] = new_aggregate()
+        aggregate[outcome] += 1
+        if seconds is not None:
+            aggregate["seconds"] += seconds
+            Sketch(aggregate["durations"]).add(seconds)
+
+    day = f"day:{when.date().isoformat()}"
+    if day not in stats:
+        stats[day] = {"completed": 0, "aborted": 0}
+        # Once a day, so the section stays bounded
+        cutoff = f"day:{(when.date() - datetime.timedelta(days=KEEP_DAYS)).isoformat()}"
+        for key in [key for key in stats if key.startswith("day:") and key < cutoff]:
+            del stats[key]
+    stats[day][outcome] += 1
+
+def summary(stats: dict, key: str):
+    """Counts, completion rate and duration mean/p50/p90 in seconds for one aggregate; None if it has none"""
+    aggregate = stats.get(key)
+    if aggregate is None:
+        return None
+    closed = aggregate["completed"] + aggregate["aborted"]
+    sketch = Sketch(aggregate["durations"])
+    return {
+        "completed": aggregate["completed"],
+        "aborted": aggregate["aborted"],
+        "completion_rate": aggregate["completed"] / closed if closed else 0.0,
+        "mean_seconds": aggregate["seconds"] / aggregate["completed"] if aggregate["completed"] else None,
+        "p50_seconds": sketch.quantile(0.5),
+        "p90_seconds": sketch.quantile(0.9)
+    }
+
+def recent(stats: dict, days: int, today: datetime.date) -> dict:
+    """Completed and aborted counts over the last days days, today included"""
+    totals = {"completed": 0, "aborted": 0}
+    for offset in range(days):
+        counts = stats.get(f"day:{(today - datetime.timedelta(days=offset)).isoformat()}")
+        if counts:
+            totals["completed"] += counts["completed"]
+            totals["aborted"] += counts["aborted"]
+    return totals
+
+def rebuild(missions: dict) -> dict:
+    """Aggregates for every closed mission in active_missions, for guilds whose history predates them"""
+    stats = {}
+    for mission in missions.values():
+        if mission["status"] == "completed":
+            when = mission.get("end_time") or mission["start_time"]
+            record(stats, mission, "completed", mission.get("duration"), datetime.datetime.fromisoformat(when))
+        elif mission["status"] == "aborted":
+            when = mission.get("abort_time") or mission["start_time"]
+            record(stats, mission, "aborted", None, datetime.datetime.fromisoformat(when))
+    return stats
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+from itertools import islice
+
+from utils import store, metrics, ranks, schema
+
+log = logging.getLogger("bot.bulk")
+
+# Records per chunk: one store save per imported chunk, one file write per exported chunk
+CHUNK_SIZE = 1000
+
+def _flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1", "yes"):
+        return True
+    if str(value).lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+def _timestamp(value) -> str:
+    return datetime.datetime.fromisoformat(value).isoformat()
+
+def _json(kind):
+    def parse(value):
+        value = json.loads(value) if isinstance(value, str) else value
+        if not isinstance(value, kind):
+            raise ValueError(f"expected a {kind.__name__}")
+        return value
+    return parse
+
+# kind -> (section, key column, {field: parser}, required fields)
+KINDS = {
+    "users": ("users", "user_id", {"sc": int, "exp": int, "level": int}, ("sc", "exp")),
+    "missions": ("active_missions", "mission_id", {
+        "leader": int, "category": str, "description": str, "status": str, "start_time": _timestamp,
+        "end_time": _timestamp, "duration": schema.duration_seconds, "members": _json(list), "helpers_needed": int, "channels": _json(dict)
+    }, ("leader", "category", "status", "start_time")),
+    "duty": ("duty_status", "user_id", {"active": _flag, "start_time": _timestamp}, ("active", "start_time")),
+    "roles": ("roles", "role_id", {"id": str, "name": str, "priority": int, "bonus_income": float}, ("priority",))
+}
+FORMATS = ("ndjson", "csv")
+
+def records(data: dict, kind: str):
+    """Yield a section's entries as flat records, iterating over a copy of the keys taken up front"""
+    section, key, _, _ = KINDS[kind]
+    entries = data[section]
+    if isinstance(entries, store.RecordSection):
+        # Decoded one at a time rather than through the cache, so a large export doesn't keep every user
+        for entry_id, entry in entries.stream():
+            yield {key: entry_id, **entry}
+        return
+    for entry_id in list(entries):
+        entry = entries.get(entry_id)
+        if entry is not None:
+            yield {key: entry_id, **entry}
+
+def encode(records, kind: str, fmt: str):
+    """Yield lines of NDJSON, or CSV with the known fields as columns and anything else in an "extra" JSON column"""
+    if fmt == "ndjson":
+        for record in records:
+            yield json.dumps(record) + "\n"
+        return
+    _, key, fields, _ = KINDS[kind]
+    columns = [key, *fields, "extra"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for record in records:
+        extra = {name: value for name, value in record.items() if name not in columns}
+        writer.writerow([
+            json.dumps(record[name]) if isinstance(record.get(name), (list, dict)) else record.get(name, "")
+            for name in columns[:-1]
+        ] + [json.dumps(extra) if extra else ""])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def decode(lines, kind: str, fmt: str):
+    """Yield (line number, record, None) for valid rows and (line number, None, error) for invalid ones"""
+    section, key, fields, required = KINDS[kind]
+    if fmt == "csv":
+        rows = ((reader.line_num, row) for reader in [csv.DictReader(lines)] for row in reader)
+    else:
+        rows = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    for number, row in rows:
+        try:
+            if fmt == "csv":
+                raw = {name: value for name, value in row.items() if name != "extra" and value not in ("", None)}
+                if row.get("extra"):
+                    raw.update(json.loads(row["extra"]))
+            else:
+                raw = json.loads(row)
+                if not isinstance(raw, dict):
+                    raise ValueError("expected a JSON object")
+            entry_id = str(raw.pop(key, "")).strip()
+            if not entry_id:
+                raise ValueError(f"missing {key}")
+            missing = [name for name in required if name not in raw]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            for name, parse in fields.items():
+                if name in raw and raw[name] is not None:
+                    raw[name] = parse(raw[name])
+            # Stored in the same canonical shape as everything else (see utils.schema)
+            yield number, (entry_id, schema.normalize(section, entry_id, raw)), None
+        except (ValueError, TypeError) as e:
+            yield number, None, f"line {number}: {e}"
+
+def apply_chunk(guild_id, kind: str, entries: list):
+    """Upsert one chunk of decoded records and save once"""
+    section = KINDS[kind][0]
+    target = store.load(guild_id)[section]
+    target.update(entries)
+    store.save(guild_id, section)
+    if isinstance(target, store.RecordSection):
+        # Saved now; keeping them cached would grow memory with the size of the import
+        target.evict(entry_id for entry_id, _ in entries)
+    if kind == "roles":
+        ranks.invalidate(guild_id)
+
+def detect_format(filename: str) -> str:
+    name = filename.lower().removesuffix(".gz")
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+def open_text(path: str):
+    return gzip.open(path, "rt", newline="") if path.endswith(".gz") else open(path, "r", newline="")
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.chunks = 0
+        self.rejected = 0
+        self.errors = []  # the first few, to show the user
+
+    def reject(self, error: str):
+        self.rejected += 1
+        if len(self.errors) < 10:
+            self.errors.append(error)
+
+    def summary(self) -> str:
+        lines = [f"Imported {self.imported} records in {self.chunks} chunks, rejected {self.rejected}."]
+        lines.extend(self.errors)
+        return "\n".join(lines)
+
+def _read_chunk(decoded, report: ImportReport, size: int):
+    """(entries, exhausted); exhausted once the reader returns fewer rows than asked for"""
+    rows = list(islice(decoded, size))
+    entries = []
+    for _, entry, error in rows:
+        if error:
+            report.reject(error)
+        else:
+            entries.append(entry)
+    return entries, len(rows) < size
+
+async def export_file(guild_id, kind: str, fmt: str, compress: bool = False) -> str:
+    """Stream a section into a temporary file, writing it chunk by chunk off the event loop; returns its path"""
+    suffix = f".{fmt}" + (".gz" if compress else "")
+    handle, path = tempfile.mkstemp(prefix=f"{kind}-", suffix=suffix)
+    os.close(handle)
+    lines = encode(records(store.load(guild_id), kind), kind, fmt)
+    with metrics.timer("bulk_seconds", op="export", kind=kind):
+        with (gzip.open(path, "wt", newline="") if compress else open(path, "w", newline="")) as f:
+            while True:
+                # Lines are produced on the loop (the data is live); the write happens in a thread
+                chunk = list(islice(lines, CHUNK_SIZE))
+                if not chunk:
+                    break
+                await asyncio.to_thread(f.writelines, chunk)
+    return path
+
+async def import_file(guild_id, kind: str, path: str, fmt: str = None, chunk_size: int = CHUNK_SIZE) -> ImportReport:
+    """Parse and validate in a thread, apply each chunk on the event loop with a single save"""
+    report = ImportReport()
+    with open_text(path) as f:
+        decoded = decode(f, kind, fmt or detect_format(path))
+        with metrics.timer("bulk_seconds", op="import", kind=kind):
+            exhausted = False
+            while not exhausted:
+                entries, exhausted = await asyncio.to_thread(_read_chunk, decoded, report, chunk_size)
+                if entries:
+                    apply_chunk(guild_id, kind, entries)
+                    report.imported += len(entries)
+                    report.chunks += 1
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream bot data out of or into a guild's store (stop the bot first)")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("--guild", required=True, help="Guild ID")
+    parser.add_argument("--kind", required=True, choices=sorted(KINDS))
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to ndjson for export, the file extension for import")
+    parser.add_argument("--file", help="Output (export; stdout if omitted) or input (import); .gz is (de)compressed")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.action == "export":
+        fmt = args.format or "ndjson"
+        lines = encode(records(store.load(args.guild), args.kind), args.kind, fmt)
+        if args.file:
+            with (gzip.open(args.file, "wt", newline="") if args.file.endswith(".gz") else open(args.file, "w", newline="")) as f:
+                f.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
+        return
+
+    if not args.file:
+        parser.error("import needs --file")
+    report = ImportReport()
+    with open_text(args.file) as f:
+        decoded = decode(f, args.kind, args.format or detect_format(args.file))
+        exhausted = False
+        while not exhausted:
+            entries, exhausted = _read_chunk(decoded, report, args.chunk_size)
+            if entries:
+                apply_chunk(args.guild, args.kind, entries)
+                report.imported += len(entries)
+                report.chunks += 1
+    print(report.summary())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import discord
+from discord import app_commands
+
+def is_owner():
+    """App command check that only lets the bot owner through"""
+    async def predicate(interaction: discord.Interaction) -> bool:
+        if await interaction.client.is_owner(interaction.user):
+            return True
+        raise app_commands.CheckFailure("Only the bot owner can use this command.")
+    return app_commands.check(predicate)
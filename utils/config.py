@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+log = logging.getLogger("bot.config")
+
+CONFIG_PATH = "configuration.json"
+
+class ConfigError(ValueError):
+    pass
+
+@dataclass(frozen=True)
+class LevelReward:
+    duty_multiplier: float = 1.0
+    mission_multiplier: float = 1.0
+    bonus_cap: int = 0
+
+@dataclass(frozen=True)
+class DutyRewards:
+    base_sc: int = 10
+    base_exp: int = 5
+    interval_minutes: int = 30
+
+@dataclass(frozen=True)
+class ApprovalRules:
+    # priority -> "any" (anyone, themselves included), "lower" (strictly lower ranks) or "none"
+    rules: MappingProxyType = field(default_factory=lambda: MappingProxyType({0: "any", 1: "lower", 2: "lower"}))
+    unranked_priority: int = 999
+    manage_levels_max_priority: int = 2
+    modify_exp_max_priority: int = 0
+
+    def min_target(self, priority: int):
+        """Lowest target priority number this approver may act on, or None if they can't approve"""
+        rule = self.rules.get(priority, "none")
+        if rule == "any":
+            return float("-inf")
+        if rule == "lower":
+            return priority + 1
+        return None
+
+@dataclass(frozen=True)
+class Config:
+    owner_id: int
+    manager_role_id: int
+    on_duty_role_id: int
+    on_mission_role_id: int
+    mission_categories: tuple
+    category_set: frozenset
+    # (exp required, level) sorted by exp, and the same levels in ascending order
+    level_thresholds: tuple
+    levels: tuple
+    level_rewards: MappingProxyType
+    duty_rewards: DutyRewards
+    approval: ApprovalRules
+    # Feature sections (metrics, gateway, storage, ...) kept as read-only mappings
+    sections: MappingProxyType = field(repr=False)
+
+    def level_for_exp(self, exp: int) -> int:
+        index = bisect_right(self.level_thresholds, (exp, float("inf")))
+        return self.level_thresholds[index - 1][1] if index else self.levels[0]
+
+    def exp_for_level(self, level: int) -> int:
+        return next(required for required, threshold_level in self.level_thresholds if threshold_level == level)
+
+    def next_level(self, level: int) -> int:
+        """The level after this one, or the highest level"""
+        index = bisect_right(self.levels, level)
+        return self.levels[min(index, len(self.levels) - 1)]
+
+    def reward_for_level(self, level: int) -> LevelReward:
+        """Rewards of the highest configured level at or below level"""
+        eligible = [reward_level for reward_level in self.level_rewards if reward_level <= level]
+        return self.level_rewards[max(eligible)] if eligible else LevelReward()
+
+    def section(self, name: str) -> MappingProxyType:
+        return self.sections.get(name, MappingProxyType({}))
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _int(raw: dict, key: str) -> int:
+    try:
+        return int(raw[key])
+    except KeyError:
+        raise ConfigError(f"Missing {key}")
+    except (TypeError, ValueError):
+        raise ConfigError(f"{key} must be a number, got {raw[key]!r}")
+
+def parse(raw: dict) -> Config:
+    """Validate the raw JSON and precompute the lookups the cogs use"""
+    categories = tuple(raw.get("mission_categories", ()))
+    if not categories or not all(isinstance(category, str) for category in categories):
+        raise ConfigError("mission_categories must be a non-empty list of names")
+
+    try:
+        thresholds = sorted((int(required), int(level)) for level, required in raw["experience_levels"].items())
+    except KeyError:
+        raise ConfigError("Missing experience_levels")
+    except (TypeError, ValueError):
+        raise ConfigError("experience_levels must map level numbers to EXP amounts")
+    if not thresholds:
+        raise ConfigError("experience_levels must define at least one level")
+    levels = tuple(sorted(level for _, level in thresholds))
+    if [level for _, level in thresholds] != list(levels):
+        raise ConfigError("experience_levels must require more EXP for each higher level")
+
+    try:
+        rewards = {int(level): LevelReward(**values) for level, values in raw.get("level_rewards", {}).items()}
+        duty_rewards = DutyRewards(**raw.get("duty_rewards", {}))
+    except (TypeError, ValueError) as e:
+        raise ConfigError(f"Invalid reward settings: {e}")
+    if duty_rewards.interval_minutes <= 0:
+        raise ConfigError("duty_rewards.interval_minutes must be positive")
+
+    approval = dict(raw.get("approval", {}))
+    try:
+        if "rules" in approval:
+            approval["rules"] = MappingProxyType({int(priority): rule for priority, rule in approval["rules"].items()})
+        approval = ApprovalRules(**approval)
+    except (TypeError, ValueError) as e:
+        raise ConfigError(f"Invalid approval settings: {e}")
+    unknown = set(approval.rules.values()) - {"any", "lower", "none"}
+    if unknown:
+        raise ConfigError(f"Unknown approval rules: {', '.join(sorted(unknown))}")
+
+    known = {"owner_id", "manager_role_id", "on_duty_role_id", "on_mission_role_id", "mission_categories",
+             "experience_levels", "level_rewards", "duty_rewards", "approval"}
+    return Config(
+        owner_id=_int(raw, "owner_id"),
+        manager_role_id=_int(raw, "manager_role_id"),
+        on_duty_role_id=_int(raw, "on_duty_role_id"),
+        on_mission_role_id=_int(raw, "on_mission_role_id"),
+        mission_categories=categories,
+        category_set=frozenset(categories),
+        level_thresholds=tuple(thresholds),
+        levels=levels,
+        level_rewards=MappingProxyType(rewards),
+        duty_rewards=duty_rewards,
+        approval=approval,
+        sections=MappingProxyType({key: _freeze(value) for key, value in raw.items() if key not in known})
+    )
+
+class ConfigService:
+    """Parses configuration.json once, hot-reloads it when its mtime changes and notifies subscribers"""
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self.current = None
+        self.mtime = None
+        self.subscribers = []
+
+    def get(self) -> Config:
+        if self.current is None:
+            self.mtime = os.stat(self.path).st_mtime_ns
+            self.current = self._read()
+        return self.current
+
+    def _read(self) -> Config:
+        with open(self.path, "r") as f:
+            return parse(json.load(f))
+
+    def subscribe(self, callback):
+        """callback(config) runs after every successful reload"""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def reload_if_changed(self) -> bool:
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            config = self._read()
+        except (ConfigError, json.JSONDecodeError) as e:
+            # Keep running on the last good configuration
+            log.error("Ignoring invalid %s: %s", self.path, e)
+            return False
+        # A single reference swap, so readers see either the old or the new config
+        self.current = config
+        log.info("Reloaded %s", self.path)
+        for callback in list(self.subscribers):
+            try:
+                callback(config)
+            except Exception:
+                log.exception("Config subscriber %r failed", callback)
+        return True
+
+    async def watch(self, interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload_if_changed()
+            except OSError as e:
+                log.error("Cannot read %s: %s", self.path, e)
+
+config = ConfigService()
+
+def get() -> Config:
+    return config.get()
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import discord
+
+from utils import metrics, config
+from utils.outbox import outbox, NOTICE
+
+log = logging.getLogger("bot.dm")
+
+class DirectMessages:
+    """DMs by user ID: cached DM channels, bounded concurrency and a record of users whose DMs are closed"""
+    def __init__(self):
+        self.channels = OrderedDict()  # user ID -> DM channel, least recently used first
+        self.undeliverable = {}        # user ID -> monotonic time their DMs were found closed
+        self.configure({})
+
+    def configure(self, settings):
+        self.cache_size = settings.get("cache_size", 1000)
+        self.concurrency = asyncio.Semaphore(settings.get("max_concurrency", 10))
+        # Users can open their DMs again, so they're tried once more after this long
+        self.retry_after = settings.get("undeliverable_hours", 24) * 3600
+        self.fallback = settings.get("duty_fallback", "ping")
+        while len(self.channels) > self.cache_size:
+            self.channels.popitem(last=False)
+
+    def reachable(self, user_id: int) -> bool:
+        marked = self.undeliverable.get(user_id)
+        if marked is None:
+            return True
+        if time.monotonic() - marked >= self.retry_after:
+            del self.undeliverable[user_id]
+            return True
+        return False
+
+    async def channel(self, bot, user_id: int):
+        channel = self.channels.get(user_id)
+        if channel is not None:
+            self.channels.move_to_end(user_id)
+            metrics.increment("dm_channel_cache_total", result="hit")
+            return channel
+        metrics.increment("dm_channel_cache_total", result="miss")
+        # The member cache usually has the user, which saves a REST call per DM
+        user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+        channel = user.dm_channel or await user.create_dm()
+        self.channels[user_id] = channel
+        if len(self.channels) > self.cache_size:
+            self.channels.popitem(last=False)
+        return channel
+
+    async def send(self, bot, user_id, content: str) -> bool:
+        """Whether the DM was delivered; users known to have DMs closed are skipped without a request"""
+        user_id = int(user_id)
+        if not self.reachable(user_id):
+            metrics.increment("dm_total", result="skipped")
+            return False
+        async with self.concurrency:
+            try:
+                channel = await self.channel(bot, user_id)
+                await outbox.send(channel, content, priority=NOTICE)
+            except (discord.Forbidden, discord.NotFound):
+                # Closed DMs, a blocked bot or a deleted account; don't try again every cycle
+                self.undeliverable[user_id] = time.monotonic()
+                self.channels.pop(user_id, None)
+                metrics.increment("dm_total", result="undeliverable")
+                return False
+            except discord.HTTPException as e:
+                log.warning("Could not DM %s: %s", user_id, e)
+                metrics.increment("dm_total", result="failed")
+                return False
+        metrics.increment("dm_total", result="sent")
+        return True
+
+    async def send_many(self, bot, messages) -> list:
+        """Send (user ID, content) pairs concurrently within the limit; whether each was delivered, in order"""
+        return await asyncio.gather(*(self.send(bot, user_id, content) for user_id, content in messages))
+
+dms = DirectMessages()
+dms.configure(config.get().section("direct_messages"))
+config.config.subscribe(lambda settings: dms.configure(settings.section("direct_messages")))
@@ -0,0 +1,75 @@
+import logging
+import os
+import sys
+
+import discord
+
+log = logging.getLogger("bot.gateway")
+
+def build_intents(config: dict) -> discord.Intents:
+    """Intents.default() (no members, presences or message content) plus the overrides in config"""
+    setting = config.get("intents", {})
+    if setting == "all":
+        return discord.Intents.all()
+    intents = discord.Intents.default()
+    for name, enabled in setting.items():
+        setattr(intents, name, enabled)
+    return intents
+
+def build_member_cache_flags(config: dict, intents: discord.Intents) -> discord.MemberCacheFlags:
+    setting = config.get("member_cache")
+    if setting is None:
+        return discord.MemberCacheFlags.from_intents(intents)
+    flags = discord.MemberCacheFlags.none()
+    for name, enabled in setting.items():
+        setattr(flags, name, enabled)
+    return flags
+
+async def fetch_members(guild: discord.Guild) -> list:
+    """Every member of the guild for bulk jobs, chunked on demand instead of kept in the cache"""
+    if guild.chunked:
+        return guild.members
+    try:
+        return await guild.chunk(cache=False)
+    except discord.ClientException:
+        # Members intent is off; the cache is all we have
+        log.warning("Cannot chunk %s without the members intent, using %d cached members", guild.id, len(guild.members))
+        return guild.members
+
+def shard_for(bot: discord.Client, guild_id) -> int:
+    return (int(guild_id) >> 22) % (bot.shard_count or 1)
+
+def owns_guild(bot: discord.Client, guild_id) -> bool:
+    """Whether this process runs the shard for guild_id; data without a guild belongs to shard 0"""
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_ids is None:
+        # Plain Bot, or AutoShardedBot running every shard in this process
+        return True
+    if guild_id is None:
+        return 0 in shard_ids
+    return shard_for(bot, guild_id) in shard_ids
+
+def resident_memory_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0  # Windows
+    else:
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def report_memory(bot: discord.Client):
+    log.info(
+        "Memory: %.1f MiB resident, %d guilds, %d cached members, %d cached messages, intents=%s",
+        resident_memory_mb(),
+        len(bot.guilds),
+        sum(len(guild.members) for guild in bot.guilds),
+        len(bot.cached_messages),
+        ",".join(name for name, enabled in bot.intents if enabled)
+    )
@@ -0,0 +1,82 @@
+import asyncio
+import datetime
+import logging
+from utils import store, metrics
+
+log = logging.getLogger("bot.idempotency")
+
+# How long a finished action is remembered; long enough to outlive a restart and any client retry
+RETENTION = datetime.timedelta(days=7)
+
+class Rejected(Exception):
+    """The action refused to run (bad input, missing setup); nothing is recorded so it can be retried"""
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution whose outcome every caller gets"""
+    def __init__(self):
+        self.calls = {}  # key -> Future
+
+    async def do(self, key, func):
+        future = self.calls.get(key)
+        if future is not None:
+            metrics.increment("single_flight_shared_total")
+            # Shielded so a cancelled waiter doesn't cancel the call everyone else is waiting on
+            return await asyncio.shield(future)
+        future = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
+
+flight = SingleFlight()
+
+def _records(guild_id) -> dict:
+    return store.load(guild_id).setdefault("idempotency", {})
+
+def recorded(guild_id, key: str):
+    record = _records(guild_id).get(key)
+    return None if record is None else record["result"]
+
+def record(guild_id, key: str, result):
+    now = datetime.datetime.now()
+    cutoff = (now - RETENTION).isoformat()
+
+    def add(data):
+        records = data.setdefault("idempotency", {})
+        for stale in [stale for stale, entry in records.items() if entry["at"] < cutoff]:
+            del records[stale]
+        records[key] = {"result": result, "at": now.isoformat()}
+
+    store.update(guild_id, add, "idempotency")
+
+async def run_once(guild_id, key: str, func):
+    """Run func() at most once per guild and key, returning its (JSON-serializable) result to every caller.
+
+    Concurrent callers share one execution; later callers, including after a restart, get the stored
+    result without repeating side effects. If func raises, nothing is recorded.
+    """
+    result = recorded(guild_id, key)
+    if result is not None:
+        metrics.increment("idempotent_replays_total", action=key.rsplit(":", 1)[-1])
+        return result
+
+    async def execute():
+        # Re-check: a call that finished between the lookup above and now has already recorded
+        done = recorded(guild_id, key)
+        if done is not None:
+            return done
+        result = await func()
+        record(guild_id, key, result)
+        return result
+
+    return await flight.do((str(guild_id), key), execute)
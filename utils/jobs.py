@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import metrics, store, snapshots
+
+log = logging.getLogger("bot.jobs")
+
+class Job:
+    def __init__(self, job_id: int, name: str, guild_id, requested_by: int):
+        self.id = job_id
+        self.name = name
+        self.guild_id = guild_id
+        self.requested_by = requested_by
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.created = datetime.datetime.now()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.task = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+class JobManager:
+    """Runs CPU-heavy pure functions from utils.reports in worker processes over a snapshot of a guild"""
+    def __init__(self, max_workers: int = 2, history: int = 50):
+        self.max_workers = max_workers
+        self.history = history
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.executor = None
+        # One per worker process, so a job holding one is actually running rather than waiting in the pool
+        self.slots = asyncio.Semaphore(max_workers)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # spawn, because forking copies the logging and watchdog threads' locks mid-use
+            self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def submit(self, name: str, guild_id, requested_by: int, func, *args, on_done=None) -> Job:
+        """Schedule func(snapshot, *args); on_done(job) is awaited on the event loop afterwards"""
+        job = Job(next(self.ids), name, guild_id, requested_by)
+        self.jobs[job.id] = job
+        self._trim()
+        job.task = asyncio.get_running_loop().create_task(self._run(job, func, args, on_done))
+        return job
+
+    async def _run(self, job: Job, func, args: tuple, on_done):
+        start = None
+        # Pinned here on the event loop, so the copy is consistent and the worker never sees later changes
+        store.load(job.guild_id)
+        sections = snapshots.capture(job.guild_id)
+        try:
+            async with self.slots:
+                # The users are decoded and everything serialized off the event loop
+                with metrics.timer("job_snapshot_seconds"):
+                    snapshot = await asyncio.to_thread(_snapshot, sections)
+                job.status = "running"
+                start = datetime.datetime.now()
+                job.future = asyncio.get_running_loop().run_in_executor(self._executor(), func, snapshot, *args)
+                job.result = await job.future
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            _release(sections)
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            log.exception("Job %s (%s) failed", job.id, job.name)
+        job.finished = datetime.datetime.now()
+        if start is not None:
+            metrics.observe("job_seconds", (job.finished - start).total_seconds(), job=job.name, status=job.status)
+        if on_done and job.status != "cancelled":
+            try:
+                await on_done(job)
+            except Exception:
+                log.exception("Delivering the result of job %s failed", job.id)
+
+    def cancel(self, job_id: int) -> bool:
+        """Queued jobs never start; a job already in a worker finishes there but its result is dropped"""
+        job = self.jobs.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.task.cancel()
+        job.status = "cancelled"
+        job.finished = datetime.datetime.now()
+        return True
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+def _snapshot(sections: dict) -> str:
+    """One JSON document of the sections snapshots.capture() took"""
+    parts = []
+    for name, payload in sections.items():
+        if isinstance(payload, tuple):
+            payload = json.dumps(store.read_records(*payload))
+        parts.append(f"{json.dumps(name)}: {payload}")
+    return "{" + ", ".join(parts) + "}"
+
+def _release(sections: dict):
+    # Record files pinned for a job cancelled before _snapshot read (and closed) them
+    for payload in sections.values():
+        if isinstance(payload, tuple):
+            payload[0].close()
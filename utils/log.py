@@ -0,0 +1,119 @@
+import contextvars
+import logging
+import logging.handlers
+import queue
+import random
+
+# Fields attached to every log line emitted while handling an interaction
+context = contextvars.ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("command", "user", "guild", "latency_ms")
+
+def bind(**fields) -> contextvars.Token:
+    """Add fields to the current task's log context; pass the token to unbind() to restore"""
+    return context.set({**context.get(), **fields})
+
+def unbind(token: contextvars.Token):
+    context.reset(token)
+
+def summarize(value, limit: int = 20):
+    """Stand-in for large containers so they are never formatted into a log line"""
+    if isinstance(value, (dict, list, tuple, set)) and len(value) > limit:
+        return f"<{type(value).__name__} with {len(value)} items>"
+    return value
+
+def truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit} chars)"
+    return text
+
+class ContextFilter(logging.Filter):
+    """Copies the interaction context onto the record"""
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of DEBUG/INFO records per logger; warnings and errors always pass"""
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self.cache = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self.cache.get(name)
+        if rate is None:
+            # Most specific configured parent wins, e.g. "bot.levels" covers "bot.levels.priority"
+            rate = 1.0
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self.cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class EventLoopQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread without formatting them on the event loop"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple):
+            record.args = tuple(summarize(arg) for arg in record.args)
+        elif isinstance(record.args, dict) and "%(" not in str(record.msg):
+            # logging unwraps a lone dict argument, so it is not in a tuple here
+            record.args = (summarize(record.args),)
+        if record.exc_info:
+            # Tracebacks hold frames that may change before the listener gets to them
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = truncate(record.getMessage(), self.max_length)
+        fields = [
+            f"{key}={truncate(str(getattr(record, key)), self.max_length)}"
+            for key in CONTEXT_FIELDS if getattr(record, key, None) is not None
+        ]
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += " | " + " ".join(fields)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+def setup_logging(config: dict) -> logging.handlers.QueueListener:
+    """Route every logger through a queue to a background writer thread"""
+    formatter = StructuredFormatter(config.get("max_field_length", 300))
+    handlers = [logging.StreamHandler()]
+    if config.get("file"):
+        handlers.append(logging.handlers.RotatingFileHandler(config["file"], maxBytes=10 * 1024 * 1024, backupCount=3))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = EventLoopQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(config.get("sampling", {})))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(config.get("level", "INFO"))
+    for name, level in config.get("levels", {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
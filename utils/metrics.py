@@ -0,0 +1,155 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds in seconds, shared by every histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+# (name, sorted label items) -> value
+histograms = {}
+counters = {}
+gauges = {}
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram()
+    histogram.observe(value)
+
+def increment(name: str, amount: int = 1, **labels):
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+def set_gauge(name: str, value: float, **labels):
+    gauges[_key(name, labels)] = value
+
+@contextmanager
+def timer(name: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+def series(name: str) -> dict:
+    """All histograms recorded under name, keyed by their label dict"""
+    return {labels: histogram for (metric, labels), histogram in histograms.items() if metric == name}
+
+def instrument_item(view, item):
+    """Time a view item's callback under the view class and the item's label"""
+    callback = item.callback
+    label = getattr(item, "label", None) or getattr(item, "placeholder", None) or type(item).__name__
+
+    async def timed_callback(interaction):
+        with timer("view_callback_seconds", view=type(view).__name__, item=label):
+            await callback(interaction)
+
+    item.callback = timed_callback
+
+def instrument_http(http):
+    """Wrap discord.py's HTTP client so every REST call is counted and timed by route"""
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        labels = {"route": f"{route.method} {route.path}"}
+        start = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except Exception:
+            increment("rest_errors_total", **labels)
+            raise
+        finally:
+            observe("rest_seconds", time.perf_counter() - start, **labels)
+
+    http.request = timed_request
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Sleep for a fixed interval and record how late the loop woke us up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        observe("event_loop_lag_seconds", lag)
+        set_gauge("event_loop_lag_seconds_last", lag)
+
+def _format_labels(labels, extra=()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items) + "}"
+
+def render_prometheus() -> str:
+    lines = []
+    typed = set()
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        # Drain the request headers; every path answers with the metrics
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = render_prometheus().encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def start_http_endpoint(host: str, port: int) -> asyncio.AbstractServer:
+    return await asyncio.start_server(_handle_scrape, host, port)
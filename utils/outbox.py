@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import io
+import itertools
+import logging
+import random
+import time
+
+import aiohttp
+import discord
+
+from utils import metrics, config
+
+log = logging.getLogger("bot.outbox")
+
+# Priority classes; within a destination's queue lower goes first
+REPLY = 0   # posts someone is waiting on after clicking or running a command (e.g. the started mission)
+NOTICE = 1  # notices, pings and DMs addressed to someone
+LOG = 2     # log lines and embeds nobody is waiting on; consecutive ones are sent as one message
+PRIORITY_NAMES = {REPLY: "reply", NOTICE: "notice", LOG: "log"}
+
+MAX_CONTENT = 2000
+MAX_EMBEDS = 10
+
+class Delivery:
+    __slots__ = ("destination", "priority", "content", "embeds", "kwargs", "future", "queued_at")
+
+    def __init__(self, destination, priority: int, content, embeds: list, kwargs: dict):
+        self.destination = destination
+        self.priority = priority
+        self.content = content
+        self.embeds = embeds
+        self.kwargs = kwargs
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.perf_counter()
+
+    def mergeable(self) -> bool:
+        # Views, files and mention settings belong to one message and can't be shared
+        return self.priority == LOG and not self.kwargs
+
+    def fail(self, error: Exception):
+        if not self.future.done():
+            self.future.set_exception(error)
+            # Already logged; callers that don't await the future shouldn't get "exception never retrieved"
+            self.future.exception()
+
+class Outbox:
+    """One queue and worker per destination, so a slow or rate-limited channel only delays its own messages"""
+    def __init__(self):
+        self.queues = {}   # destination ID -> heap of (priority, sequence, Delivery)
+        self.workers = {}  # destination ID -> task draining that queue; exits once it is empty
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.configure({})
+
+    def configure(self, settings):
+        self.max_attempts = max(1, settings.get("max_attempts", 5))
+        self.retry_base = settings.get("retry_base_seconds", 1.0)
+        self.retry_max = settings.get("retry_max_seconds", 30.0)
+        self.coalesce_window = settings.get("coalesce_ms", 250) / 1000
+        # Caps concurrent sends across all destinations, well under Discord's global limit
+        self.in_flight = asyncio.Semaphore(settings.get("max_in_flight", 8))
+
+    def send(self, destination, content=None, *, embed=None, priority: int = NOTICE, **kwargs) -> asyncio.Future:
+        """Queue a message for a channel or user and return at once; the future resolves to the sent Message"""
+        delivery = Delivery(destination, priority, content, [embed] if embed else [], kwargs)
+        key = destination.id
+        heapq.heappush(self.queues.setdefault(key, []), (priority, next(self.sequence), delivery))
+        self.pending += 1
+        metrics.increment("outbox_queued_total", priority=PRIORITY_NAMES[priority])
+        metrics.set_gauge("outbox_pending", self.pending)
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_running_loop().create_task(self.drain(key))
+        return delivery.future
+
+    async def drain(self, key):
+        queue = self.queues[key]
+        try:
+            while queue:
+                if self.coalesce_window and queue[0][2].mergeable():
+                    # Give a burst of log lines a moment to arrive so they go out together
+                    await asyncio.sleep(self.coalesce_window)
+                batch = self.take(queue)
+                self.pending -= len(batch)
+                metrics.set_gauge("outbox_pending", self.pending)
+                await self.deliver(key, batch)
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    def take(self, queue: list) -> list:
+        """The next delivery, plus the mergeable ones right behind it that still fit in one message"""
+        _, _, first = heapq.heappop(queue)
+        batch = [first]
+        if not first.mergeable():
+            return batch
+        length = len(first.content or "")
+        embeds = len(first.embeds)
+        while queue and queue[0][2].mergeable():
+            following = queue[0][2]
+            added = len(following.content) + bool(length) if following.content else 0
+            if length + added > MAX_CONTENT or embeds + len(following.embeds) > MAX_EMBEDS:
+                break
+            heapq.heappop(queue)
+            batch.append(following)
+            length += added
+            embeds += len(following.embeds)
+        return batch
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter, so retries from many queues don't line up"""
+        ceiling = min(self.retry_max, self.retry_base * 2 ** (attempt - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    async def deliver(self, key, batch: list):
+        first = batch[0]
+        priority = PRIORITY_NAMES[first.priority]
+        content = "\n".join(delivery.content for delivery in batch if delivery.content) or None
+        embeds = [embed for delivery in batch for embed in delivery.embeds]
+        kwargs = dict(first.kwargs)
+        if len(embeds) == 1:
+            kwargs["embed"] = embeds[0]
+        elif embeds:
+            kwargs["embeds"] = embeds
+        # A File is spent by the first attempt that sends it, so keep its bytes and attach fresh copies each time
+        files = [kwargs.pop("file")] if "file" in kwargs else kwargs.pop("files", [])
+        attachments = [_read_file(file) for file in files]
+
+        # discord.py already waits out 429s itself; this retries what it gives up on and server/network errors
+        for attempt in range(1, self.max_attempts + 1):
+            if attachments:
+                kwargs["files"] = [
+                    discord.File(io.BytesIO(data), filename, spoiler=spoiler, description=description)
+                    for data, filename, spoiler, description in attachments
+                ]
+            try:
+                async with self.in_flight:
+                    message = await first.destination.send(content, **kwargs)
+            except (discord.Forbidden, discord.NotFound) as e:
+                error = e
+                break
+            except discord.HTTPException as e:
+                error = e
+                if e.status != 429 and e.status < 500:
+                    break
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                error = e
+            except Exception as e:
+                error = e
+                break
+            else:
+                now = time.perf_counter()
+                metrics.increment("outbox_sent_total", priority=priority)
+                if len(batch) > 1:
+                    metrics.increment("outbox_coalesced_total", len(batch) - 1, priority=priority)
+                for delivery in batch:
+                    metrics.observe("outbox_delivery_seconds", now - delivery.queued_at, priority=priority)
+                    if not delivery.future.done():
+                        delivery.future.set_result(message)
+                return
+            if attempt < self.max_attempts:
+                metrics.increment("outbox_retries_total", priority=priority)
+                await asyncio.sleep(self.backoff(attempt))
+
+        log.warning("Dropped a %s message to %s after %d attempt(s): %s", priority, key, attempt, error)
+        metrics.increment("outbox_failed_total", priority=priority, reason=type(error).__name__)
+        for delivery in batch:
+            delivery.fail(error)
+
+    async def flush(self, timeout: float = None):
+        """Wait until every queue is empty, e.g. before shutting down"""
+        async def drained():
+            while self.workers:
+                await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+        try:
+            await asyncio.wait_for(drained(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("%d outgoing messages were not sent before shutdown", self.pending)
+
+def _read_file(file: discord.File) -> tuple:
+    """(bytes, filename, spoiler, description) of a File, which is closed afterwards"""
+    file.reset()
+    try:
+        return file.fp.read(), file.filename, file.spoiler, file.description
+    finally:
+        file.close()
+
+async def resolve_channel(bot, channel_id):
+    """A channel from the gateway cache, falling back to the API"""
+    channel_id = int(channel_id)
+    return bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+
+outbox = Outbox()
+outbox.configure(config.get().section("outbox"))
+config.config.subscribe(lambda settings: outbox.configure(settings.section("outbox")))
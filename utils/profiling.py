@@ -0,0 +1,103 @@
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+
+log = logging.getLogger("bot.profiling")
+
+PROFILE_DIR = "data/profiles"
+
+class Profiler:
+    """Samples a fraction of command and task runs under cProfile and aggregates them per name"""
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.1
+        self.memory = False
+        self.stats = {}  # name -> pstats.Stats
+        self.samples = {}  # name -> sampled run count
+        self.allocations = {}  # name -> latest tracemalloc diff lines
+        self.active = False  # Only one cProfile may run on the loop thread at a time
+
+    def configure(self, enabled: bool, sample_rate: float = None, memory: bool = None):
+        self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = max(0.0, min(1.0, sample_rate))
+        if memory is not None:
+            self.memory = memory
+        if self.enabled and self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif tracemalloc.is_tracing() and not (self.enabled and self.memory):
+            tracemalloc.stop()
+
+    def reset(self):
+        self.stats.clear()
+        self.samples.clear()
+        self.allocations.clear()
+
+    def should_sample(self) -> bool:
+        return self.enabled and not self.active and random.random() < self.sample_rate
+
+    @asynccontextmanager
+    async def sample(self, name: str):
+        if not self.should_sample():
+            yield
+            return
+
+        # Other tasks that run while this one awaits are included in the profile too
+        self.active = True
+        before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.active = False
+            self._add(name, profile, before)
+
+    def _add(self, name: str, profile: cProfile.Profile, before):
+        if name in self.stats:
+            self.stats[name].add(profile)
+        else:
+            self.stats[name] = pstats.Stats(profile)
+        self.samples[name] = self.samples.get(name, 0) + 1
+        if before is not None:
+            diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            self.allocations[name] = [str(line) for line in diff[:10]]
+
+    async def dump(self) -> list:
+        """Write one .prof file per name to PROFILE_DIR off the event loop"""
+        stats = dict(self.stats)
+        return await asyncio.to_thread(self._dump, stats)
+
+    def _dump(self, stats: dict) -> list:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        paths = []
+        for name, name_stats in stats.items():
+            path = os.path.join(PROFILE_DIR, f"{safe_filename(name)}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            name_stats.dump_stats(path)
+            paths.append(path)
+        log.info("Dumped %d profiles to %s", len(paths), PROFILE_DIR)
+        return paths
+
+    def top(self, name: str, limit: int = 15) -> list:
+        """(cumulative seconds, calls, function) for the slowest functions by cumulative time"""
+        stats = self.stats.get(name)
+        if stats is None:
+            return []
+        rows = []
+        for (filename, line, function), (_, calls, _, cumulative, _) in stats.stats.items():
+            rows.append((cumulative, calls, f"{function} ({os.path.basename(filename)}:{line})"))
+        rows.sort(reverse=True)
+        return rows[:limit]
+
+def safe_filename(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+profiler = Profiler()
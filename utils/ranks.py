@@ -0,0 +1,82 @@
+import logging
+from utils import store, config
+
+log = logging.getLogger("bot.ranks")
+
+class RankTable:
+    """A guild's role hierarchy compiled from its roles section"""
+    def __init__(self, roles: dict, unranked: int):
+        self.priorities = {int(role_id): role["priority"] for role_id, role in roles.items()}
+        self.unranked = unranked
+        # Member id -> rank last computed from their roles, for callers that only have user ids
+        self.members = {}
+
+    def rank(self, role_ids) -> int:
+        priorities = self.priorities
+        return min((priorities[role_id] for role_id in role_ids if role_id in priorities), default=self.unranked)
+
+_tables = {}  # guild id -> RankTable
+_sources = {}  # guild id -> the roles dict its table was compiled from
+
+def table(guild_id) -> RankTable:
+    key = str(guild_id)
+    roles = store.load(guild_id)["roles"]
+    compiled = _tables.get(key)
+    # A guild read again from disk (reload, eviction) comes back with a new roles dict
+    if compiled is None or _sources.get(key) is not roles:
+        compiled = _tables[key] = RankTable(roles, config.get().approval.unranked_priority)
+        _sources[key] = roles
+        log.debug("Compiled rank table for %s (%d roles)", key, len(compiled.priorities))
+    return compiled
+
+def invalidate(guild_id=None):
+    """Call after editing a guild's roles section; None drops every guild"""
+    if guild_id is None:
+        _tables.clear()
+        _sources.clear()
+    else:
+        _tables.pop(str(guild_id), None)
+        _sources.pop(str(guild_id), None)
+
+def prune():
+    """Drop the tables of guilds the store has evicted"""
+    for key in set(_tables) - set(store.loaded()):
+        invalidate(key)
+
+def rank_of(member) -> int:
+    compiled = table(member.guild.id)
+    rank = compiled.members[member.id] = compiled.rank(role.id for role in member.roles)
+    return rank
+
+def forget_member(guild_id, user_id):
+    compiled = _tables.get(str(guild_id))
+    if compiled is not None:
+        compiled.members.pop(int(user_id), None)
+
+def can_approve(approver, target) -> bool:
+    return can_approve_many(approver, [target])[0]
+
+def can_approve_many(approver, targets: list) -> list:
+    """Which targets (members, or user ids looked up in the rank cache) the approver may act on, in order.
+    An id whose roles aren't known, in the rank cache or the guild's member cache, can't be approved."""
+    bound = config.get().approval.min_target(rank_of(approver))
+    if bound is None:
+        return [False] * len(targets)
+    compiled = table(approver.guild.id)
+    cache = compiled.members
+    ranks = []
+    for target in targets:
+        if isinstance(target, (int, str)):
+            rank = cache.get(int(target))
+            member = approver.guild.get_member(int(target)) if rank is None else None
+            if member is not None:
+                rank = cache[member.id] = compiled.rank(role.id for role in member.roles)
+            ranks.append(rank)
+        else:
+            rank = cache[target.id] = compiled.rank(role.id for role in target.roles)
+            ranks.append(rank)
+    # Unranked is the most permissive rank, so an unknown one mustn't default to it
+    return [rank is not None and rank >= bound for rank in ranks]
+
+# unranked_priority and the rules live in configuration.json
+config.config.subscribe(lambda settings: invalidate())
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+
+import discord
+from discord import app_commands
+
+from utils import metrics, config
+
+log = logging.getLogger("bot.ratelimit")
+
+# Commands that change stored data or call out to Discord; everything else spends the read budget
+WRITE_COMMANDS = frozenset({
+    "onduty", "offduty", "confirm", "transfer", "modifybalance", "startmission", "confend", "confabort",
+    "approve", "addexp", "levels", "role", "editrole", "removerole", "setchannel", "setup", "report", "restore", "import"
+})
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, per: float, now: float):
+        self.capacity = capacity
+        self.rate = capacity / per  # tokens refilled per second
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self, now: float) -> float:
+        """Seconds until a token is available; 0 if one is available now"""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    """Per-user and per-guild token buckets, with separate budgets for read and write interactions"""
+    def __init__(self):
+        self.buckets = {}  # (scope, kind, id) -> TokenBucket
+        self.configure({})
+
+    def configure(self, settings):
+        self.enabled = settings.get("enabled", True)
+        # scope -> kind -> (capacity, per seconds)
+        self.limits = {
+            "user": {"read": (8, 10), "write": (4, 15)},
+            "guild": {"read": (120, 60), "write": (60, 60)}
+        }
+        for scope, kinds in settings.get("limits", {}).items():
+            for kind, (capacity, per) in kinds.items():
+                self.limits.setdefault(scope, {})[kind] = (capacity, per)
+        self.write_commands = frozenset(settings.get("write_commands", WRITE_COMMANDS))
+        self.cleanup_interval = settings.get("cleanup_seconds", 300)
+        self.buckets.clear()
+
+    def kind_of(self, interaction: discord.Interaction) -> str:
+        if interaction.type is discord.InteractionType.application_command:
+            name = (interaction.data or {}).get("name")
+            return "write" if name in self.write_commands else "read"
+        # Buttons, selects and modals act on missions, duty and levels
+        return "write"
+
+    def hit(self, interaction: discord.Interaction):
+        """Spend a token from each bucket the interaction falls in, or raise CommandOnCooldown"""
+        if not self.enabled or interaction.type is discord.InteractionType.autocomplete:
+            return
+        kind = self.kind_of(interaction)
+        now = time.monotonic()
+        keys = [("user", kind, interaction.user.id)]
+        if interaction.guild_id is not None:
+            keys.append(("guild", kind, interaction.guild_id))
+
+        buckets = []
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(*self.limits[key[0]][kind], now)
+            buckets.append(bucket)
+
+        # Check every bucket before spending, so a guild-wide limit doesn't also drain the user's budget
+        for key, bucket in zip(keys, buckets):
+            retry_after = bucket.retry_after(now)
+            if retry_after:
+                metrics.increment("rate_limited_total", scope=key[0], kind=kind)
+                raise app_commands.CommandOnCooldown(app_commands.Cooldown(*self.limits[key[0]][kind]), retry_after)
+        for bucket in buckets:
+            bucket.tokens -= 1
+
+    def cleanup(self) -> int:
+        """Drop buckets that have refilled completely; a new bucket starts full, so nothing changes"""
+        now = time.monotonic()
+        full = []
+        for key, bucket in self.buckets.items():
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                full.append(key)
+        for key in full:
+            del self.buckets[key]
+        metrics.set_gauge("rate_limit_buckets", len(self.buckets))
+        return len(full)
+
+    async def cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            self.cleanup()
+
+def cooldown_message(retry_after: float) -> str:
+    day = round(retry_after / 86400)
+    hour = round(retry_after / 3600)
+    minute = round(retry_after / 60)
+    if day > 0:
+        return f"This command has a cooldown, for {day} day(s)"
+    if hour > 0:
+        return f"This command has a cooldown, for {hour} hour(s)"
+    if minute > 0:
+        return f"This command has a cooldown, for {minute} minute(s)"
+    return f"This command has a cooldown, for {retry_after:.2f} second(s)"
+
+async def send_error(interaction: discord.Interaction, message: str):
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
+limiter = RateLimiter()
+limiter.configure(config.get().section("rate_limits"))
+config.config.subscribe(lambda settings: limiter.configure(settings.section("rate_limits")))
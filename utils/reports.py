@@ -0,0 +1,66 @@
+import csv
+import datetime
+import io
+import json
+
+# Pure functions run in worker processes by utils.jobs. Each takes the guild's data
+# serialized as JSON (a read-only snapshot) and returns something picklable.
+
+def duty_rollup(snapshot: str) -> dict:
+    data = json.loads(snapshot)
+    now = datetime.datetime.now()
+    active_minutes = []
+    for status in data["duty_status"].values():
+        if status.get("active"):
+            start = datetime.datetime.fromisoformat(status["start_time"])
+            active_minutes.append((now - start).total_seconds() / 60)
+    return {
+        "sessions": len(data["duty_status"]),
+        "on_duty": len(active_minutes),
+        "longest_minutes": round(max(active_minutes, default=0), 1),
+        "average_minutes": round(sum(active_minutes) / len(active_minutes), 1) if active_minutes else 0
+    }
+
+def mission_statistics(snapshot: str) -> dict:
+    data = json.loads(snapshot)
+    categories = {}
+    for mission in data["active_missions"].values():
+        stats = categories.setdefault(mission.get("category", "Other"), {"total": 0, "completed": 0, "aborted": 0, "seconds": 0.0})
+        stats["total"] += 1
+        status = mission.get("status")
+        if status in ("completed", "aborted"):
+            stats[status] += 1
+        duration = mission.get("duration")  # Seconds
+        if duration is not None:
+            stats["seconds"] += duration
+    for stats in categories.values():
+        seconds = stats.pop("seconds")
+        stats["average_minutes"] = round(seconds / stats["completed"] / 60, 1) if stats["completed"] else 0
+    return categories
+
+def leaderboard(snapshot: str, field: str = "sc", limit: int = 10) -> list:
+    data = json.loads(snapshot)
+    ranked = sorted(data["users"].items(), key=lambda item: item[1].get(field, 0), reverse=True)
+    return [(user_id, user.get(field, 0)) for user_id, user in ranked[:limit]]
+
+def level_reconciliation(snapshot: str, thresholds: tuple) -> list:
+    """Users whose stored level doesn't match the level their EXP earns; thresholds are sorted (exp, level) pairs"""
+    data = json.loads(snapshot)
+    mismatched = []
+    for user_id, user in data["users"].items():
+        earned = 0
+        for required, level in thresholds:
+            if user.get("exp", 0) >= required:
+                earned = level
+        if user.get("level", 0) != earned:
+            mismatched.append((user_id, user.get("level", 0), earned))
+    return mismatched
+
+def users_csv(snapshot: str) -> str:
+    data = json.loads(snapshot)
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["user_id", "sc", "exp", "level"])
+    for user_id, user in data["users"].items():
+        writer.writerow([user_id, user.get("sc", 0), user.get("exp", 0), user.get("level", 0)])
+    return output.getvalue()
@@ -0,0 +1,179 @@
+import datetime
+import logging
+
+from utils import analytics
+
+log = logging.getLogger("bot.schema")
+
+class SchemaError(ValueError):
+    pass
+
+_REQUIRED = object()
+
+def _flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "1", "yes"):
+        return True
+    if str(value).lower() in ("false", "0", "no"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+def _list(value) -> list:
+    if not isinstance(value, list):
+        raise ValueError(f"not a list: {value!r}")
+    return value
+
+def _dict(value) -> dict:
+    if not isinstance(value, dict):
+        raise ValueError(f"not an object: {value!r}")
+    return value
+
+def _field(entry: dict, name: str, kind, default=_REQUIRED):
+    value = entry.get(name, default)
+    if value is _REQUIRED:
+        raise SchemaError(f"missing {name}")
+    if value is None:
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise SchemaError(f"invalid {name}: {value!r}")
+
+def duration_seconds(value) -> float:
+    """Seconds from a number or a str(timedelta) such as '1 day, 2:03:04.5', which is how durations used to be stored"""
+    if isinstance(value, str) and ":" in value:
+        days = 0
+        if "day" in value:
+            day_part, value = value.split(",", 1)
+            days = int(day_part.split()[0])
+        hours, minutes, seconds = value.strip().split(":")
+        return datetime.timedelta(days=days, hours=int(hours), minutes=int(minutes), seconds=float(seconds)).total_seconds()
+    return float(value)
+
+def _shape(entry, fields: dict) -> dict:
+    """fields: name -> (kind, default); known fields first, in that order, then anything else unchanged"""
+    if not isinstance(entry, dict):
+        raise SchemaError(f"expected an object, not {type(entry).__name__}")
+    shaped = {name: _field(entry, name, kind, default) for name, (kind, default) in fields.items()}
+    shaped.update((name, value) for name, value in entry.items() if name not in fields)
+    return shaped
+
+USER = {"sc": (int, 0), "exp": (int, 0), "level": (int, 0)}
+ROLE = {"id": (str, None), "name": (str, ""), "priority": (int, _REQUIRED), "bonus_income": (float, 1.0)}
+LEVEL_ROLE = {"role_id": (str, _REQUIRED), "exp_required": (int, 0), "duty_income": (float, 0.0), "mission_bonus": (float, 0.0)}
+# last_check_in caps the payout of a session whose check-in goes unanswered; check_code and
+# check_deadline are the pending check-in, kept here so it survives a restart
+DUTY = {
+    "active": (_flag, False), "start_time": (str, _REQUIRED), "last_check_in": (str, None),
+    "check_code": (str, None), "check_deadline": (str, None)
+}
+MISSION = {
+    "id": (str, None), "leader": (int, _REQUIRED), "category": (str, _REQUIRED), "description": (str, ""),
+    "status": (str, _REQUIRED), "start_time": (str, _REQUIRED), "members": (_list, None),
+    "helpers_needed": (int, 0), "channels": (_dict, None), "duration": (duration_seconds, None)
+}
+
+def _role(key: str, entry) -> dict:
+    role = _shape(entry, ROLE)
+    role["id"] = role["id"] or key
+    return role
+
+def _mission(key: str, entry) -> dict:
+    mission = _shape(entry, MISSION)
+    mission["id"] = mission["id"] or key
+    mission["members"] = mission["members"] if mission["members"] is not None else [mission["leader"]]
+    mission["channels"] = mission["channels"] or {}
+    return mission
+
+def _channel(key: str, entry) -> str:
+    if not isinstance(entry, (str, int)) or isinstance(entry, bool):
+        raise SchemaError(f"expected a channel ID, not {entry!r}")
+    return str(entry)
+
+# section -> function(key, entry) returning the canonical entry or raising SchemaError
+NORMALIZERS = {
+    "users": lambda key, entry: _shape(entry, USER),
+    "roles": _role,
+    "level_roles": lambda key, entry: _shape(entry, LEVEL_ROLE),
+    "channels": _channel,
+    "duty_status": lambda key, entry: _shape(entry, DUTY),
+    "active_missions": _mission
+}
+
+def new_user() -> dict:
+    return {"sc": 0, "exp": 0, "level": 0}
+
+def ensure_user(users, user_id: str) -> dict:
+    """The stored record of user_id, created empty if there is none"""
+    user = users.get(user_id)
+    if user is None:
+        # update() rather than assignment, so a record section tracks the new record
+        users.update({user_id: new_user()})
+        user = users[user_id]
+    return user
+
+def normalize(section: str, key: str, entry):
+    """The canonical shape of one entry; SchemaError (a ValueError) if it can't be repaired"""
+    normalizer = NORMALIZERS.get(section)
+    if normalizer is None:
+        return entry
+    try:
+        return normalizer(key, entry)
+    except SchemaError as e:
+        raise SchemaError(f"{section} {key}: {e}")
+
+def normalize_section(section: str, entries) -> int:
+    """Normalize every entry of a section in place; returns how many changed"""
+    if section not in NORMALIZERS:
+        return 0
+    changed = {}
+    for key in list(entries):
+        entry = entries[key]
+        shaped = normalize(section, key, entry)
+        # Same content in another key order counts as changed, so stored records end up identical
+        if shaped != entry or list(shaped) != list(entry):
+            changed[key] = shaped
+    entries.update(changed)
+    return len(changed)
+
+# (version, description, function(data)) in order. A guild whose stored schema is older runs every
+# later migration once when it is first opened. Migrations also run on restored snapshots, which
+# don't record their version, so each must be safe to apply to data it has already been applied to.
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    def register(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+@migration(1, "Give every user sc, exp and level and every other section its canonical shape")
+def _canonical_shapes(data):
+    for section in NORMALIZERS:
+        changed = normalize_section(section, data[section])
+        if changed:
+            log.info("Normalized %d %s entries", changed, section)
+
+@migration(2, "Store mission durations in seconds and build mission_stats from closed missions")
+def _mission_durations(data):
+    # Durations are converted by the mission normalizer
+    normalize_section("active_missions", data["active_missions"])
+    stats = analytics.rebuild(data["active_missions"])
+    data["mission_stats"].clear()
+    data["mission_stats"].update(stats)
+    log.info("Built mission statistics from %d closed missions", stats.get("total", {}).get("completed", 0) + stats.get("total", {}).get("aborted", 0))
+
+def version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def migrate(data, current: int = 0) -> int:
+    """Apply the migrations newer than current to data (a guild's sections); returns the new version"""
+    for number, description, func in MIGRATIONS:
+        if number > current:
+            log.info("Migration %d: %s", number, description)
+            func(data)
+            current = number
+    return current
@@ -0,0 +1,220 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+
+from utils import store, metrics
+from utils.gateway import owns_guild
+
+log = logging.getLogger("bot.snapshots")
+
+SNAPSHOTS_DIR = "data/snapshots"
+CODECS = {"gzip": (".gz", gzip), "lzma": (".xz", lzma)}
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%S%f"
+
+# Retention deletes objects no manifest refers to, so it must not interleave with writing a manifest.
+# This covers the tasks of one process; _locked covers every process sharing the snapshot directory.
+_lock = asyncio.Lock()
+
+# Layout per guild:
+#   <guild>/objects/<sha256>.gz   one compressed JSON section, shared by every snapshot that has that content
+#   <guild>/manifests/<time>.json {"taken": iso time, "sections": {section: object file name}}
+# Deduplication is per section: one changed user means the whole users section is decoded, encoded and
+# stored again. Unchanged sections cost nothing.
+
+def guild_dir(guild_id) -> str:
+    return os.path.join(SNAPSHOTS_DIR, str(guild_id))
+
+def _locked(guild_id):
+    """The guild's snapshot lock file, held exclusively, so another process's retention can't delete an
+    object between _existing_object finding it and a manifest referring to it"""
+    os.makedirs(guild_dir(guild_id), exist_ok=True)
+    return store._locked(guild_dir(guild_id), exclusive=True)
+
+def manifests(guild_id) -> list:
+    """(taken, manifest path) for every snapshot of a guild, oldest first"""
+    directory = os.path.join(guild_dir(guild_id), "manifests")
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        (datetime.datetime.strptime(name[:-5], TIMESTAMP_FORMAT), os.path.join(directory, name))
+        for name in os.listdir(directory) if name.endswith(".json")
+    )
+
+def _read_manifest(path: str) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+def _existing_object(objects_dir: str, digest: str) -> str:
+    for extension, _ in CODECS.values():
+        if os.path.exists(os.path.join(objects_dir, digest + extension)):
+            return digest + extension
+    return None
+
+def capture(guild_id, names=None) -> dict:
+    """Serialize a loaded guild's sections (or just names) on the event loop, so the copy is consistent;
+    None if not loaded. Record sections are only pinned here and decoded by write_snapshot."""
+    data = store.loaded().get(str(guild_id))
+    if data is None:
+        return None
+    sections = {}
+    for name in (names or list(data)):
+        value = data[name]
+        sections[name] = value.frozen() if isinstance(value, store.RecordSection) else json.dumps(value, sort_keys=True)
+    return sections
+
+def write_snapshot(guild_id, sections: dict, compression: str = "gzip", retention=None) -> str:
+    """Hash each section and compress only the ones no earlier snapshot has; returns the manifest path or None
+
+    Runs in a worker thread. Sections left out are carried over from the previous snapshot; with
+    sections=None every section is read from disk instead. With retention=(keep_last, keep_daily), old
+    snapshots are pruned under the same lock.
+    """
+    with _locked(guild_id):
+        path = _write_snapshot(guild_id, sections, compression)
+        if retention:
+            _apply_retention(guild_id, *retention)
+    return path
+
+def _write_snapshot(guild_id, sections: dict, compression: str) -> str:
+    if sections is None:
+        sections = {name: json.dumps(value, sort_keys=True) for name, value in store.read_sections(guild_id).items()}
+
+    extension, codec = CODECS[compression]
+    objects_dir = os.path.join(guild_dir(guild_id), "objects")
+    manifests_dir = os.path.join(guild_dir(guild_id), "manifests")
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(manifests_dir, exist_ok=True)
+
+    previous = manifests(guild_id)
+    last = _read_manifest(previous[-1][1])["sections"] if previous else {}
+    entries = dict(last)
+    written = 0
+    for section, payload in sections.items():
+        if isinstance(payload, tuple):
+            payload = json.dumps(store.read_records(*payload), sort_keys=True)
+        encoded = payload.encode()
+        digest = hashlib.sha256(encoded).hexdigest()
+        # Any earlier snapshot, not just the last, may already hold this content (e.g. after an undo)
+        name = _existing_object(objects_dir, digest)
+        if name is None:
+            name = digest + extension
+            temporary = os.path.join(objects_dir, name + ".tmp")
+            with open(temporary, "wb") as f:
+                f.write(codec.compress(encoded))
+            os.replace(temporary, os.path.join(objects_dir, name))
+            written += 1
+        entries[section] = name
+
+    if entries == last:
+        return None
+    taken = datetime.datetime.now()
+    path = os.path.join(manifests_dir, taken.strftime(TIMESTAMP_FORMAT) + ".json")
+    # Renamed into place, so manifests() never lists a half-written one
+    with open(path + ".tmp", "w") as f:
+        json.dump({"taken": taken.isoformat(), "sections": entries}, f, indent=4)
+    os.replace(path + ".tmp", path)
+    metrics.increment("snapshot_sections_written_total", written)
+    log.info("Snapshot of %s: %d of %d sections changed", guild_id, written, len(entries))
+    return path
+
+def load_snapshot(guild_id, at: datetime.datetime):
+    """(taken, data) of the newest snapshot taken at or before at, or None"""
+    candidates = [(taken, path) for taken, path in manifests(guild_id) if taken <= at]
+    if not candidates:
+        return None
+    taken, path = candidates[-1]
+    objects_dir = os.path.join(guild_dir(guild_id), "objects")
+    data = {}
+    for section, name in _read_manifest(path)["sections"].items():
+        codec = next(codec for extension, codec in CODECS.values() if name.endswith(extension))
+        with open(os.path.join(objects_dir, name), "rb") as f:
+            data[section] = json.loads(codec.decompress(f.read()))
+    return taken, data
+
+def apply_retention(guild_id, keep_last: int, keep_daily: int) -> int:
+    """Keep the newest keep_last snapshots plus the last one of each of the past keep_daily days; returns deleted count"""
+    with _locked(guild_id):
+        return _apply_retention(guild_id, keep_last, keep_daily)
+
+def _apply_retention(guild_id, keep_last: int, keep_daily: int) -> int:
+    snapshots = manifests(guild_id)
+    keep = {path for _, path in snapshots[-keep_last:]} if keep_last else set()
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=keep_daily)
+    last_of_day = {}
+    for taken, path in snapshots:
+        if taken >= cutoff:
+            last_of_day[taken.date()] = path
+    keep.update(last_of_day.values())
+
+    deleted = 0
+    for _, path in snapshots:
+        if path not in keep:
+            os.remove(path)
+            deleted += 1
+    if deleted:
+        # Drop objects no remaining snapshot refers to
+        referenced = set()
+        for path in keep:
+            referenced.update(_read_manifest(path)["sections"].values())
+        objects_dir = os.path.join(guild_dir(guild_id), "objects")
+        for name in os.listdir(objects_dir):
+            if name not in referenced:
+                os.remove(os.path.join(objects_dir, name))
+    return deleted
+
+async def snapshot(guild_id, compression: str = "gzip", names=None, retention=None) -> str:
+    """Snapshot a guild; with names, only those sections are re-read and the rest carried over"""
+    if names and not manifests(guild_id):
+        # Nothing to carry over yet
+        names = None
+    sections = capture(guild_id, names)
+    async with _lock:
+        with metrics.timer("snapshot_seconds"):
+            return await asyncio.to_thread(write_snapshot, guild_id, sections, compression, retention)
+
+async def restore(guild_id, at: datetime.datetime, compression: str = "gzip"):
+    """Replace a guild's data with its snapshot as of at; the current state is snapshotted first so this can be undone.
+
+    There is no write-ahead journal, so restores are to the snapshot itself, not to an arbitrary
+    point between snapshots.
+    """
+    found = await asyncio.to_thread(load_snapshot, guild_id, at)
+    if found is None:
+        return None
+    if os.path.exists(store.path_for(guild_id)) or str(guild_id) in store.loaded():
+        await snapshot(guild_id, compression)
+    taken, data = found
+    store.replace(guild_id, data)
+    log.warning("Restored %s to the snapshot taken %s", guild_id, taken.isoformat())
+    return taken
+
+async def run(bot, settings):
+    """Snapshot every guild of this process's shards saved since the last pass; every such guild with data
+    is covered on the first pass"""
+    interval = settings.get("interval_minutes", 60) * 60
+    compression = settings.get("compression", "gzip")
+    retention = (settings.get("keep_last", 48), settings.get("keep_daily", 14))
+    # guild id -> sections, None for all. Other shards' processes snapshot (and prune) their own guilds.
+    pending = {guild_id: None for guild_id in store.guild_ids() if owns_guild(bot, guild_id)}
+    while True:
+        for guild_id, names in store.take_dirty().items():
+            if not owns_guild(bot, guild_id):
+                continue
+            if guild_id not in pending:
+                pending[guild_id] = set(names)
+            elif pending[guild_id] is not None:
+                pending[guild_id] |= names
+        for guild_id, names in sorted(pending.items()):
+            try:
+                await snapshot(guild_id, compression, names, retention)
+            except Exception:
+                log.exception("Snapshot of %s failed", guild_id)
+                # Retried on the next pass
+                continue
+            del pending[guild_id]
+        await asyncio.sleep(interval)
@@ -0,0 +1,929 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from utils import metrics, schema
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: no locking between processes
+
+log = logging.getLogger("bot.store")
+
+# One directory per guild, loaded on first use and dropped again when idle. Its header.json lists the
+# sections and the schema version the data was migrated to (see utils.schema); each section has files
+# of its own and is read the first time it is used. Writers in any process hold the directory's lock
+# file exclusively while committing; it also holds the commit version, bumped by every save.
+GUILDS_DIR = "data/guilds"
+# The single-guild database from before partitioning
+LEGACY_PATH = "data/database.json"
+SECTIONS = ("users", "roles", "level_roles", "channels", "duty_status", "active_missions", "mission_stats")
+# Sections too large to parse whole: an append-only record file plus an offset index, read through mmap
+RECORD_SECTIONS = ("users",)
+# Numeric fields that are tallies, per section (True: every number in it): changes made to them at the
+# same time by two processes both count. Any other number changed differently on both sides conflicts.
+COUNTERS = {"users": {"sc", "exp"}, "mission_stats": True}
+FORMAT = 1
+LOCK_FILE = ".lock"
+
+# A record file is rewritten once superseded records make up more than this share of it
+COMPACT_RATIO = 0.5
+COMPACT_MIN_BYTES = 1024 * 1024
+# Index entry: record offset, record length (0 marks a deletion), key length; the key bytes follow
+INDEX_ENTRY = struct.Struct("<QIH")
+
+# Guild that inherits LEGACY_PATH. Unset, it is only adopted when the bot is in exactly one guild.
+legacy_guild_id = None
+# How many guilds the bot is in, set once connected; None until then
+guild_count = None
+# For a second instance that only reads (e.g. for reporting): saves are skipped
+read_only = False
+
+_partitions = {}  # guild id -> GuildData
+_last_used = {}  # guild id -> monotonic time of the last load()
+_dirty = {}  # guild id -> sections written since the last take_dirty(), for utils.snapshots
+_legacy_checked = False
+
+class ConflictError(Exception):
+    """Another process committed a different value for something changed here. Nothing was saved and
+    every unsaved change in the guild was dropped, so repeating the change applies it to their data."""
+
+class Record(dict):
+    """A record handed out by a RecordSection; changing it queues it for the next save"""
+    __slots__ = ("_owner", "_key")
+
+    def __init__(self, owner, key: str, values: dict):
+        super().__init__(values)
+        self._owner = owner
+        self._key = key
+
+    def _changed(self):
+        self._owner.changed.add(self._key)
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self._changed()
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self._changed()
+        return super().setdefault(name, default)
+
+    def pop(self, *args):
+        self._changed()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._changed()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+class RecordSection(MutableMapping):
+    """A section stored as one compact JSON record per key; looking a key up decodes that record only"""
+    def __init__(self, directory: str, name: str, generation: int):
+        self.directory = directory
+        self.name = name
+        self.generation = generation
+        self.offsets = {}  # key -> (offset, length) in the record file
+        self.cache = {}  # key -> decoded record
+        self.changed = set()  # keys to write at the next save
+        self.untracked = set()  # keys holding a plain dict whose changes can't be seen; compared at every save
+        self.written = {}  # untracked key -> its encoding as last saved, to tell whether it changed since
+        self.deleted = set()
+        self.assigned = set()  # keys whose pending change sets their counters outright rather than adding to them
+        self.bases = {}  # key -> its encoding on disk when it was read or last saved (None: not on disk)
+        self.size = 0  # bytes in the record file
+        self.index_size = 0  # bytes of the index read so far
+        self.garbage = 0  # bytes of superseded records
+        self._map = None
+        self._read_index()
+
+    def _path(self, extension: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{self.name}-{generation}.{extension}")
+
+    def _read_index(self) -> set:
+        """Apply the index entries past those already read; returns the keys they touch"""
+        try:
+            self.size = os.path.getsize(self._path("records"))
+            with open(self._path("index"), "rb") as f:
+                f.seek(self.index_size)
+                raw = f.read()
+        except FileNotFoundError:
+            return set()
+        keys = set()
+        position = end = 0
+        while position + INDEX_ENTRY.size <= len(raw):
+            offset, length, key_length = INDEX_ENTRY.unpack_from(raw, position)
+            position += INDEX_ENTRY.size + key_length
+            if position > len(raw) or offset + length > self.size:
+                # The tail of a save that was interrupted; the next save writes over it
+                break
+            key = raw[position - key_length:position].decode()
+            if length:
+                self.offsets[key] = (offset, length)
+            else:
+                self.offsets.pop(key, None)
+            keys.add(key)
+            end = position
+        self.index_size += end
+        self.garbage = self.size - sum(length + 1 for _, length in self.offsets.values())
+        return keys
+
+    def sync(self, generation: int) -> int:
+        """Pick up records another process saved since this one last read or wrote. Records changed on both
+        sides are merged (see _merge_value); returns how many couldn't be."""
+        unchanged = {
+            key for key in self.untracked - self.changed
+            if key in self.written and _encode(self.cache[key]) == self.written[key]
+        }
+        pending = (self.changed | self.untracked | self.deleted) - unchanged
+        if generation != self.generation:
+            # Compacted elsewhere: the same records at new offsets, possibly plus newer ones
+            self.close()
+            self.generation = generation
+            self.offsets = {}
+            self.index_size = 0
+        theirs = self._read_index()
+        conflicts = 0
+        for key in theirs:
+            if key not in pending:
+                self._forget(key)
+                continue
+            base = self.bases.get(key, _MISSING)
+            after = self._bytes(key) if key in self.offsets else None
+            if base is _MISSING or after == base:
+                # Unknown base (the section was cleared wholesale) or they didn't change it after all
+                continue
+            mine = _MISSING if key in self.deleted else self.cache[key]
+            try:
+                merged = _merge_value(
+                    _MISSING if base is None else json.loads(base), mine,
+                    _MISSING if after is None else json.loads(after),
+                    () if key in self.assigned else COUNTERS.get(self.name, ())
+                )
+            except ConflictError:
+                conflicts += 1
+                continue
+            self.bases[key] = after
+            if merged is _MISSING:
+                self.cache.pop(key, None)
+                self.changed.discard(key)
+                self.untracked.discard(key)
+                self.deleted.add(key)
+            else:
+                # In place, so callers holding the record keep seeing it
+                dict.clear(mine)
+                dict.update(mine, merged)
+                self.changed.add(key)
+        return conflicts
+
+    def _forget(self, key: str):
+        self.cache.pop(key, None)
+        self.bases.pop(key, None)
+        self.untracked.discard(key)
+        self.written.pop(key, None)
+
+    def discard_changes(self):
+        """Drop every unsaved change; the records are read from disk again when next used"""
+        for key in self.changed | self.untracked | self.deleted:
+            self._forget(key)
+        self.changed.clear()
+        self.deleted.clear()
+        self.assigned.clear()
+
+    def assign(self, key: str):
+        """Mark the pending change to key as setting its counters to exact values (e.g. an admin setting a
+        balance), so a change made elsewhere at the same time conflicts instead of being added to it"""
+        self.assigned.add(key)
+
+    def _base(self, key: str):
+        # Remembered before the first change, for merging with a change made elsewhere at the same time
+        if key not in self.bases:
+            self.bases[key] = self._bytes(key) if key in self.offsets and key not in self.deleted else None
+
+    def _bytes(self, key: str) -> bytes:
+        offset, length = self.offsets[key]
+        if self._map is None or offset + length > len(self._map):
+            # The file grew since it was mapped
+            self.close()
+            with open(self._path("records"), "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __getitem__(self, key: str):
+        record = self.cache.get(key)
+        if record is None:
+            if key not in self.offsets or key in self.deleted:
+                raise KeyError(key)
+            raw = self.bases[key] = self._bytes(key)
+            record = self.cache[key] = Record(self, key, json.loads(raw))
+        return record
+
+    def __setitem__(self, key: str, value: dict):
+        self._base(key)
+        self.cache[key] = value
+        self.deleted.discard(key)
+        self.changed.add(key)
+        if not (isinstance(value, Record) and value._owner is self):
+            self.untracked.add(key)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._base(key)
+        self.cache.pop(key, None)
+        self.changed.discard(key)
+        self.untracked.discard(key)
+        self.written.pop(key, None)
+        if key in self.offsets:
+            self.deleted.add(key)
+
+    def __contains__(self, key) -> bool:
+        return (key in self.cache or key in self.offsets) and key not in self.deleted
+
+    def __iter__(self):
+        for key in list(self.offsets):
+            if key not in self.deleted:
+                yield key
+        for key in [key for key in self.cache if key not in self.offsets]:
+            yield key
+
+    def __len__(self) -> int:
+        return len(self.offsets) - len(self.deleted) + sum(1 for key in self.cache if key not in self.offsets)
+
+    def update(self, *args, **kwargs):
+        """Like dict.update, but the values are copied into tracked records rather than kept by reference"""
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = Record(self, key, value)
+
+    def clear(self):
+        # Without decoding every record, as MutableMapping.clear would
+        self.deleted.update(self.offsets)
+        self.cache.clear()
+        self.changed.clear()
+        self.untracked.clear()
+        self.written.clear()
+
+    def plain(self) -> dict:
+        """Every record, without filling the cache"""
+        return dict(self.stream())
+
+    def stream(self):
+        """(key, record) for every record, each decoded as it is reached and not kept in the cache"""
+        for key in list(self):
+            if key in self.cache:
+                yield key, self.cache[key]
+            elif key in self.offsets and key not in self.deleted:
+                # Looked up again each time: a save between two steps may have moved or deleted it
+                yield key, json.loads(self._bytes(key))
+
+    def evict(self, keys):
+        """Drop saved records from the cache (e.g. after a bulk import); they are read again when next used"""
+        for key in keys:
+            if key not in self.changed and key not in self.untracked and key not in self.deleted:
+                self._forget(key)
+
+    def frozen(self):
+        """(open record file, offsets) as saved now. Saved bytes never change, so a worker thread can
+        read_records() them while the bot keeps appending; the open file outlives a compaction."""
+        return open(self._path("records"), "rb"), dict(self.offsets)
+
+    def flush(self) -> bool:
+        """Append changed records and their index entries; True if anything was written"""
+        entries = []
+        chunks = []
+        offset = self.size
+        for key in self.changed | self.untracked:
+            value = self.cache.get(key)
+            if value is None:
+                continue
+            encoded = _encode(value)
+            if key in self.untracked:
+                self.written[key] = encoded
+            self.bases[key] = encoded
+            if key in self.offsets and self.offsets[key][1] == len(encoded) and self._bytes(key) == encoded:
+                continue
+            chunks.append(encoded + b"\n")
+            entries.append((key, offset, len(encoded)))
+            offset += len(encoded) + 1
+        entries.extend((key, 0, 0) for key in self.deleted)
+        for key in self.deleted:
+            self.bases.pop(key, None)
+        self.changed.clear()
+        self.assigned.clear()
+        self.untracked = {key for key in self.untracked if not isinstance(self.cache.get(key), Record)}
+        self.written = {key: encoded for key, encoded in self.written.items() if key in self.untracked}
+        if not entries:
+            return False
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Records before index entries, so an entry never points past the end of the record file
+        with open(self._path("records"), "ab") as f:
+            f.write(b"".join(chunks))
+        index = b"".join(
+            INDEX_ENTRY.pack(entry_offset, length, len(key.encode())) + key.encode()
+            for key, entry_offset, length in entries
+        )
+        with open(self._path("index"), "r+b" if os.path.exists(self._path("index")) else "wb") as f:
+            # Over the torn tail of an interrupted save, if there is one
+            f.seek(self.index_size)
+            f.write(index)
+            f.truncate()
+        self.size = offset
+        self.index_size += len(index)
+        for key, entry_offset, length in entries:
+            previous = self.offsets.pop(key, None)
+            if previous is not None:
+                self.garbage += previous[1] + 1
+            if length:
+                self.offsets[key] = (entry_offset, length)
+        self.deleted.clear()
+        return True
+
+    def should_compact(self) -> bool:
+        return self.size > COMPACT_MIN_BYTES and self.garbage > self.size * COMPACT_RATIO
+
+    def compact(self) -> tuple:
+        """Copy the live records into the next generation's files; returns the old files, to delete once
+        the header points at the new generation"""
+        generation = self.generation + 1
+        offsets = {}
+        offset = 0
+        with open(self._path("records", generation), "wb") as records, open(self._path("index", generation), "wb") as index:
+            for key in list(self.offsets):
+                encoded = self._bytes(key)
+                records.write(encoded + b"\n")
+                index.write(INDEX_ENTRY.pack(offset, len(encoded), len(key.encode())) + key.encode())
+                offsets[key] = (offset, len(encoded))
+                offset += len(encoded) + 1
+            index_size = index.tell()
+        old = (self._path("records"), self._path("index"))
+        self.close()
+        self.generation = generation
+        self.offsets = offsets
+        self.size = offset
+        self.index_size = index_size
+        self.garbage = 0
+        log.info("Compacted %s to generation %d", self.directory, generation)
+        return old
+
+def _encode(record) -> bytes:
+    return json.dumps(record, separators=(",", ":")).encode()
+
+def read_records(f, offsets: dict) -> dict:
+    """Decode the records at offsets from a record file opened by RecordSection.frozen(), then close it"""
+    with f:
+        if not offsets:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return {key: json.loads(mapped[offset:offset + length]) for key, (offset, length) in offsets.items()}
+
+class GuildData(MutableMapping):
+    """One guild's sections, each read the first time it is used and written only when it changed.
+
+    Saves are compare-and-swap commits: under the guild's exclusive lock, anything another process
+    committed since this one last looked (the commit version moved, or a section file changed) is
+    merged in first, then the changed sections are written and the version is bumped.
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.directory = path_for(key)
+        self.header = {"format": FORMAT, "sections": {}}
+        self._read_header()
+        self.version = 0  # commit version as of the last sync
+        self.version_stamp = None
+        if os.path.isdir(self.directory):
+            with _locked(self.directory, exclusive=False) as lock:
+                self.version = _read_version(lock)
+                self.version_stamp = _stamp(os.fstat(lock.fileno()))
+        self.sections = {}  # loaded sections
+        self.digests = {}  # JSON section -> digest of its file, to skip rewriting unchanged ones
+        self.bases = {}  # JSON section -> file contents last read or written, the base of a three-way merge
+        self.stamps = {}  # JSON section -> file stat when last read or written
+        self.header_changed = False
+
+    @property
+    def schema_version(self) -> int:
+        return self.header.get("schema", 0)
+
+    @schema_version.setter
+    def schema_version(self, version: int):
+        self.header["schema"] = version
+        self.header_changed = True
+
+    def _read_header(self):
+        try:
+            with open(os.path.join(self.directory, "header.json"), "r") as f:
+                disk = json.load(f)
+        except FileNotFoundError:
+            return
+        self.header["sections"].update(disk["sections"])
+        self.header["schema"] = max(self.schema_version, disk.get("schema", 0))
+
+    def __getitem__(self, name: str):
+        section = self.sections.get(name)
+        if section is None:
+            info = self.header["sections"].get(name)
+            if info is None and name not in SECTIONS:
+                raise KeyError(name)
+            with metrics.timer("store_seconds", op="load"):
+                section = self.sections[name] = self._read_section(name, info)
+        return section
+
+    def _read_section(self, name: str, info):
+        if name in RECORD_SECTIONS:
+            # Shared, so a compaction elsewhere can't delete the files between reading the header and the index
+            with _locked(self.directory, exclusive=False):
+                self._read_header()
+                info = self.header["sections"].get(name)
+                return RecordSection(self.directory, name, info["generation"] if info else 0)
+        raw = self._read_file(name)
+        if raw is None:
+            return {}
+        return self._parse(name, raw)
+
+    def _read_file(self, name: str):
+        path = os.path.join(self.directory, f"{name}.json")
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+                stamp = _stamp(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None
+        self.digests[name] = hashlib.sha1(raw).digest()
+        self.bases[name] = raw
+        self.stamps[name] = stamp
+        return raw
+
+    def _parse(self, name: str, raw: bytes):
+        section = json.loads(raw)
+        if self.schema_version:
+            # Small sections are validated whenever they're read; records only when migrated or written
+            try:
+                schema.normalize_section(name, section)
+            except schema.SchemaError as e:
+                raise schema.SchemaError(f"Guild {self.key}: {e}")
+        return section
+
+    def __setitem__(self, name: str, value: dict):
+        if name in RECORD_SECTIONS:
+            section = self[name]
+            section.clear()
+            section.update(value)
+        else:
+            self.sections[name] = value
+
+    def __delitem__(self, name: str):
+        raise TypeError("Sections can't be removed, only emptied")
+
+    def __contains__(self, name) -> bool:
+        return name in SECTIONS or name in self.header["sections"] or name in self.sections
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*SECTIONS, *self.header["sections"], *self.sections]))
+
+    def __len__(self) -> int:
+        return len(dict.fromkeys([*SECTIONS, *self.header["sections"], *self.sections]))
+
+    def to_dict(self) -> dict:
+        """Every section as plain dicts, e.g. to serialize for a worker process"""
+        return {name: self[name].plain() if name in RECORD_SECTIONS else self[name] for name in self}
+
+    def committed_elsewhere(self) -> bool:
+        """Whether another process may have committed since this one last synced (one stat)"""
+        try:
+            return _stamp(os.stat(os.path.join(self.directory, LOCK_FILE))) != self.version_stamp
+        except FileNotFoundError:
+            return False
+
+    def refresh(self):
+        """Merge in what other processes committed, without writing anything"""
+        with _locked(self.directory, exclusive=False) as lock:
+            self._sync(lock)
+
+    def _sync(self, lock):
+        """Bring the loaded sections up to date with disk, merging what was changed on both sides. Raises
+        ConflictError, having dropped every unsaved change, if something can't be merged."""
+        version = _read_version(lock)
+        moved = version != self.version
+        if moved:
+            metrics.increment("store_external_commits_total")
+            self._read_header()
+        conflicted = []
+        for name, section in self.sections.items():
+            if isinstance(section, RecordSection):
+                # Record files are only written by commits, so they can't have changed unless the version did
+                conflicts = section.sync(self.header["sections"].get(name, {}).get("generation", 0)) if moved else 0
+            else:
+                # Checked either way: the file may have been edited by hand
+                conflicts = self._merge_file(name, section)
+            if conflicts:
+                log.warning("Guild %s: %d %s entries were changed differently here and by another process",
+                            self.key, conflicts, name)
+                metrics.increment("store_conflicts_total", conflicts, section=name)
+                conflicted.append(name)
+        self.version = version
+        self.version_stamp = _stamp(os.fstat(lock.fileno())) if lock else None
+        if conflicted:
+            self.discard_changes()
+            raise ConflictError(f"Guild {self.key}: {', '.join(conflicted)} changed by another process at the same time")
+
+    def discard_changes(self):
+        """Reset every loaded section to what is on disk"""
+        for name, section in self.sections.items():
+            if isinstance(section, RecordSection):
+                section.discard_changes()
+            elif name in self.bases:
+                section.clear()
+                section.update(self._parse(name, self.bases[name]))
+            else:
+                section.clear()
+
+    def _merge_file(self, name: str, ours: dict) -> int:
+        """Three-way merge of a JSON section changed on disk since it was read (by another bot process, a
+        script or a text editor), entry by entry with _merge_value; returns how many entries couldn't be"""
+        path = os.path.join(self.directory, f"{name}.json")
+        try:
+            if _stamp(os.stat(path)) == self.stamps.get(name):
+                return 0
+        except FileNotFoundError:
+            return 0
+        base = json.loads(self.bases.get(name, b"{}"))
+        digest = self.digests.get(name)
+        raw = self._read_file(name)
+        if raw is None or self.digests[name] == digest:
+            return 0
+        theirs = self._parse(name, raw)
+        conflicts = 0
+        for key in set(theirs) | set(base):
+            before = base.get(key, _MISSING)
+            after = theirs.get(key, _MISSING)
+            if after == before:
+                continue
+            try:
+                merged = _merge_value(before, ours.get(key, _MISSING), after, COUNTERS.get(name, ()))
+            except ConflictError:
+                conflicts += 1
+                continue
+            if merged is _MISSING:
+                ours.pop(key, None)
+            elif key in ours and isinstance(ours[key], dict) and isinstance(merged, dict):
+                # In place, so callers holding the entry keep seeing it
+                ours[key].clear()
+                ours[key].update(merged)
+            else:
+                ours[key] = merged
+        return conflicts
+
+    def save(self, names=None) -> set:
+        """Commit the loaded sections (or just names) that changed; returns the names written"""
+        if read_only:
+            return set()
+        os.makedirs(self.directory, exist_ok=True)
+        with _locked(self.directory, exclusive=True) as lock:
+            self._sync(lock)
+            written = set()
+            header_changed = self.header_changed
+            old_files = []
+            for name in (names or list(self.sections)):
+                section = self.sections.get(name)
+                if section is None:
+                    continue
+                if isinstance(section, RecordSection):
+                    if section.flush():
+                        written.add(name)
+                    if section.should_compact():
+                        old_files.extend(section.compact())
+                    info = {"type": "records", "generation": section.generation}
+                else:
+                    raw = json.dumps(section, indent=4).encode()
+                    digest = hashlib.sha1(raw).digest()
+                    if digest != self.digests.get(name):
+                        path = os.path.join(self.directory, f"{name}.json")
+                        _write_atomic(path, raw)
+                        self.digests[name] = digest
+                        self.bases[name] = raw
+                        self.stamps[name] = _stamp(os.stat(path))
+                        written.add(name)
+                    info = {"type": "json"}
+                if self.header["sections"].get(name) != info:
+                    self.header["sections"][name] = info
+                    header_changed = True
+
+            if header_changed:
+                _write_atomic(os.path.join(self.directory, "header.json"), json.dumps(self.header, indent=4).encode())
+                self.header_changed = False
+            if written or header_changed:
+                self.version += 1
+                _write_version(lock, self.version)
+                self.version_stamp = _stamp(os.fstat(lock.fileno())) if lock else None
+            # Only once the header points at the compacted files
+            for path in old_files:
+                os.remove(path)
+        return written
+
+    def close(self):
+        for section in self.sections.values():
+            if isinstance(section, RecordSection):
+                section.close()
+
+_MISSING = object()
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _merge_value(base, mine, theirs, counters=()):
+    """Three-way merge of a stored value changed here (mine) and elsewhere (theirs) since base; _MISSING
+    stands for absent. Objects merge field by field; counters (field names, or True for every number) add
+    both changes, so two balance updates to one user both count unless together they'd go below zero.
+    Raises ConflictError where the two changes can't be combined."""
+    if mine == base:
+        return theirs
+    if theirs == base:
+        return mine
+    if base is _MISSING and isinstance(mine, dict) and isinstance(theirs, dict):
+        # Added on both sides (e.g. the same day's mission tally): merged as if both started empty
+        base = {}
+    if isinstance(base, dict) and isinstance(mine, dict) and isinstance(theirs, dict):
+        merged = {}
+        for name in dict.fromkeys([*theirs, *mine]):
+            value = _merge_value(
+                base.get(name, _MISSING), mine.get(name, _MISSING), theirs.get(name, _MISSING),
+                True if counters is True or name in counters else ()
+            )
+            if value is not _MISSING:
+                merged[name] = value
+        return merged
+    if counters is True and _is_number(mine) and _is_number(theirs) and (base is _MISSING or _is_number(base)):
+        merged = theirs + (mine - (0 if base is _MISSING else base))
+        # Two withdrawals that each fit the balance may not fit together; the caller has to check again
+        if merged >= 0 or min(mine, theirs) < 0:
+            return merged
+    elif mine == theirs:
+        return mine
+    raise ConflictError()
+
+VERSION = struct.Struct("<Q")
+
+def _stamp(stat) -> tuple:
+    # A rename replaces the inode, so this changes even when the mtime doesn't
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def _write_atomic(path: str, raw: bytes):
+    """Write to a temporary file and rename it over path, so readers see the old or the new file, never half"""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(raw)
+    os.replace(temporary, path)
+
+def _read_version(lock) -> int:
+    if lock is None:
+        return 0
+    lock.seek(0)
+    raw = lock.read(VERSION.size)
+    return VERSION.unpack(raw)[0] if len(raw) == VERSION.size else 0
+
+def _write_version(lock, version: int):
+    # In place: cheaper than writing a new file, and the lock file's mtime tells readers to refresh
+    lock.seek(0)
+    lock.write(VERSION.pack(version))
+    lock.flush()
+
+@contextmanager
+def _locked(directory: str, exclusive: bool):
+    """The guild's lock file (which also holds its commit version), under an advisory lock shared with
+    every process using this module; None if the directory doesn't exist yet"""
+    if not os.path.isdir(directory):
+        yield None
+        return
+    with os.fdopen(os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT), "r+b") as f:
+        if fcntl is None:
+            yield f
+            return
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def path_for(guild_id) -> str:
+    return os.path.join(GUILDS_DIR, str(guild_id))
+
+def _single_file_path(key: str) -> str:
+    """Where a guild's data lived before it was split into sections"""
+    return os.path.join(GUILDS_DIR, f"{key}.json")
+
+def empty() -> dict:
+    return {section: {} for section in SECTIONS}
+
+def load(guild_id) -> GuildData:
+    """Return the data of one guild; each section is read from disk when first used"""
+    if guild_id is None:
+        raise ValueError("Bot data is stored per server; this needs a server.")
+    key = str(guild_id)
+    _last_used[key] = time.monotonic()
+    data = _partitions.get(key)
+    if data is None:
+        data = _partitions[key] = _open(key)
+    elif data.committed_elsewhere():
+        # Another process committed; one stat per call is the price of noticing
+        data.refresh()
+    return data
+
+def _open(key: str) -> GuildData:
+    if not os.path.isdir(path_for(key)):
+        if not os.path.exists(_single_file_path(key)):
+            _adopt_legacy(key)
+        if os.path.exists(_single_file_path(key)):
+            data = _split(key)
+            if data is not None:
+                return data
+    data = GuildData(key)
+    if data.schema_version < schema.version():
+        _migrate(data)
+    return data
+
+def _migrate(data: GuildData):
+    with metrics.timer("store_seconds", op="migrate"):
+        try:
+            version = schema.migrate(data, data.schema_version)
+        except schema.SchemaError as e:
+            raise schema.SchemaError(f"Guild {data.key}: {e}")
+        data.schema_version = version
+        data.save(list(data))
+    log.info("Migrated guild %s to schema %d", data.key, version)
+
+def migrate_all() -> int:
+    """Bring every guild on disk to the current schema, so no handler pays for it; returns how many moved"""
+    if read_only:
+        return 0
+    migrated = 0
+    for key in guild_ids():
+        if key in _partitions:
+            continue
+        if os.path.isdir(path_for(key)) and GuildData(key).schema_version >= schema.version():
+            continue
+        # Loading migrates; idle eviction drops it again
+        load(key)
+        migrated += 1
+    return migrated
+
+def _split(key: str):
+    """Convert a single-file guild to sections, keeping the old file as .bak. A read-only store can't,
+    so it gets the data in memory instead."""
+    path = _single_file_path(key)
+    with open(path, "r") as f:
+        legacy = json.load(f)
+    data = GuildData(key)
+    for name, section in legacy.items():
+        data[name] = section
+    if read_only:
+        data.schema_version = schema.migrate(data)
+        return data
+    data.save(list(dict.fromkeys([*SECTIONS, *legacy])))
+    data.close()
+    os.replace(path, path + ".bak")
+    log.warning("Split %s into sections under %s", path, path_for(key))
+    return None
+
+def _adopt_legacy(key: str):
+    """Move a pre-partitioning database with any data in it to the guild it belongs to"""
+    global _legacy_checked
+    if read_only or _legacy_checked or not os.path.exists(LEGACY_PATH):
+        return
+    if legacy_guild_id is not None and str(legacy_guild_id) != key:
+        return
+    if legacy_guild_id is None and guild_count != 1:
+        # With several guilds (or before connecting) there's no telling whose data it is; asked again once connected
+        _legacy_checked = guild_count is not None
+        log.warning(
+            "Not adopting %s: the bot is in %s guilds and storage.legacy_guild_id is unset. Set it in "
+            "configuration.json to the ID of the server the data belongs to and restart.",
+            LEGACY_PATH, "an unknown number of" if guild_count is None else guild_count
+        )
+        return
+    _legacy_checked = True
+    with open(LEGACY_PATH, "r") as f:
+        legacy = json.load(f)
+    if not any(legacy.get(section) for section in SECTIONS):
+        return
+    os.makedirs(GUILDS_DIR, exist_ok=True)
+    os.replace(LEGACY_PATH, _single_file_path(key))
+    log.warning("Moved %s to %s", LEGACY_PATH, _single_file_path(key))
+
+def read_sections(guild_id) -> dict:
+    """Every section of a guild as stored on disk, without loading it into the store (safe in a thread)"""
+    key = str(guild_id)
+    if not os.path.isdir(path_for(key)) and os.path.exists(_single_file_path(key)):
+        with open(_single_file_path(key), "r") as f:
+            return json.load(f)
+    data = GuildData(key)
+    try:
+        return data.to_dict()
+    finally:
+        data.close()
+
+def save(guild_id, *sections):
+    """Write what changed in a guild; naming the sections touched skips checking the others"""
+    key = str(guild_id)
+    data = _partitions.get(key)
+    if data is None:
+        return
+    with metrics.timer("store_seconds", op="save"):
+        written = data.save(sections or None)
+    if written:
+        _dirty.setdefault(key, set()).update(written)
+
+def update(guild_id, change, *sections, attempts: int = 3):
+    """Apply change(data) and save it. If another process changed the same entries at the same moment,
+    change runs again on the data they committed. Returns what change returned."""
+    for attempt in range(attempts):
+        result = change(load(guild_id))
+        try:
+            save(guild_id, *sections)
+            return result
+        except ConflictError:
+            if attempt == attempts - 1:
+                raise
+            metrics.increment("store_retries_total")
+
+def replace(guild_id, sections: dict):
+    """Swap in new data for a guild (e.g. a restored snapshot) and save it"""
+    data = load(guild_id)
+    sections = {**{name: {} for name in data}, **sections}
+    # Snapshots don't record their schema version; migrations are safe to re-apply
+    schema.migrate(sections)
+    for name, section in sections.items():
+        data[name] = section
+    save(guild_id)
+
+def take_dirty() -> dict:
+    """Guild id -> sections written since the previous call"""
+    dirty = dict(_dirty)
+    _dirty.clear()
+    return dirty
+
+def reload(guild_id) -> GuildData:
+    data = _partitions.pop(str(guild_id), None)
+    if data is not None:
+        data.close()
+    return load(guild_id)
+
+def guild_ids() -> list:
+    """Every guild with data, loaded or not"""
+    on_disk = set()
+    if os.path.isdir(GUILDS_DIR):
+        for name in os.listdir(GUILDS_DIR):
+            if name.endswith(".json"):
+                on_disk.add(name[:-5])
+            elif os.path.isdir(os.path.join(GUILDS_DIR, name)):
+                on_disk.add(name)
+    return sorted(on_disk | set(_partitions))
+
+def loaded() -> dict:
+    return dict(_partitions)
+
+def evict_idle(max_idle: float) -> int:
+    """Drop guilds not used for max_idle seconds; every change is saved when made, so nothing is lost"""
+    cutoff = time.monotonic() - max_idle
+    idle = [key for key in _partitions if _last_used.get(key, 0) < cutoff]
+    for key in idle:
+        _partitions.pop(key).close()
+        _last_used.pop(key, None)
+    metrics.set_gauge("store_loaded_guilds", len(_partitions))
+    return len(idle)
+
+def reset(guilds_dir: str = None):
+    """Forget every loaded guild, optionally pointing the store at another directory"""
+    global GUILDS_DIR, _legacy_checked
+    if guilds_dir is not None:
+        GUILDS_DIR = guilds_dir
+    for data in _partitions.values():
+        data.close()
+    _partitions.clear()
+    _last_used.clear()
+    _dirty.clear()
+    _legacy_checked = False
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+
+import discord
+from discord import app_commands
+
+STRING_OPTION_TYPE = 3
+
+class TraceRecorder:
+    """Buffers a sanitized record of every app command and appends it to an NDJSON file off the event loop"""
+    def __init__(self, path: str, flush_every: int = 50, flush_interval: float = 5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.task = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.task = asyncio.get_running_loop().create_task(self._flush_periodically())
+
+    def record(self, interaction: discord.Interaction):
+        command = interaction.command
+        if command is None or interaction.type is not discord.InteractionType.application_command:
+            return
+        options = sanitize_options(command, interaction.data.get("options", []))
+        self.buffer.append({
+            "t": interaction.created_at.timestamp(),
+            "command": command.qualified_name,
+            "options": options,
+            "user_id": interaction.user.id,
+            "guild_id": interaction.guild_id
+        })
+        if len(self.buffer) >= self.flush_every:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: list):
+        with open(self.path, "a") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+def sanitize_options(command, options: list) -> list:
+    """Keep IDs, numbers and choice values; free text is reduced to its length"""
+    sanitized = []
+    for option in options:
+        if "options" in option:
+            # Subcommand or group
+            sanitized.append({"name": option["name"], "type": option["type"],
+                              "options": sanitize_options(command, option["options"])})
+            continue
+        value = option.get("value")
+        if option["type"] == STRING_OPTION_TYPE:
+            parameter = command.get_parameter(option["name"]) if isinstance(command, app_commands.Command) else None
+            if not (parameter and parameter.choices):
+                value = {"redacted": len(value or "")}
+        sanitized.append({"name": option["name"], "type": option["type"], "value": value})
+    return sanitized
+
+def read_trace(path: str):
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
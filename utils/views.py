@@ -0,0 +1,30 @@
+import logging
+from discord.ui import View
+from discord import app_commands
+from utils import metrics
+from utils.ratelimit import limiter, cooldown_message, send_error
+
+log = logging.getLogger("bot.views")
+
+class BotView(View):
+    """View base used by every cog so item callbacks are instrumented"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Decorated buttons are created by View.__init__ without going through add_item
+        for item in self.children:
+            metrics.instrument_item(self, item)
+
+    def add_item(self, item):
+        metrics.instrument_item(self, item)
+        return super().add_item(item)
+
+    async def interaction_check(self, interaction) -> bool:
+        # Button presses share the write budget with the commands they stand in for
+        limiter.hit(interaction)
+        return True
+
+    async def on_error(self, interaction, error, item):
+        if isinstance(error, app_commands.CommandOnCooldown):
+            await send_error(interaction, cooldown_message(error.retry_after))
+        else:
+            log.error("Error in %s of %s", item, type(self).__name__, exc_info=error)
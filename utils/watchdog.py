@@ -0,0 +1,80 @@
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from utils import metrics
+
+log = logging.getLogger("bot.watchdog")
+
+COGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Cogs")
+
+class Stall:
+    def __init__(self, duration: float, culprit: str, blocking_at: str, stack: list):
+        self.when = datetime.datetime.now()
+        self.duration = duration
+        self.culprit = culprit  # Innermost cog frame, e.g. "Cogs.levels LevelsCog.get_user_priority"
+        self.blocking_at = blocking_at  # Innermost frame overall, usually inside json or io
+        self.stack = stack
+
+def describe_stack(frame) -> tuple:
+    """Return (culprit, blocking_at, formatted stack) for a frame captured from the loop thread"""
+    summary = traceback.extract_stack(frame)
+    culprit = None
+    walker = frame
+    while walker is not None:
+        if culprit is None and walker.f_code.co_filename.startswith(COGS_DIR):
+            module = os.path.splitext(os.path.basename(walker.f_code.co_filename))[0]
+            culprit = f"Cogs.{module} {walker.f_code.co_qualname}:{walker.f_lineno}"
+        walker = walker.f_back
+    innermost = summary[-1] if summary else None
+    blocking_at = f"{innermost.name} ({os.path.basename(innermost.filename)}:{innermost.lineno})" if innermost else "unknown"
+    return culprit or "outside Cogs", blocking_at, traceback.format_list(summary[-12:])
+
+class Watchdog:
+    """Detects event loop stalls and captures what the loop thread was doing from a helper thread"""
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05, history: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = collections.deque(maxlen=history)
+        self.last_beat = time.monotonic()
+        self.loop_thread = None
+        self.captured = None  # (beat it belongs to, culprit, blocking_at, stack)
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+
+    async def _beat(self):
+        while not self.stopping.is_set():
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            gap = now - self.last_beat - self.interval
+            beat, self.last_beat = self.last_beat, now
+            captured, self.captured = self.captured, None
+            if gap >= self.threshold and captured and captured[0] == beat:
+                self._record(Stall(gap, *captured[1:]))
+
+    def _watch(self):
+        while not self.stopping.wait(self.interval):
+            beat = self.last_beat
+            if self.captured is None and time.monotonic() - beat - self.interval >= self.threshold:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.captured = (beat, *describe_stack(frame))
+
+    def _record(self, stall: Stall):
+        self.stalls.append(stall)
+        metrics.increment("event_loop_stalls_total", culprit=stall.culprit.split(":")[0])
+        log.warning("Event loop blocked for %.0fms in %s at %s", stall.duration * 1000, stall.culprit, stall.blocking_at)